@@ -44,6 +44,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'machinlist.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -71,7 +72,7 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('DB_NAME', 'pm'),
         'USER': os.getenv('DB_USER', 'postgres'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'password'),
@@ -80,6 +81,29 @@ DATABASES = {
     }
 }
 
+# Read replicas as comma-separated host[:port] entries, e.g. DB_REPLICA_HOSTS=db-replica-1,db-replica-2:5433.
+# Each becomes an alias (replica1, replica2, ...) with the primary's credentials. Safe requests read
+# from them through machinlist.db_router; pointing one at the primary's host gives a local two-alias setup.
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    if 'postgresql' in DATABASES['default']['ENGINE']:
+        # Fail over to the primary quickly instead of waiting on an unreachable replica
+        DATABASES[f'replica{index}']['OPTIONS'] = {'connect_timeout': int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', 2))}
+
+DATABASE_ROUTERS = ['machinlist.db_router.PrimaryReplicaRouter']
+
+DATABASE_REPLICAS = {
+    # Seconds a client's reads stay on the primary after it writes (read-your-writes)
+    'PIN_SECONDS': int(os.getenv('DB_REPLICA_PIN_SECONDS', 5)),
+    'RETRY_SECONDS': int(os.getenv('DB_REPLICA_RETRY_SECONDS', 30)),
+}
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
@@ -121,6 +145,79 @@ SIMPLE_JWT = {
 
 CSRF_COOKIE_HTTPONLY = False
 
+# In-process autocomplete index over machine code/name/serial
+MACHINE_TYPEAHEAD = {
+    'MAX_ENTRIES': int(os.getenv('TYPEAHEAD_MAX_ENTRIES', 50000)),
+    'REBUILD_INTERVAL': int(os.getenv('TYPEAHEAD_REBUILD_INTERVAL', 300)),
+}
+
+# Server-sent machine change stream (/api/machines/events/), see machinlist/events.py
+MACHINE_EVENTS = {
+    'POLL_INTERVAL': float(os.getenv('MACHINE_EVENTS_POLL_INTERVAL', 1.0)),
+    'RETENTION_HOURS': int(os.getenv('MACHINE_EVENTS_RETENTION_HOURS', 24)),
+}
+
+# Users with role 'user' and no section/location assignments (MachineAccessScope) see every
+# machine unless this is True; admins always do. See machinlist/scoping.py
+MACHINE_SCOPES_REQUIRED = os.getenv('MACHINE_SCOPES_REQUIRED', 'False') == 'True'
+
+# Append PDF exports to the template as an incremental update instead of re-writing it
+PDF_EXPORT_INCREMENTAL = os.getenv('PDF_EXPORT_INCREMENTAL', 'True') == 'True'
+
+# Persian-capable TTFs for PDF rendering: (name, path) pairs in PDF_FONTS are tried
+# first, then the fonts bundled in PDF_FONT_DIR, then system font paths
+PDF_FONT_DIR = BASE_DIR / 'Files' / 'fonts'
+PDF_FONTS = []
+
+# Concurrency limits for DOCX/PDF export rendering, see machinlist/admission.py.
+# The slots live in the cache, which has to be shared by the workers (see CACHES)
+EXPORT_ADMISSION = {
+    'GLOBAL_LIMIT': int(os.getenv('EXPORT_GLOBAL_LIMIT', 4)),
+    'PER_USER_LIMIT': int(os.getenv('EXPORT_PER_USER_LIMIT', 2)),
+    'RETRY_AFTER': int(os.getenv('EXPORT_RETRY_AFTER', 5)),
+    'RESULT_TTL': int(os.getenv('EXPORT_RESULT_TTL', 60)),
+}
+
+# Shared by every worker through the database by default; create its table once per database with
+# `python manage.py createcachetable`. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with
+# CACHE_LOCATION=redis://host:6379 uses Redis instead. Process-local caches are refused by export admission
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'machinlist_cache'),
+    }
+}
+
+# Machine label sheets (/api/machines/labels/), see machinlist/labels.py for the built-in templates.
+# Streams take export slots from EXPORT_ADMISSION for as long as they run
+MACHINE_LABELS = {
+    'TEMPLATE': os.getenv('MACHINE_LABELS_TEMPLATE', 'a4-3x8'),
+    'CODE_FORMAT': os.getenv('MACHINE_LABELS_CODE_FORMAT', '{machine_code}'),
+    'PAGES_PER_CHUNK': int(os.getenv('MACHINE_LABELS_PAGES_PER_CHUNK', 10)),
+}
+
+# Runtime readings (current, power, pressure, operating hours), see machinlist/readings.py.
+# Run rollup_readings every few minutes and prune_readings daily
+MACHINE_READINGS = {
+    'TOLERANCE': float(os.getenv('READINGS_TOLERANCE', 0.1)),
+    'RAW_RETENTION_DAYS': int(os.getenv('READINGS_RAW_RETENTION_DAYS', 30)),
+    'HOURLY_RETENTION_DAYS': int(os.getenv('READINGS_HOURLY_RETENTION_DAYS', 365)),
+}
+
+# Machine attachments (manuals, nameplate photos, wiring diagrams), see machinlist/attachments.py
+ATTACHMENTS = {
+    'ROOT': os.getenv('ATTACHMENTS_ROOT', str(BASE_DIR / 'media' / 'attachments')),
+    'MAX_SIZE': int(os.getenv('ATTACHMENTS_MAX_SIZE', 512 * 1024 * 1024)),
+    'MAX_CHUNK_SIZE': int(os.getenv('ATTACHMENTS_MAX_CHUNK_SIZE', 8 * 1024 * 1024)),
+    'THUMBNAIL_WORKERS': int(os.getenv('ATTACHMENTS_THUMBNAIL_WORKERS', 2)),
+    # Set with an nginx 'internal' location aliased to ATTACHMENTS_ROOT to serve downloads from nginx
+    'ACCEL_REDIRECT_PREFIX': os.getenv('ATTACHMENTS_ACCEL_REDIRECT_PREFIX') or None,
+}
+
+# Load the docx/reportlab/pypdf export stack when the WSGI/ASGI app is created
+# instead of on the first export request; useful with pre-fork servers (--preload)
+WARM_EXPORT_STACK = os.getenv('WARM_EXPORT_STACK', 'False') == 'True'
+
 CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:5173",
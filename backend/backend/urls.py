@@ -4,9 +4,17 @@ from rest_framework.routers import DefaultRouter
 from machinlist.views import (
     UserViewSet, 
     MachineRegistrationViewSet,
+    ArchivedMachineViewSet,
+    LubricantViewSet,
+    MachineAttachmentViewSet,
+    AttachmentUploadViewSet,
+    MachineReadingViewSet,
+    LocationViewSet,
     CookieTokenObtainPairView,
     CookieTokenRefreshView,
     LogoutView,
+    machine_autocomplete,
+    machine_events,
     export_machine_doc,
     export_machine_pdf
 )
@@ -14,9 +22,17 @@ from machinlist.views import (
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'machines', MachineRegistrationViewSet)
+router.register(r'archived-machines', ArchivedMachineViewSet)
+router.register(r'lubricants', LubricantViewSet)
+router.register(r'attachments', MachineAttachmentViewSet)
+router.register(r'attachment-uploads', AttachmentUploadViewSet)
+router.register(r'readings', MachineReadingViewSet, basename='readings')
+router.register(r'locations', LocationViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/machines/autocomplete/', machine_autocomplete, name='machine_autocomplete'),
+    path('api/machines/events/', machine_events, name='machine_events'),
     path('api/', include(router.urls)),
     path('api/auth/login/', CookieTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/refresh/', CookieTokenRefreshView.as_view(), name='token_refresh'),
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.WARM_EXPORT_STACK:
+    from machinlist.warmup import warm_export_stack
+    warm_export_stack()
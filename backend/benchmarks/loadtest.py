@@ -0,0 +1,303 @@
+"""
+Local load generator for the machine registry API.
+
+Each virtual user logs in through the cookie login endpoint and then replays a
+weighted mix of requests until the run duration elapses. Latency percentiles
+and throughput are reported per endpoint as JSON.
+
+Start a server first, e.g. with a throwaway SQLite database:
+
+    DB_ENGINE=django.db.backends.sqlite3 DB_NAME=/tmp/loadtest.sqlite3 python manage.py migrate
+    DB_ENGINE=django.db.backends.sqlite3 DB_NAME=/tmp/loadtest.sqlite3 python manage.py create_admin --email load@test.local --password load
+    DB_ENGINE=django.db.backends.sqlite3 DB_NAME=/tmp/loadtest.sqlite3 python manage.py runserver --noreload
+
+then run (from the backend directory):
+
+    python benchmarks/loadtest.py --email load@test.local --password load \\
+        --users 20 --duration 60 --seed-machines 200 --output load.json
+
+The mix is given as name=weight pairs, e.g.
+``--mix list=40,detail=30,create=5,update=5,refresh=5,login=2,export_pdf=2,export_doc=1``.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+DEFAULT_MIX = {
+    'list': 40,
+    'detail': 30,
+    'create': 5,
+    'update': 8,
+    'refresh': 5,
+    'login': 2,
+    'export_pdf': 3,
+    'export_doc': 2,
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}', expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def machine_payload(lubricant_count=2):
+    suffix = uuid.uuid4().hex[:10]
+    return {
+        'section': random.choice(['تولید', 'بسته بندی', 'تاسیسات', 'انبار']),
+        'machine_name': f'دستگاه {suffix}',
+        'machine_code': f'LT-{suffix}',
+        'machine_model': f'MD-{suffix}',
+        'machine_serial': f'SN-{suffix}',
+        'manufacture_year': random.randint(1990, 2024),
+        'company_entry_date': '2024-01-15',
+        'criticality_level': random.choice(['low', 'medium', 'high', 'critical']),
+        'location_name': random.choice(['سالن 1', 'سالن 2', 'سالن 3']),
+        'location_code': random.choice(['H1', 'H2', 'H3']),
+        'length_mm': 1200, 'width_mm': 800, 'height_mm': 1500, 'weight_kg': 450,
+        'foundation_type': 'بتنی',
+        'automation_level': 'اتوماتیک',
+        'current_type': 'AC',
+        'phase_count': 3,
+        'nominal_voltage': 380,
+        'nominal_power': round(random.uniform(0.5, 90), 1),
+        'nominal_current': round(random.uniform(1, 150), 1),
+        'electrical_technical_description': 'الکتروموتور سه فاز',
+        'supplier_company_name': 'تامین کننده',
+        'supplier_phone': '021-00000000',
+        'supplier_address': 'تهران',
+        'manufacturer_company_name': 'سازنده',
+        'manufacturer_phone': '021-11111111',
+        'manufacturer_address': 'تبریز',
+        'lubricants': [
+            {'lubricant_type': f'روغن {i}', 'alternative_lubricant_type': f'جایگزین {i}', 'description': ''}
+            for i in range(lubricant_count)
+        ],
+    }
+
+
+class Session:
+    def __init__(self, base_url, email, password):
+        self.base_url = base_url.rstrip('/')
+        self.email = email
+        self.password = password
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return None
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header('Content-Type', 'application/json')
+        token = self.csrf_token()
+        if token:
+            request.add_header('X-CSRFToken', token)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                payload = response.read()
+                return response.status, payload
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self):
+        self.cookies.clear()
+        return self.request('POST', '/api/auth/login/', {'email': self.email, 'password': self.password})
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.bytes = {}
+
+    def record(self, name, seconds, status, size):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+            self.bytes[name] = self.bytes.get(name, 0) + size
+            if status >= 400:
+                self.errors.setdefault(name, {}).setdefault(str(status), 0)
+                self.errors[name][str(status)] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, args, mix, machine_ids, recorder, deadline):
+        super().__init__(daemon=True)
+        self.args = args
+        self.mix = mix
+        self.machine_ids = machine_ids
+        self.recorder = recorder
+        self.deadline = deadline
+        self.session = Session(args.base_url, args.email, args.password)
+        self.own_ids = []
+
+    def timed(self, name, method, path, body=None):
+        start = time.perf_counter()
+        status, payload = self.session.request(method, path, body)
+        self.recorder.record(name, time.perf_counter() - start, status, len(payload))
+        return status, payload
+
+    def pick_id(self):
+        ids = self.machine_ids + self.own_ids
+        return random.choice(ids) if ids else None
+
+    def run(self):
+        self.timed('login', 'POST', '/api/auth/login/', {'email': self.args.email, 'password': self.args.password})
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while time.monotonic() < self.deadline:
+            getattr(self, 'op_' + random.choices(names, weights)[0])()
+            if self.args.think_time:
+                time.sleep(random.uniform(0, 2 * self.args.think_time))
+
+    def op_login(self):
+        self.session.cookies.clear()
+        self.timed('login', 'POST', '/api/auth/login/', {'email': self.args.email, 'password': self.args.password})
+
+    def op_refresh(self):
+        self.timed('refresh', 'POST', '/api/auth/refresh/', {})
+
+    def op_list(self):
+        self.timed('list', 'GET', '/api/machines/')
+
+    def op_detail(self):
+        pk = self.pick_id()
+        if pk is not None:
+            self.timed('detail', 'GET', f'/api/machines/{pk}/')
+
+    def op_create(self):
+        status, payload = self.timed('create', 'POST', '/api/machines/', machine_payload(self.args.lubricants))
+        if status == 201:
+            self.own_ids.append(json.loads(payload)['id'])
+
+    def op_update(self):
+        if not self.own_ids:
+            return self.op_create()
+        self.timed('update', 'PUT', f'/api/machines/{random.choice(self.own_ids)}/', machine_payload(self.args.lubricants))
+
+    def op_export_pdf(self):
+        pk = self.pick_id()
+        if pk is not None:
+            self.timed('export_pdf', 'GET', f'/api/machines/{pk}/export_pdf/')
+
+    def op_export_doc(self):
+        pk = self.pick_id()
+        if pk is not None:
+            self.timed('export_doc', 'GET', f'/api/machines/{pk}/export/')
+
+
+def seed(args):
+    session = Session(args.base_url, args.email, args.password)
+    status, payload = session.login()
+    if status != 200:
+        raise SystemExit(f"Login failed ({status}): {payload[:200]!r}")
+    for _ in range(args.seed_machines):
+        session.request('POST', '/api/machines/', machine_payload(args.lubricants))
+    status, payload = session.request('GET', '/api/machines/')
+    machines = json.loads(payload)
+    if isinstance(machines, dict):
+        machines = machines.get('results', [])
+    return [machine['id'] for machine in machines]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--users', type=int, default=10, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--ramp-up', type=float, default=0, help='Seconds over which users are started')
+    parser.add_argument('--think-time', type=float, default=0, help='Mean pause between requests per user, seconds')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument('--lubricants', type=int, default=2, help='Lubricant rows sent with each create/update')
+    parser.add_argument('--seed-machines', type=int, default=0, help='Machines to create before the run')
+    parser.add_argument('--seed', type=int, help='Random seed')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    machine_ids = seed(args)
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.ramp_up + args.duration
+
+    users = []
+    for i in range(args.users):
+        user = VirtualUser(args, args.mix, machine_ids, recorder, deadline)
+        users.append(user)
+        user.start()
+        if args.ramp_up:
+            time.sleep(args.ramp_up / args.users)
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+
+    endpoints = {}
+    total = 0
+    for name, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        total += len(samples)
+        errors = recorder.errors.get(name, {})
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': sum(errors.values()),
+            'error_statuses': errors,
+            'throughput_rps': len(samples) / elapsed,
+            'bytes_received': recorder.bytes.get(name, 0),
+            'latency_ms': {
+                'mean': 1000 * sum(samples) / len(samples),
+                'p50': 1000 * percentile(samples, 50),
+                'p90': 1000 * percentile(samples, 90),
+                'p95': 1000 * percentile(samples, 95),
+                'p99': 1000 * percentile(samples, 99),
+                'max': 1000 * samples[-1],
+            },
+        }
+
+    report = {
+        'base_url': args.base_url,
+        'users': args.users,
+        'duration_s': elapsed,
+        'mix': args.mix,
+        'machines': len(machine_ids),
+        'requests': total,
+        'throughput_rps': total / elapsed,
+        'endpoints': endpoints,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Startup-time benchmark.
+
+Measures, in fresh interpreter processes, how long ``django.setup()`` takes,
+how long the URLconf (and through it the views) takes to import, and the
+latency of the first request. Also reports whether the document-export stack
+was imported along the way.
+
+Usage (from the backend directory):
+
+    python benchmarks/startup.py --runs 10 --output startup.json
+    python benchmarks/startup.py --settings backend.settings --warmup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXPORT_MODULES = ('docx', 'reportlab', 'pypdf', 'arabic_reshaper', 'bidi')
+
+CHILD = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import django
+t1 = time.perf_counter()
+django.setup()
+t2 = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+t3 = time.perf_counter()
+warmup = None
+if {warmup!r}:
+    from machinlist.warmup import warm_export_stack
+    warmup = warm_export_stack()
+from django.test import Client
+client = Client()
+t4 = time.perf_counter()
+response = client.{method}({path!r})
+t5 = time.perf_counter()
+print(json.dumps({{
+    "import_django": t1 - t0,
+    "django_setup": t2 - t1,
+    "urlconf": t3 - t2,
+    "warmup": warmup,
+    "first_request": t5 - t4,
+    "status": response.status_code,
+    "export_stack_loaded": [m for m in {modules!r} if m in sys.modules],
+}}))
+'''
+
+
+def run_once(settings, path, method, warmup):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings)
+    code = CHILD.format(path=path, method=method, warmup=warmup, modules=EXPORT_MODULES)
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'median': statistics.median(values),
+        'mean': statistics.fmean(values),
+        'max': values[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--settings', default=os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'))
+    parser.add_argument('--path', default='/api/auth/logout/', help='Path for the first request (no auth or DB needed by default)')
+    parser.add_argument('--method', default='post', choices=['get', 'post'])
+    parser.add_argument('--warmup', action='store_true', help='Call warm_export_stack() before the first request')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    samples = [run_once(args.settings, args.path, args.method, args.warmup) for _ in range(args.runs)]
+
+    report = {
+        'runs': args.runs,
+        'settings': args.settings,
+        'path': args.path,
+        'warmup': args.warmup,
+        'export_stack_loaded': samples[-1]['export_stack_loaded'],
+        'status': samples[-1]['status'],
+    }
+    for key in ('import_django', 'django_setup', 'urlconf', 'first_request', 'warmup'):
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        if values:
+            report[key] = summarize(values)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
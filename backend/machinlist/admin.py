@@ -1,7 +1,127 @@
 from django.contrib import admin
-from .models import User
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import User, MachineRegistration, MachineLubricant, MachineAccessScope, MachineAttachment, Location
+from .locations import sync_location_machines
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counting a large table exactly is a full scan on Postgres. For unfiltered
+    changelists the planner's row estimate from pg_class is used instead once
+    it passes ESTIMATE_THRESHOLD; filtered lists and small tables are counted.
+    """
+
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.ESTIMATE_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) the changelist runs to show "x of y"
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class MachineAccessScopeInline(admin.TabularInline):
+    model = MachineAccessScope
+    extra = 0
+
+
 # Register your models here.
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    list_display = ("email", "role", "is_active", "is_staff")
-    list_filter = ("email", "role", "is_active", "is_staff")
\ No newline at end of file
+class UserAdmin(LargeTableAdmin):
+    list_display = ("email", "username", "role", "is_active", "is_staff", "date_joined")
+    list_filter = ("role", "is_active", "is_staff")
+    # startswith is a LIKE prefix, which Postgres serves from the varchar_pattern_ops (<name>_like)
+    # index Django adds beside each unique CharField; icontains would scan every row
+    search_fields = ("email__startswith", "username__startswith")
+    ordering = ("email",)
+    inlines = [MachineAccessScopeInline]
+
+
+class MachineLubricantInline(admin.TabularInline):
+    model = MachineLubricant
+    fields = ("row_number", "lubricant_type", "alternative_lubricant_type", "description", "lubricant", "alternative_lubricant")
+    # Resolved from the free-text columns in MachineLubricant.save
+    readonly_fields = ("lubricant", "alternative_lubricant")
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("lubricant", "alternative_lubricant")
+
+
+class MachineAttachmentInline(admin.TabularInline):
+    model = MachineAttachment
+    fields = ("kind", "filename", "blob", "uploaded_by", "created_at")
+    # Files are added through the resumable upload API, not the admin
+    readonly_fields = ("blob", "uploaded_by", "created_at")
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MachineRegistration)
+class MachineRegistrationAdmin(LargeTableAdmin):
+    list_display = (
+        "machine_code",
+        "machine_name",
+        "section",
+        "location_code",
+        "criticality_level",
+        "company_entry_date",
+        "decommissioned_at",
+    )
+    list_filter = ("criticality_level", "current_type", ("decommissioned_at", admin.EmptyFieldListFilter))
+    search_fields = (
+        "machine_code__startswith",
+        "machine_name__startswith",
+        "machine_serial__startswith",
+        "machine_model__startswith",
+    )
+    date_hierarchy = "company_entry_date"
+    ordering = ("-id",)
+    readonly_fields = ("created_at", "updated_at", "decommissioned_at")
+    raw_id_fields = ("location",)
+    inlines = [MachineLubricantInline, MachineAttachmentInline]
+
+
+@admin.register(MachineLubricant)
+class MachineLubricantAdmin(LargeTableAdmin):
+    list_display = ("machine", "row_number", "lubricant_type", "alternative_lubricant_type", "lubricant")
+    list_select_related = ("machine", "lubricant")
+    search_fields = ("machine__machine_code__startswith",)
+    raw_id_fields = ("machine",)
+    readonly_fields = ("lubricant", "alternative_lubricant")
+    ordering = ("-id",)
+
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "parent", "depth", "path")
+    # Pattern-ops indexes for these come from migration 0015
+    search_fields = ("code__startswith", "name__startswith")
+    raw_id_fields = ("parent",)
+    readonly_fields = ("path", "depth")
+    ordering = ("path",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change:
+            sync_location_machines(obj)
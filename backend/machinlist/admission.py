@@ -0,0 +1,237 @@
+import base64
+import pickle
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+
+DEFAULTS = {
+    'GLOBAL_LIMIT': 4,        # renders in flight across all workers sharing the cache
+    'PER_USER_LIMIT': 2,      # renders in flight per user
+    'LEASE_SECONDS': 60,      # a slot held longer than this (crashed worker) is reclaimed
+    'RETRY_AFTER': 5,         # seconds sent in Retry-After when a request is turned away
+    'RESULT_TTL': 60,         # seconds a finished render is reused for the same machine version
+    'COALESCE_WAIT': 15,      # seconds a request waits for an identical render already in flight
+    'WAIT_LIMIT': 8,          # requests waiting on other renders across all workers; per user, PER_USER_LIMIT
+    'POLL_INTERVAL': 0.1,
+}
+
+KEY_PREFIX = 'machinlist:export'
+
+# Each process has its own copy of these, so their slots would not limit anything across workers
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Deletes KEYS[1] only while it still holds ARGV[1]
+REDIS_RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+def get_export_setting(name):
+    return getattr(settings, 'EXPORT_ADMISSION', {}).get(name, DEFAULTS[name])
+
+
+class ExportRejected(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = get_export_setting('RETRY_AFTER')
+
+
+# Slots
+
+def acquire_slot(name, limit):
+    """
+    Take one of limit slots named name. Each slot is a cache key claimed with
+    the atomic add(), so the semaphore holds across processes as long as the
+    cache backend is shared (database, Redis, Memcached); a process-local
+    cache is refused outside DEBUG. Returns (key, token) or None when every
+    slot is taken.
+    """
+    backend = settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES and not settings.DEBUG:
+        raise ImproperlyConfigured(f'Export admission needs a cache shared by all workers, not {backend}.')
+    token = uuid.uuid4().hex
+    lease = get_export_setting('LEASE_SECONDS')
+    for index in range(limit):
+        key = f'{KEY_PREFIX}:slot:{name}:{index}'
+        if cache.add(key, token, lease):
+            return key, token
+    return None
+
+
+def release_slot(slot):
+    if slot is None:
+        return
+    key, token = slot
+    # Only free the slot if the lease did not expire and pass to someone else meanwhile
+    delete_if_equal(key, token)
+
+
+def delete_if_equal(key, value):
+    """
+    Delete key if it still holds value, as one step on the database and Redis
+    caches so a slot taken over between the check and the delete stays held.
+    """
+    from django.core.cache.backends.db import DatabaseCache
+    from django.core.cache.backends.redis import RedisCache
+
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(backend, DatabaseCache):
+        # Values are stored the way DatabaseCache writes them: pickled, then base64 encoded
+        stored = base64.b64encode(pickle.dumps(value, backend.pickle_protocol)).decode('latin1')
+        connection = connections[router.db_for_write(backend.cache_model_class)]
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote_name(backend._table)} WHERE {quote_name("cache_key")} = %s AND {quote_name("value")} = %s',
+                [backend.make_and_validate_key(key), stored],
+            )
+    elif isinstance(backend, RedisCache):
+        key = backend.make_and_validate_key(key)
+        client = backend._cache.get_client(key, write=True)
+        client.eval(REDIS_RELEASE, 1, key, backend._cache._serializer.dumps(value))
+    elif cache.get(key) == value:
+        cache.delete(key)
+
+
+# Rendering
+
+def acquire_wait_slots(user):
+    """
+    Waiting on another request's render ties up a worker as much as
+    rendering does, so waiters hold slots of their own: per user (else 429)
+    and global (else 503). Returns the slots to release.
+    """
+    user_slot = acquire_slot(f'wait:user:{user.pk}', get_export_setting('PER_USER_LIMIT'))
+    if user_slot is None:
+        raise ExportRejected(429, 'Too many exports in progress for this user.')
+    global_slot = acquire_slot('wait:global', get_export_setting('WAIT_LIMIT'))
+    if global_slot is None:
+        release_slot(user_slot)
+        raise ExportRejected(503, 'Export service is busy.')
+    return [user_slot, global_slot]
+
+
+def admitted_render(kind, version, user, render):
+    """
+    Return the bytes of an export, rendering at most once per (kind, version)
+    at a time. A fresh result is reused, and a request for a version that is
+    being rendered waits (holding a wait slot) for that render instead of
+    starting another. Only new renders take a per-user slot (else 429) and a
+    global slot (else 503).
+    """
+    result_key = f'{KEY_PREFIX}:result:{kind}:{version}'
+    lock_key = f'{KEY_PREFIX}:lock:{kind}:{version}'
+
+    deadline = time.monotonic() + get_export_setting('COALESCE_WAIT')
+    wait_slots = []
+    try:
+        while True:
+            content = cache.get(result_key)
+            if content is not None:
+                return content
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, get_export_setting('LEASE_SECONDS')):
+                break
+            # Someone else is rendering this version; wait for their result
+            if not wait_slots:
+                wait_slots = acquire_wait_slots(user)
+            if time.monotonic() > deadline:
+                raise ExportRejected(503, 'Export is taking longer than expected.')
+            time.sleep(get_export_setting('POLL_INTERVAL'))
+    finally:
+        for slot in wait_slots:
+            release_slot(slot)
+
+    try:
+        user_slot = acquire_slot(f'user:{user.pk}', get_export_setting('PER_USER_LIMIT'))
+        if user_slot is None:
+            raise ExportRejected(429, 'Too many exports in progress for this user.')
+        try:
+            global_slot = acquire_slot('global', get_export_setting('GLOBAL_LIMIT'))
+            if global_slot is None:
+                raise ExportRejected(503, 'Export service is busy.')
+            try:
+                content = render()
+            finally:
+                release_slot(global_slot)
+        finally:
+            release_slot(user_slot)
+        cache.set(result_key, content, get_export_setting('RESULT_TTL'))
+        return content
+    finally:
+        release_slot((lock_key, token))
+
+
+# Streaming
+
+class AdmittedStream:
+    """
+    Iterator over the chunks of a streamed export that holds a per-user slot
+    (else 429) and a global slot (else 503) from creation until it is
+    exhausted or closed. Streams are not coalesced: their content depends on
+    the selection. Every chunk renews the leases, so a long stream keeps its
+    slots past LEASE_SECONDS while a dead worker's still expire.
+    """
+
+    def __init__(self, user, chunks):
+        self.slots = []
+        user_slot = acquire_slot(f'user:{user.pk}', get_export_setting('PER_USER_LIMIT'))
+        if user_slot is None:
+            raise ExportRejected(429, 'Too many exports in progress for this user.')
+        global_slot = acquire_slot('global', get_export_setting('GLOBAL_LIMIT'))
+        if global_slot is None:
+            release_slot(user_slot)
+            raise ExportRejected(503, 'Export service is busy.')
+        self.slots = [user_slot, global_slot]
+        self.chunks = iter(chunks)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.chunks)
+        except BaseException:
+            self.close()
+            raise
+        for key, token in self.slots:
+            cache.touch(key, get_export_setting('LEASE_SECONDS'))
+        return chunk
+
+    def close(self):
+        slots, self.slots = self.slots, []
+        for slot in slots:
+            release_slot(slot)
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+
+
+class AsyncAdmittedStream:
+    """
+    The same stream for ASGI. Django would read a synchronous iterator to the
+    end before sending anything, so chunks are pulled one at a time on the
+    request's sync thread, which owns the database connection (and cursor).
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        from asgiref.sync import sync_to_async
+
+        chunk = await sync_to_async(next, thread_sensitive=True)(self.stream, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        self.stream.close()
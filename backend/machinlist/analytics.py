@@ -0,0 +1,140 @@
+import datetime
+from django.core.cache import cache
+from django.db.models import Max
+from .models import MachineChangeEvent
+
+ANALYTICS_FIELDS = (
+    'manufacture_year',
+    'nominal_power',
+    'nominal_current',
+    'length_mm',
+    'width_mm',
+    'weight_kg',
+    'section',
+    'location_code',
+    'location_name',
+    'criticality_level',
+    'automation_level',
+)
+
+AGE_BINS = (0, 5, 10, 15, 20, 30, 1000)
+CACHE_TIMEOUT = 60 * 60
+
+
+def data_version():
+    # Every machine write appends to the change log, so its head identifies the data
+    return MachineChangeEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def fleet_analytics(queryset, scope_key='all'):
+    version = data_version()
+    cache_key = f'machinlist:fleet-analytics:{scope_key}:{version}'
+    result = cache.get(cache_key)
+    if result is None:
+        result = compute_fleet_analytics(queryset)
+        result['version'] = version
+        cache.set(cache_key, result, CACHE_TIMEOUT)
+    return result
+
+
+def _stats(np, values):
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return {'count': 0, 'sum': 0.0, 'mean': None, 'median': None, 'p90': None, 'min': None, 'max': None}
+    return {
+        'count': int(values.size),
+        'sum': float(values.sum()),
+        'mean': float(values.mean()),
+        'median': float(np.median(values)),
+        'p90': float(np.percentile(values, 90)),
+        'min': float(values.min()),
+        'max': float(values.max()),
+    }
+
+
+def _group_totals(np, keys, weights):
+    # Factorize each key column, combine the codes into one group id, then bincount every metric
+    factors = [(name,) + tuple(np.unique(values, return_inverse=True)) for name, values in keys.items()]
+    combined = np.zeros(len(next(iter(keys.values()))), dtype=np.int64)
+    for _, labels, inverse in factors:
+        combined = combined * labels.size + inverse
+    groups, group_index = np.unique(combined, return_inverse=True)
+
+    counts = np.bincount(group_index, minlength=groups.size)
+    sums = {name: np.bincount(group_index, weights=np.nan_to_num(values), minlength=groups.size) for name, values in weights.items()}
+
+    result = []
+    for i, group in enumerate(groups):
+        entry = {}
+        for name, labels, _ in reversed(factors):
+            group, position = divmod(int(group), labels.size)
+            entry[name] = str(labels[position])
+        entry['count'] = int(counts[i])
+        for name, totals in sums.items():
+            entry[name] = float(totals[i])
+        result.append(entry)
+    return result
+
+
+def compute_fleet_analytics(queryset):
+    import numpy as np
+
+    rows = list(queryset.order_by().values_list(*ANALYTICS_FIELDS))
+    if not rows:
+        return {'machine_count': 0}
+
+    columns = dict(zip(ANALYTICS_FIELDS, zip(*rows)))
+    year = np.array(columns['manufacture_year'], dtype=float)
+    power = np.array(columns['nominal_power'], dtype=float)
+    current = np.array(columns['nominal_current'], dtype=float)
+    length = np.array(columns['length_mm'], dtype=float)
+    width = np.array(columns['width_mm'], dtype=float)
+    weight = np.array(columns['weight_kg'], dtype=float)
+
+    def categorical(name):
+        return np.array(['' if value is None else value for value in columns[name]], dtype=object).astype(str)
+
+    section = categorical('section')
+    criticality = categorical('criticality_level')
+    automation = categorical('automation_level')
+
+    # Age distribution
+    age = datetime.date.today().year - year
+    age_counts, _ = np.histogram(age[~np.isnan(age)], bins=AGE_BINS)
+    age_histogram = [
+        {'from': AGE_BINS[i], 'to': AGE_BINS[i + 1] if i + 2 < len(AGE_BINS) else None, 'count': int(count)}
+        for i, count in enumerate(age_counts)
+    ]
+
+    # Installed power/current by section and location
+    totals = {'nominal_power': power, 'nominal_current': current}
+    by_section = _group_totals(np, {'section': section}, totals)
+    by_location = _group_totals(
+        np,
+        {'location_code': categorical('location_code'), 'location_name': categorical('location_name')},
+        totals,
+    )
+
+    # Criticality x automation cross-tab
+    crit_labels, crit_index = np.unique(criticality, return_inverse=True)
+    auto_labels, auto_index = np.unique(automation, return_inverse=True)
+    crosstab = np.zeros((crit_labels.size, auto_labels.size), dtype=np.int64)
+    np.add.at(crosstab, (crit_index, auto_index), 1)
+
+    return {
+        'machine_count': len(rows),
+        'age': {'histogram': age_histogram, 'stats': _stats(np, age)},
+        'power_by_section': by_section,
+        'power_by_location': by_location,
+        'dimensions': {
+            'weight_kg': _stats(np, weight),
+            'footprint_m2': _stats(np, length * width / 1e6),
+            'length_mm': _stats(np, length),
+            'width_mm': _stats(np, width),
+        },
+        'criticality_by_automation': {
+            'criticality_levels': [str(label) for label in crit_labels],
+            'automation_levels': [str(label) for label in auto_labels],
+            'counts': crosstab.tolist(),
+        },
+    }
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MachinlistConfig(AppConfig):
     name = 'machinlist'
+
+    def ready(self):
+        from . import signals  # noqa: F401
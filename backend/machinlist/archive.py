@@ -0,0 +1,89 @@
+from datetime import datetime
+from django.db import transaction
+from .models import MachineRegistration, MachineLubricant, ArchivedMachine
+from .attachments import attachment_snapshot, restore_attachments
+from .readings import delete_machine_readings
+
+LUBRICANT_FIELDS = ('row_number', 'lubricant_type', 'alternative_lubricant_type', 'description')
+
+
+def machine_snapshot(machine):
+    snapshot = {}
+    for field in machine._meta.concrete_fields:
+        value = field.value_from_object(machine)
+        # DjangoJSONEncoder cuts datetimes to milliseconds; isoformat keeps them exact
+        snapshot[field.attname] = value.isoformat() if isinstance(value, datetime) else value
+    return snapshot
+
+
+def lubricant_snapshot(machine):
+    return [
+        {field: getattr(lubricant, field) for field in LUBRICANT_FIELDS}
+        for lubricant in machine.lubricants.all()
+    ]
+
+
+def archivable_machines(cutoff=None):
+    queryset = MachineRegistration.all_objects.filter(decommissioned_at__isnull=False)
+    if cutoff is not None:
+        queryset = queryset.filter(decommissioned_at__lte=cutoff)
+    return queryset
+
+
+def archive_batch(ids):
+    # Copy one batch of decommissioned machines into the archive and delete them (and, by cascade,
+    # their lubricants and attachments) from the hot tables in the same transaction. Attachment files
+    # stay in the blob store, referenced from the snapshot; readings and rollups are not archived
+    with transaction.atomic():
+        machines = list(
+            MachineRegistration.all_objects
+            .select_for_update()
+            .filter(pk__in=ids, decommissioned_at__isnull=False)
+            .prefetch_related('lubricants', 'attachments')
+        )
+        ArchivedMachine.objects.bulk_create([
+            ArchivedMachine(
+                original_id=machine.pk,
+                section=machine.section,
+                machine_name=machine.machine_name,
+                machine_code=machine.machine_code,
+                machine_serial=machine.machine_serial,
+                location_code=machine.location_code,
+                data=machine_snapshot(machine),
+                lubricants=lubricant_snapshot(machine),
+                attachments=attachment_snapshot(machine),
+                decommissioned_at=machine.decommissioned_at,
+            )
+            for machine in machines
+        ])
+        ids = [machine.pk for machine in machines]
+        delete_machine_readings(ids)
+        MachineRegistration.all_objects.filter(pk__in=ids).delete()
+    return len(machines)
+
+
+def archive_machines(cutoff=None, batch_size=500):
+    archived = 0
+    while True:
+        ids = list(archivable_machines(cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return archived
+        archived += archive_batch(ids)
+
+
+def restore_machine(archived):
+    with transaction.atomic():
+        data = dict(archived.data)
+        data['decommissioned_at'] = None
+        machine = MachineRegistration(**data)
+        machine.save(force_insert=True)
+        # auto_now_add overwrote the original creation time on insert
+        MachineRegistration.all_objects.filter(pk=machine.pk).update(created_at=archived.data['created_at'])
+        machine.refresh_from_db()
+        lubricants = [MachineLubricant(machine=machine, **lubricant) for lubricant in archived.lubricants]
+        for lubricant in lubricants:
+            lubricant.link_catalog()
+        MachineLubricant.objects.bulk_create(lubricants)
+        restore_attachments(machine, archived.attachments)
+        archived.delete()
+    return machine
@@ -0,0 +1,433 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .models import AttachmentBlob, AttachmentUpload, MachineAttachment, ArchivedMachine
+from .thumbnails import THUMBNAIL_EXTENSION, make_thumbnail
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ROOT': None,                    # defaults to <BASE_DIR>/media/attachments
+    'MAX_SIZE': 512 * 1024 * 1024,   # largest file accepted
+    'MAX_CHUNK_SIZE': 8 * 1024 * 1024,
+    'WRITE_LEASE_SECONDS': 300,      # an append that dies mid-chunk releases the upload after this long
+    'UPLOAD_EXPIRY_HOURS': 24,       # unfinished uploads older than this are purged
+    'ORPHAN_GRACE_HOURS': 1,         # unreferenced blobs younger than this are kept
+    'THUMBNAIL_SIZE': 320,
+    'THUMBNAIL_WORKERS': 2,          # processes generate_thumbnails decodes on
+    'ACCEL_REDIRECT_PREFIX': None,   # e.g. '/protected/attachments/' to let nginx send the file
+}
+
+BLOCK_SIZE = 64 * 1024
+
+# Running SHA-256 of uploads this process is receiving, by upload id: (offset hashed up to, hash object)
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+MAX_DIGESTS = 256
+
+SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+# Only these are ever sent inline; anything else is forced to download
+INLINE_TYPES = {'application/pdf', 'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+
+def get_attachment_setting(name):
+    value = getattr(settings, 'ATTACHMENTS', {}).get(name, DEFAULTS[name])
+    if name == 'ROOT' and value is None:
+        value = os.path.join(settings.BASE_DIR, 'media', 'attachments')
+    return value
+
+
+class AttachmentError(Exception):
+    def __init__(self, status, message, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.offset = offset
+
+
+# Paths
+
+def blob_path(sha256):
+    # Fan out over two directory levels so no directory holds more than a few thousand files
+    return os.path.join(get_attachment_setting('ROOT'), 'blobs', sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(sha256):
+    return blob_path(sha256) + THUMBNAIL_EXTENSION
+
+
+def upload_path(upload_id):
+    return os.path.join(get_attachment_setting('ROOT'), 'uploads', f'{upload_id}.part')
+
+
+def sniff_content_type(path, filename):
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Uploads
+
+def _take_digest(upload_id, offset):
+    # The hash of the first offset bytes, if this process received them; None means another worker did
+    if offset == 0:
+        return hashlib.sha256()
+    with _digests_lock:
+        entry = _digests.pop(upload_id, None)
+    if entry is None or entry[0] != offset:
+        return None
+    return entry[1]
+
+
+def _keep_digest(upload_id, offset, digest):
+    with _digests_lock:
+        _digests[upload_id] = (offset, digest)
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+
+
+def start_upload(machine, user, filename, size, kind, sha256=None):
+    """
+    Open a resumable upload. When the client already knows the file's SHA-256
+    and that content is stored, the attachment is created straight away and
+    (None, attachment) is returned; otherwise (upload, None).
+    """
+    if size > get_attachment_setting('MAX_SIZE'):
+        raise AttachmentError(413, f'Files are limited to {get_attachment_setting("MAX_SIZE")} bytes.')
+    if sha256:
+        with transaction.atomic():
+            blob = AttachmentBlob.objects.select_for_update().filter(sha256=sha256.lower(), size=size).first()
+            if blob is not None and os.path.exists(blob_path(blob.sha256)):
+                return None, MachineAttachment.objects.create(
+                    machine=machine, blob=blob, kind=kind, filename=filename, uploaded_by=user
+                )
+    upload = AttachmentUpload.objects.create(machine=machine, user=user, filename=filename, size=size, kind=kind)
+    path = upload_path(upload.pk)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload, None
+
+
+def append_chunk(upload, offset, length, stream):
+    """
+    Append length bytes read from stream at offset, copying BLOCK_SIZE at a time
+    so the chunk never sits in memory. offset must equal what the server has
+    received; a chunk cut short by a dropped connection still counts the bytes
+    that arrived, so the client resumes from the offset it is told.
+
+    The bytes are hashed as they are written. When this process received the
+    whole file, the chunk that completes it also stores it; otherwise the
+    upload is marked complete and generate_thumbnails hashes and stores it,
+    so no request re-reads a whole file. Returns (new offset, attachment or
+    None).
+    """
+    if length > get_attachment_setting('MAX_CHUNK_SIZE'):
+        raise AttachmentError(413, f'Chunks are limited to {get_attachment_setting("MAX_CHUNK_SIZE")} bytes.')
+    if offset + length > upload.size:
+        raise AttachmentError(400, 'Chunk extends past the declared file size.', upload.received)
+
+    # Claim the upload at this offset; a second writer (or a stale offset) gets 409
+    now = timezone.now()
+    lease = now + timedelta(seconds=get_attachment_setting('WRITE_LEASE_SECONDS'))
+    claimed = (
+        AttachmentUpload.objects.filter(pk=upload.pk, received=offset, completed_at__isnull=True, attachment__isnull=True)
+        .exclude(writing_until__gt=now)
+        .update(writing_until=lease)
+    )
+    if not claimed:
+        upload.refresh_from_db(fields=['received'])
+        raise AttachmentError(409, 'Upload offset does not match.', upload.received)
+
+    written = 0
+    attachment = None
+    completed_at = None
+    digest = _take_digest(upload.pk, offset)
+    try:
+        with open(upload_path(upload.pk), 'r+b') as f:
+            # Drop anything past the acknowledged offset left by an interrupted write
+            f.truncate(offset)
+            f.seek(offset)
+            while written < length:
+                block = stream.read(min(BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                f.write(block)
+                if digest is not None:
+                    digest.update(block)
+                written += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+        upload.received = offset + written
+        if upload.received < upload.size:
+            if digest is not None:
+                _keep_digest(upload.pk, upload.received, digest)
+        elif digest is not None:
+            # Still holding the claim, so no other request can finish it twice
+            attachment = finish_upload(upload, digest.hexdigest())
+        else:
+            completed_at = upload.completed_at = timezone.now()
+    finally:
+        AttachmentUpload.objects.filter(pk=upload.pk).update(
+            received=offset + written, writing_until=None, completed_at=completed_at, updated_at=timezone.now()
+        )
+    return offset + written, attachment
+
+
+def _store_part(path, target):
+    # Runs on commit: the row that names target exists by now, and a rolled back finish keeps its part file
+    if target is not None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def finish_upload(upload, sha256=None):
+    """
+    Turn a complete upload into an attachment, hashing the part file unless
+    sha256 is given. The part file is moved into the blob store under its
+    hash, or discarded if that content is already stored, once the
+    transaction commits. The upload keeps a reference to the attachment for
+    the client until it is purged; the thumbnail is left pending for the
+    generate_thumbnails command.
+    """
+    path = upload_path(upload.pk)
+    if os.path.getsize(path) != upload.size:
+        raise AttachmentError(409, 'Upload is incomplete.', upload.received)
+    if sha256 is None:
+        sha256 = hash_file(path)
+
+    with transaction.atomic():
+        # A second finish of the same upload (two commands at once) leaves the first one's attachment
+        finished = AttachmentUpload.objects.select_for_update().filter(pk=upload.pk).values_list('attachment', flat=True).first()
+        if finished is not None:
+            return MachineAttachment.objects.get(pk=finished)
+        # Row lock against purge_attachments removing the blob between the check and the new reference
+        blob = AttachmentBlob.objects.select_for_update().filter(sha256=sha256).first()
+        target = blob_path(sha256)
+        if blob is None or not os.path.exists(target):
+            content_type = sniff_content_type(path, upload.filename)
+            if blob is None:
+                # get_or_create: an identical upload may be finishing at the same moment
+                blob, _ = AttachmentBlob.objects.get_or_create(
+                    sha256=sha256, defaults={'size': upload.size, 'content_type': content_type}
+                )
+            else:
+                blob.thumbnail_status = AttachmentBlob.THUMBNAIL_PENDING
+                blob.save(update_fields=['thumbnail_status'])
+        else:
+            target = None
+        attachment = MachineAttachment.objects.create(
+            machine_id=upload.machine_id, blob=blob, kind=upload.kind, filename=upload.filename, uploaded_by_id=upload.user_id
+        )
+        upload.attachment = attachment
+        upload.save(update_fields=['attachment', 'updated_at'])
+        transaction.on_commit(lambda: _store_part(path, target))
+    return attachment
+
+
+def finish_pending_uploads():
+    """
+    Store the uploads marked complete by a worker that did not hold their
+    running hash, for the generate_thumbnails command. Returns how many were
+    stored.
+    """
+    finished = 0
+    for upload in AttachmentUpload.objects.filter(completed_at__isnull=False, attachment__isnull=True):
+        try:
+            finish_upload(upload)
+        except Exception:
+            logger.exception('Storing upload %s failed', upload.pk)
+            continue
+        finished += 1
+    return finished
+
+
+def abort_upload(upload):
+    path = upload_path(upload.pk)
+    upload.delete()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# Downloads
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    Resolve a single-range Range header to (start, end) inclusive. Returns None
+    when the whole file should be sent (no header, or a multi-range request);
+    raises AttachmentError(416) when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _range_re.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            raise AttachmentError(416, 'Range not satisfiable.')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise AttachmentError(416, 'Range not satisfiable.')
+    return start, end
+
+
+def iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+# Thumbnails
+
+def generate_pending_thumbnails(retry_failed=False, workers=None):
+    """
+    Make the thumbnails of blobs still pending, for the generate_thumbnails
+    command; web workers never decode. Images are decoded in recycled child
+    processes (workers of them, default THUMBNAIL_WORKERS) so a large scan
+    never inflates the command, and statuses are written from this process.
+    Returns {status: count}.
+    """
+    statuses = [AttachmentBlob.THUMBNAIL_PENDING]
+    if retry_failed:
+        statuses.append(AttachmentBlob.THUMBNAIL_FAILED)
+    blobs = list(AttachmentBlob.objects.filter(thumbnail_status__in=statuses).values_list('sha256', 'content_type'))
+    workers = workers or get_attachment_setting('THUMBNAIL_WORKERS')
+    size = get_attachment_setting('THUMBNAIL_SIZE')
+
+    counts = {}
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=20) as pool:
+        futures = [
+            (sha256, pool.submit(make_thumbnail, blob_path(sha256), thumbnail_path(sha256), content_type, size))
+            for sha256, content_type in blobs
+        ]
+        for sha256, future in futures:
+            try:
+                status = AttachmentBlob.THUMBNAIL_READY if future.result() else AttachmentBlob.THUMBNAIL_UNAVAILABLE
+            except Exception:
+                logger.exception('Thumbnail generation failed for %s', sha256)
+                status = AttachmentBlob.THUMBNAIL_FAILED
+            AttachmentBlob.objects.filter(sha256=sha256).update(thumbnail_status=status)
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+# Archive
+
+def attachment_snapshot(machine):
+    return [
+        {'sha256': attachment.blob_id, 'kind': attachment.kind, 'filename': attachment.filename}
+        for attachment in machine.attachments.all()
+    ]
+
+
+def restore_attachments(machine, snapshot):
+    stored = set(AttachmentBlob.objects.filter(sha256__in=[a['sha256'] for a in snapshot]).values_list('sha256', flat=True))
+    MachineAttachment.objects.bulk_create([
+        MachineAttachment(machine=machine, blob_id=a['sha256'], kind=a['kind'], filename=a['filename'])
+        for a in snapshot if a['sha256'] in stored
+    ])
+
+
+# Cleanup
+
+def purge_attachments(expiry_hours=None, grace_hours=None):
+    """
+    Remove uploads untouched for expiry_hours (apart from complete ones still
+    waiting to be stored), and blobs that no attachment or archived machine
+    refers to any more. Returns (uploads removed, blobs removed).
+    """
+    now = timezone.now()
+    if expiry_hours is None:
+        expiry_hours = get_attachment_setting('UPLOAD_EXPIRY_HOURS')
+    if grace_hours is None:
+        grace_hours = get_attachment_setting('ORPHAN_GRACE_HOURS')
+
+    uploads = 0
+    expired = AttachmentUpload.objects.filter(updated_at__lt=now - timedelta(hours=expiry_hours)).exclude(
+        completed_at__isnull=False, attachment__isnull=True
+    )
+    for upload in expired.iterator():
+        abort_upload(upload)
+        uploads += 1
+    # Part files whose upload row went with a deleted machine
+    directory = os.path.dirname(upload_path('x'))
+    if os.path.isdir(directory):
+        cutoff = (now - timedelta(hours=expiry_hours)).timestamp()
+        live = {str(pk) for pk in AttachmentUpload.objects.values_list('pk', flat=True)}
+        for entry in os.scandir(directory):
+            if entry.name.removesuffix('.part') not in live and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                uploads += 1
+
+    archived = set()
+    for snapshot in ArchivedMachine.objects.exclude(attachments=[]).values_list('attachments', flat=True).iterator():
+        archived.update(a['sha256'] for a in snapshot)
+
+    referenced = MachineAttachment.objects.filter(blob=OuterRef('pk'))
+    candidates = (
+        AttachmentBlob.objects.filter(created_at__lt=now - timedelta(hours=grace_hours))
+        .filter(~Exists(referenced))
+        .values_list('sha256', flat=True)
+    )
+    blobs = 0
+    for sha256 in list(candidates):
+        if sha256 in archived:
+            continue
+        with transaction.atomic():
+            blob = AttachmentBlob.objects.select_for_update().filter(sha256=sha256).first()
+            # Re-checked under the lock in case an upload reused the blob meanwhile
+            if blob is None or MachineAttachment.objects.filter(blob=blob).exists():
+                continue
+            blob.delete()
+            for path in (blob_path(sha256), thumbnail_path(sha256)):
+                if os.path.exists(path):
+                    os.remove(path)
+        blobs += 1
+    return uploads, blobs
@@ -0,0 +1,83 @@
+import os
+from django.db import models, transaction
+from django.db.models.deletion import ProtectedError
+from django.utils import timezone
+from .events import record_machine_events
+from .models import MachineRegistration, MachineChangeEvent, AttachmentUpload
+from .attachments import upload_path
+from .typeahead import machine_typeahead
+from .search import refresh_search_documents
+from .readings import delete_machine_readings
+
+
+def select_machines(queryset, ids=None, filters=None):
+    if ids:
+        queryset = queryset.filter(pk__in=ids)
+    if filters:
+        queryset = queryset.filter(**filters)
+    return queryset
+
+
+def bulk_update_machines(queryset, patch):
+    """
+    Apply one field patch to every selected machine with a single UPDATE. The
+    selected rows are locked first so the change events name exactly the rows
+    that were updated. Returns the number of machines updated.
+    """
+    with transaction.atomic():
+        ids = list(queryset.select_for_update().values_list('pk', flat=True))
+        if not ids:
+            return 0
+        updated = MachineRegistration.all_objects.filter(pk__in=ids).update(**patch, updated_at=timezone.now())
+        if set(patch) & set(MachineRegistration.SEARCH_TITLE_FIELDS + MachineRegistration.SEARCH_BODY_FIELDS):
+            refresh_search_documents(ids)
+        # Machine codes, names and serials cannot be patched, so the typeahead index is unaffected
+        record_machine_events(ids, MachineChangeEvent.UPDATED)
+    return updated
+
+
+def _delete_related(ids):
+    # The cascades Django would emulate row by row, done set-based ahead of the raw DELETE
+    for relation in MachineRegistration._meta.related_objects:
+        related = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': ids})
+        if relation.on_delete is models.CASCADE:
+            related.delete()
+        elif relation.on_delete is models.SET_NULL:
+            related.update(**{relation.field.name: None})
+        elif related.exists():
+            raise ProtectedError(f'Machines are referenced by {relation.related_model.__name__}', set(related))
+
+
+def _remove_part_files(upload_ids):
+    for upload_id in upload_ids:
+        path = upload_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _remove_from_typeahead(ids):
+    for pk in ids:
+        machine_typeahead.remove(pk)
+
+
+def bulk_delete_machines(queryset):
+    """
+    Delete every selected machine with one DELETE statement (plus one per
+    related table) instead of loading each machine and sending per-row
+    signals. Readings and rollups (keyed by machine_id, not a foreign key) go
+    too, and part files of unfinished uploads once the delete commits.
+    Returns the number of machines deleted.
+    """
+    with transaction.atomic():
+        ids = list(queryset.select_for_update().values_list('pk', flat=True))
+        if not ids:
+            return 0
+        upload_ids = list(AttachmentUpload.objects.filter(machine_id__in=ids).values_list('pk', flat=True))
+        _delete_related(ids)
+        delete_machine_readings(ids)
+        machines = MachineRegistration.all_objects.filter(pk__in=ids)
+        deleted = machines._raw_delete(machines.db)
+        record_machine_events(ids, MachineChangeEvent.DELETED)
+        transaction.on_commit(lambda: _remove_part_files(upload_ids))
+        transaction.on_commit(lambda: _remove_from_typeahead(ids))
+    return deleted
@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ALIASES': None,         # replica aliases; None means every alias in DATABASES except default
+    'PIN_SECONDS': 5,        # reads stay on the primary this long after the client's last write
+    'RETRY_SECONDS': 30,     # an unreachable replica is skipped for this long
+    'COOKIE_NAME': 'db_pin',
+}
+
+# Per request (or task): whether reads may go to a replica, the replica picked
+# for it once the first read happens, and whether it has written anything
+_replica_allowed = contextvars.ContextVar('replica_allowed', default=False)
+_replica_alias = contextvars.ContextVar('replica_alias', default=None)
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+# DatabaseCache entries: cache reads have to see the latest writes (export slots live there), and
+# writing one is not a change the client needs to read back
+CACHE_APP_LABEL = 'django_cache'
+
+_unavailable = {}  # alias -> monotonic time until which it is skipped
+_unavailable_lock = threading.Lock()
+
+
+def get_replica_setting(name):
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def replica_aliases():
+    aliases = get_replica_setting('ALIASES')
+    if aliases is None:
+        aliases = [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+    return list(aliases)
+
+
+def allow_replica_reads():
+    """Let reads in the current request go to a replica. Returns a token for reset_replica_reads."""
+    return _replica_allowed.set(True), _replica_alias.set(None), _wrote.set(False)
+
+
+def reset_replica_reads(token):
+    allowed, alias, wrote = token
+    _replica_allowed.reset(allowed)
+    _replica_alias.reset(alias)
+    _wrote.reset(wrote)
+
+
+def pin_to_primary():
+    _replica_allowed.set(False)
+
+
+def is_pinned():
+    return not _replica_allowed.get()
+
+
+def has_written():
+    return _wrote.get()
+
+
+def _is_available(alias):
+    with _unavailable_lock:
+        until = _unavailable.get(alias)
+        if until is not None and time.monotonic() < until:
+            return False
+    try:
+        connections[alias].ensure_connection()
+    except OperationalError:
+        logger.warning('Replica %s is unavailable, reading from the primary', alias, exc_info=True)
+        with _unavailable_lock:
+            _unavailable[alias] = time.monotonic() + get_replica_setting('RETRY_SECONDS')
+        return False
+    with _unavailable_lock:
+        _unavailable.pop(alias, None)
+    return True
+
+
+def choose_replica():
+    # One replica per request, so all of its reads see the same replication position
+    alias = _replica_alias.get()
+    if alias is not None:
+        return alias
+    candidates = replica_aliases()
+    random.shuffle(candidates)
+    alias = next((candidate for candidate in candidates if _is_available(candidate)), DEFAULT_DB_ALIAS)
+    _replica_alias.set(alias)
+    return alias
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads to a replica only inside requests the ReplicaRoutingMiddleware
+    marked as safe; everything else (writes, management commands, migrations,
+    requests from recently-writing clients) uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if is_pinned() or not replica_aliases() or model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        # Once a request writes, its remaining reads must see that write
+        pin_to_primary()
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects loaded from either can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
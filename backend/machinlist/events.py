@@ -0,0 +1,371 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from .models import MachineRegistration, MachineChangeEvent
+from .scoping import can_access, get_user_scopes
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'POLL_INTERVAL': 1.0,      # seconds between event-log polls, one poller per process
+    'HEARTBEAT': 15,           # seconds between keep-alive comments
+    'BATCH_SIZE': 200,         # events read (and machines serialized) per poll
+    'MAX_LAG': 5000,           # a client further behind than this gets a reset instead of a replay
+    'QUEUE_SIZE': 50,          # batches queued for a stream before it is reset instead
+    'GAP_WAIT': 2.0,           # seconds a hole in the event ids is waited on before it is skipped
+    'RETENTION_HOURS': 24,     # events older than this are pruned by prune_machine_events
+    'RETRY_MS': 3000,          # reconnect delay suggested to EventSource
+    'WSGI_MAX_DURATION': 60,   # seconds a stream may hold a WSGI worker thread before the client reconnects
+}
+
+
+def get_events_setting(name):
+    return getattr(settings, 'MACHINE_EVENTS', {}).get(name, DEFAULTS[name])
+
+
+# Recording
+
+def record_machine_events(machine_ids, action):
+    # Written once the surrounding transaction commits, so a stream never serializes a half-written machine
+    machine_ids = list(machine_ids)
+    if not machine_ids:
+        return
+    transaction.on_commit(lambda: MachineChangeEvent.objects.bulk_create([
+        MachineChangeEvent(machine_id=machine_id, action=action) for machine_id in machine_ids
+    ]))
+
+
+def prune_events(hours=None):
+    hours = get_events_setting('RETENTION_HOURS') if hours is None else hours
+    cutoff = timezone.now() - timedelta(hours=hours)
+    deleted, _ = MachineChangeEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+# Reading
+
+def latest_cursor():
+    return MachineChangeEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def resolve_cursor(cursor, head):
+    """
+    Returns (cursor, reset) for a stream joining at head. A missing cursor
+    starts at head; a cursor that fell out of retention or too far behind asks
+    the client to refetch the list and continue from head.
+    """
+    bounds = MachineChangeEvent.objects.aggregate(oldest=Min('id'), latest=Max('id'))
+    if cursor is None:
+        return head, False
+    if cursor > (bounds['latest'] or 0):
+        return head, True
+    if head - cursor > get_events_setting('MAX_LAG'):
+        return head, True
+    if bounds['oldest'] is not None and cursor < bounds['oldest'] - 1:
+        return head, True
+    return cursor, False
+
+
+def read_events(cursor, upper=None):
+    """The next batch of (id, machine_id, action) after cursor, up to upper."""
+    rows = MachineChangeEvent.objects.filter(id__gt=cursor)
+    if upper is not None:
+        rows = rows.filter(id__lte=upper)
+    rows = rows.order_by('id').values_list('id', 'machine_id', 'action', 'created_at')[:get_events_setting('BATCH_SIZE')]
+    # Ids are taken when an event is inserted but only become visible when it commits, so a
+    # lower id can show up after a higher one. Reading stops at a hole until it is GAP_WAIT
+    # old; holes left by rolled-back inserts never fill and are then skipped
+    settled = timezone.now() - timedelta(seconds=get_events_setting('GAP_WAIT'))
+    events, previous = [], cursor
+    for event_id, machine_id, action, created_at in rows:
+        if event_id != previous + 1 and created_at > settled:
+            break
+        events.append((event_id, machine_id, action))
+        previous = event_id
+    return events
+
+
+def render_events(events):
+    """
+    Collapse events to the latest one per machine and serialize the machines
+    with one query, ahead of any user. Returns (event_id, action, scope,
+    message, removed) entries: scope is the machine's (section,
+    location_code), or None once it is gone; removed is the message for
+    clients that may not see it.
+    """
+    from .serializers import MachineRegistrationSerializer
+
+    latest = {}
+    for event_id, machine_id, action in events:
+        latest.pop(machine_id, None)
+        latest[machine_id] = (event_id, action)
+
+    live_ids = [machine_id for machine_id, (_, action) in latest.items() if action != MachineChangeEvent.DELETED]
+    machines = {machine.id: machine for machine in MachineRegistration.objects.filter(id__in=live_ids).prefetch_related('lubricants')}
+
+    entries = []
+    for machine_id, (event_id, action) in latest.items():
+        machine = machines.get(machine_id)
+        removed = format_sse({'action': MachineChangeEvent.DELETED, 'id': machine_id}, event='machine', event_id=event_id)
+        if machine is None:
+            entries.append((event_id, action, None, None, removed))
+            continue
+        payload = {'action': action, 'id': machine_id, 'machine': MachineRegistrationSerializer(machine).data}
+        message = format_sse(payload, event='machine', event_id=event_id)
+        entries.append((event_id, action, (machine.section, machine.location_code), message, removed))
+    return entries
+
+
+def messages_for(entries, user=None):
+    # Machines outside the user's scopes are reported as deleted, or skipped if just created
+    messages = []
+    for event_id, action, scope, message, removed in entries:
+        if scope is not None and (user is None or can_access(user, *scope)):
+            messages.append(message)
+        elif action != MachineChangeEvent.CREATED:
+            messages.append(removed)
+    return messages
+
+
+def fetch_events(cursor, user=None, upper=None):
+    """
+    Read the next batch after cursor (up to upper) and return (new_cursor,
+    messages) for user. Streams use it to catch up when they connect; after
+    that the hub reads for them.
+    """
+    events = read_events(cursor, upper)
+    if not events:
+        return cursor, []
+    return events[-1][0], messages_for(render_events(events), user)
+
+
+def format_sse(data=None, event=None, event_id=None, retry=None, comment=None):
+    lines = []
+    if comment is not None:
+        lines.append(f': {comment}')
+    if retry is not None:
+        lines.append(f'retry: {retry}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    if data is not None:
+        lines.append('data: ' + json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+# Fan-out
+
+class EventStream:
+    """
+    One connection's queue of rendered batches. Past QUEUE_SIZE batches the
+    queue is dropped and the stream reset to the hub's position, so a slow
+    client costs a bounded amount of memory. notify wakes the connection.
+    """
+
+    def __init__(self, notify):
+        self._lock = threading.Lock()
+        self._batches = deque()
+        self._reset_to = None
+        self._notify = notify
+
+    def put(self, cursor, entries):
+        with self._lock:
+            if self._reset_to is not None or len(self._batches) >= get_events_setting('QUEUE_SIZE'):
+                self._batches.clear()
+                self._reset_to = cursor
+            else:
+                self._batches.append((cursor, entries))
+        try:
+            self._notify()
+        except RuntimeError:
+            # The connection's event loop is gone; the stream unsubscribes as it closes
+            pass
+
+    def take(self, cursor, user=None):
+        """Returns (new cursor, chunks to send) for everything queued after cursor."""
+        with self._lock:
+            batches, reset_to = list(self._batches), self._reset_to
+            self._batches.clear()
+            self._reset_to = None
+        if reset_to is not None:
+            return reset_to, [format_sse(event='reset', event_id=reset_to, data={'cursor': reset_to})]
+        chunks = []
+        for batch_cursor, entries in batches:
+            if batch_cursor <= cursor:
+                continue
+            chunks.extend(messages_for([entry for entry in entries if entry[0] > cursor], user))
+            cursor = batch_cursor
+        return cursor, chunks
+
+
+class EventHub:
+    """
+    One poller thread per process reads the event log every POLL_INTERVAL
+    and renders each batch once for all open streams, so the database sees
+    one query per interval however many clients are connected. The thread
+    keeps its connection open between polls and exits with the last stream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = set()
+        self._thread = None
+        self.cursor = None
+
+    def subscribe(self, stream):
+        # Returns the cursor after which every batch reaches the stream
+        with self._lock:
+            if self.cursor is None:
+                self.cursor = latest_cursor()
+            self._streams.add(stream)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='machine-events', daemon=True)
+                self._thread.start()
+            return self.cursor
+
+    def unsubscribe(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def poll(self):
+        events = read_events(self.cursor)
+        if not events:
+            return False
+        entries = render_events(events)
+        with self._lock:
+            self.cursor = events[-1][0]
+            streams = list(self._streams)
+        for stream in streams:
+            stream.put(self.cursor, entries)
+        return True
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._streams:
+                        self._thread = None
+                        self.cursor = None
+                        return
+                try:
+                    if self.poll():
+                        continue
+                except Exception:
+                    logger.exception('Reading machine events failed')
+                    # Reconnect on the next poll
+                    connection.close()
+                time.sleep(get_events_setting('POLL_INTERVAL'))
+        finally:
+            connection.close()
+
+
+event_hub = EventHub()
+
+
+# Streams
+
+def _open(cursor, user, stream):
+    """
+    Subscribe stream and replay what the client missed up to the hub's
+    position. Returns (start cursor, reset, replayed messages, cursor). The
+    user's scopes are read here, once per connection.
+    """
+    close_old_connections()
+    try:
+        get_user_scopes(user)
+        head = event_hub.subscribe(stream)
+        try:
+            start, reset = resolve_cursor(cursor, head)
+            cursor, messages = start, []
+            while cursor < head:
+                previous = cursor
+                cursor, batch = fetch_events(cursor, user, upper=head)
+                messages.extend(batch)
+                if cursor == previous:
+                    # Only holes the hub has already skipped remain below head
+                    break
+            return start, reset, messages, max(cursor, head)
+        except BaseException:
+            event_hub.unsubscribe(stream)
+            raise
+    finally:
+        close_old_connections()
+
+
+def _preamble(cursor, reset):
+    yield format_sse(retry=get_events_setting('RETRY_MS'), event_id=cursor, event='ready', data={'cursor': cursor})
+    if reset:
+        yield format_sse(event='reset', event_id=cursor, data={'cursor': cursor})
+
+
+async def stream_events_async(cursor, user=None):
+    """
+    ASGI stream. The connection waits on its queue from the hub and renders
+    nothing itself: each batch is filtered by the user's scopes in memory.
+    """
+    from asgiref.sync import sync_to_async
+
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    stream = EventStream(lambda: loop.call_soon_threadsafe(wake.set))
+    start, reset, replayed, cursor = await sync_to_async(_open, thread_sensitive=False)(cursor, user, stream)
+    try:
+        for chunk in _preamble(start, reset):
+            yield chunk
+        for chunk in replayed:
+            yield chunk
+
+        heartbeat = get_events_setting('HEARTBEAT')
+        last_write = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(wake.wait(), max(heartbeat - (time.monotonic() - last_write), 0))
+            except asyncio.TimeoutError:
+                yield format_sse(comment='keep-alive')
+                last_write = time.monotonic()
+                continue
+            wake.clear()
+            cursor, chunks = stream.take(cursor, user)
+            for chunk in chunks:
+                yield chunk
+            if chunks:
+                last_write = time.monotonic()
+    finally:
+        event_hub.unsubscribe(stream)
+
+
+def stream_events_sync(cursor, user=None):
+    # WSGI fallback: same protocol, but bounded in time because it pins a worker thread
+    wake = threading.Event()
+    stream = EventStream(wake.set)
+    start, reset, replayed, cursor = _open(cursor, user, stream)
+    try:
+        yield from _preamble(start, reset)
+        yield from replayed
+
+        heartbeat = get_events_setting('HEARTBEAT')
+        deadline = time.monotonic() + get_events_setting('WSGI_MAX_DURATION')
+        last_write = time.monotonic()
+        while time.monotonic() < deadline:
+            timeout = min(deadline, last_write + heartbeat) - time.monotonic()
+            if wake.wait(max(timeout, 0)):
+                wake.clear()
+                cursor, chunks = stream.take(cursor, user)
+                yield from chunks
+                if chunks:
+                    last_write = time.monotonic()
+            elif time.monotonic() - last_write >= heartbeat:
+                yield format_sse(comment='keep-alive')
+                last_write = time.monotonic()
+    finally:
+        event_hub.unsubscribe(stream)
@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_FONT = 'Helvetica'
+
+# Glyphs arabic_reshaper emits for Persian text (presentation forms); a font
+# without them renders boxes, so it is skipped rather than registered.
+REQUIRED_GLYPHS = ('\ufe8d', '\ufee1', '\ufbfc', '\ufb8f')
+
+# Tried in order after PDF_FONTS from settings. Bundled fonts live in PDF_FONT_DIR.
+BUNDLED_FONTS = [
+    ('Vazirmatn', 'Vazirmatn-Regular.ttf'),
+    ('Vazir', 'Vazir.ttf'),
+    ('Sahel', 'Sahel.ttf'),
+]
+
+SYSTEM_FONTS = [
+    # Linux
+    ('Vazirmatn', '/usr/share/fonts/truetype/vazirmatn/Vazirmatn-Regular.ttf'),
+    ('Vazirmatn', '/usr/share/fonts/truetype/fonts-vazirmatn/Vazirmatn-Regular.ttf'),
+    ('NotoSansArabic', '/usr/share/fonts/truetype/noto/NotoSansArabic-Regular.ttf'),
+    ('NotoNaskhArabic', '/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf'),
+    ('DejaVuSans', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'),
+    ('FreeSerif', '/usr/share/fonts/truetype/freefont/FreeSerif.ttf'),
+    # Windows
+    ('Tahoma', 'C:/Windows/Fonts/tahoma.ttf'),
+    ('Arial', 'C:/Windows/Fonts/arial.ttf'),
+    ('Segoe UI', 'C:/Windows/Fonts/segoeui.ttf'),
+]
+
+
+def get_font_dir():
+    return getattr(settings, 'PDF_FONT_DIR', os.path.join(settings.BASE_DIR, 'Files', 'fonts'))
+
+
+def font_candidates():
+    candidates = list(getattr(settings, 'PDF_FONTS', []))
+    font_dir = get_font_dir()
+    candidates += [(name, os.path.join(font_dir, filename)) for name, filename in BUNDLED_FONTS]
+    candidates += SYSTEM_FONTS
+    return candidates
+
+
+class FontRegistry:
+    """
+    Resolves the Persian-capable TTF used by the PDF renderers once per process.
+
+    The parsed TTFont is registered with reportlab a single time, so its face
+    tables and glyph metrics are shared by every later render instead of
+    re-reading the font file per request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._font_name = None
+
+    def get_font_name(self):
+        if self._font_name is None:
+            with self._lock:
+                if self._font_name is None:
+                    self._font_name = self._resolve()
+        return self._font_name
+
+    def reset(self):
+        with self._lock:
+            self._font_name = None
+
+    def _resolve(self):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        for font_name, font_path in font_candidates():
+            if not os.path.exists(font_path):
+                continue
+            if font_name in pdfmetrics.getRegisteredFontNames():
+                return font_name
+            try:
+                font = TTFont(font_name, font_path)
+            except Exception as e:
+                logger.warning("Error registering font %s from %s: %s", font_name, font_path, e)
+                continue
+            missing = [glyph for glyph in REQUIRED_GLYPHS if ord(glyph) not in font.face.charToGlyph]
+            if missing:
+                logger.warning("Font %s at %s has no Persian glyphs, skipping", font_name, font_path)
+                continue
+            pdfmetrics.registerFont(font)
+            logger.info("Using font %s from %s for PDF rendering", font_name, font_path)
+            return font_name
+
+        logger.error(
+            "No Persian-capable TTF found (checked PDF_FONTS, %s and system font paths); "
+            "falling back to %s, Persian text will not render",
+            get_font_dir(), FALLBACK_FONT,
+        )
+        return FALLBACK_FONT
+
+
+font_registry = FontRegistry()
@@ -0,0 +1,220 @@
+import io
+import unicodedata
+import zipfile
+from bidi.algorithm import get_display
+from pypdf import PdfReader
+
+# Kept in step with pdf_utils.render_machine_overlay: the right edge (values are
+# drawn right-aligned) and baseline of every value printed on the form.
+FIELD_ANCHORS = {
+    'machine_name': (475, 640),
+    'machine_code': (325, 640),
+    'machine_model': (210, 640),
+    'machine_serial': (77, 640),
+    'manufacture_year': (475, 615),
+    'company_entry_date': (300, 615),
+    'installation_date': (202, 615),
+    'criticality_level': (77, 615),
+    'location_name': (475, 590),
+    'location_code': (77, 590),
+    'length_mm': (525, 547),
+    'width_mm': (460, 547),
+    'height_mm': (380, 547),
+    'weight_kg': (320, 547),
+    'guarantee_expiry_date': (205, 526),
+    'warranty_expiry_date': (74, 526),
+    'current_type': (530, 445),
+    'phase_count': (465, 445),
+    'nominal_voltage': (400, 445),
+    'nominal_power': (335, 445),
+    'nominal_current': (265, 445),
+    'electrical_technical_description': (215, 445),
+    'maximum_consumption': (460, 394),
+    'operating_pressure': (220, 394),
+    'supplier_company_name': (440, 146),
+    'supplier_phone': (440, 120),
+    'supplier_address': (440, 90),
+    'manufacturer_company_name': (200, 146),
+    'manufacturer_phone': (200, 120),
+    'manufacturer_address': (200, 80),
+}
+
+LUBRICANT_ROWS = 5
+LUBRICANT_TOP = 325
+LUBRICANT_ROW_HEIGHT = 20
+LUBRICANT_ANCHORS = {
+    'row_number': 540,
+    'lubricant_type': 460,
+    'alternative_lubricant_type': 310,
+    'description': 160,
+}
+
+# (x, y) where a checkmark stroke starts -> (field, value)
+CHECKMARKS = {
+    (168, 550): ('foundation_type', 'بتنی'),
+    (103, 550): ('foundation_type', 'پیش ساخته'),
+    (66, 550): ('foundation_type', 'ندارد'),
+    (323, 530): ('automation_level', 'اتوماتیک'),
+    (371, 530): ('automation_level', 'نیمه اتوماتیک'),
+    (440, 530): ('automation_level', 'دستی'),
+    (257, 530): ('has_guarantee', True),
+    (138, 530): ('has_warranty', True),
+}
+
+BASELINE_TOLERANCE = 3
+CHECKMARK_TOLERANCE = 2
+
+# Arabic presentation forms (what arabic_reshaper emits) fold back to the base letters under NFKC
+PRESENTATION_FORMS = (('ﭐ', '﷿'), ('ﹰ', '﻿'))
+
+
+def _anchors():
+    anchors = dict(FIELD_ANCHORS)
+    for row in range(LUBRICANT_ROWS):
+        y = LUBRICANT_TOP - row * LUBRICANT_ROW_HEIGHT
+        for column, x in LUBRICANT_ANCHORS.items():
+            anchors[(row, column)] = (x, y)
+    return anchors
+
+
+def build_field_boxes():
+    """
+    Bounding box (x0, y0, x1, y1) per field. A right-aligned value starts left
+    of its anchor, so a box spans from the next anchor on the same baseline to
+    its own anchor.
+    """
+    rows = {}
+    for key, (x, y) in _anchors().items():
+        rows.setdefault(y, []).append((x, key))
+
+    boxes = {}
+    for y, cells in rows.items():
+        cells.sort()
+        left = 0
+        for x, key in cells:
+            boxes[key] = (left, y - BASELINE_TOLERANCE, x + 2, y + BASELINE_TOLERANCE)
+            left = x
+    return boxes
+
+
+FIELD_BOXES = build_field_boxes()
+
+
+def _is_rtl(text):
+    return any(unicodedata.bidirectional(char) in ('R', 'AL') for char in text)
+
+
+def unshape(segments):
+    """
+    Turn the pieces pypdf extracts from one drawn string back into logical text.
+
+    The form is written with arabic_reshaper + get_display, i.e. in visual order
+    with presentation-form glyphs. pypdf hands back right-to-left runs reversed
+    and left-to-right runs as drawn, so the visual line is rebuilt first, then
+    the bidi reordering is undone and the glyphs are folded to plain letters.
+    """
+    visual = ''.join(segment[::-1] if _is_rtl(segment) else segment for segment in segments)
+    text = get_display(visual, base_dir='R') if _is_rtl(visual) else visual
+    text = ''.join(
+        unicodedata.normalize('NFKC', char) if any(lo <= char <= hi for lo, hi in PRESENTATION_FORMS) else char
+        for char in text
+    )
+    return ' '.join(text.split())
+
+
+def _page_marks(page):
+    # Strings grouped by the point they were drawn at, plus the start of every stroke
+    strings = {}
+    strokes = set()
+
+    def visit_text(text, cm, tm, font_dict, font_size):
+        if not text.strip():
+            return
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        strings.setdefault((round(x, 1), round(y, 1)), []).append(text.rstrip('\n'))
+
+    def visit_operand(operator, operands, cm, tm):
+        if operator == b'm' and len(operands) == 2:
+            x, y = float(operands[0]), float(operands[1])
+            strokes.add((round(cm[0] * x + cm[2] * y + cm[4]), round(cm[1] * x + cm[3] * y + cm[5])))
+
+    page.extract_text(visitor_text=visit_text, visitor_operand_before=visit_operand)
+    return strings, strokes
+
+
+def template_marks(template_path):
+    """Printed labels and table rules of the blank form, ignored when reading filled copies."""
+    strings, strokes = _page_marks(PdfReader(template_path).pages[0])
+    return frozenset((position, tuple(segments)) for position, segments in strings.items()), frozenset(strokes)
+
+
+def _field_at(x, y):
+    for key, (x0, y0, x1, y1) in FIELD_BOXES.items():
+        if x0 <= x < x1 and y0 <= y <= y1:
+            return key
+    return None
+
+
+def _checkmark_at(x, y):
+    for (cx, cy), choice in CHECKMARKS.items():
+        if abs(cx - x) <= CHECKMARK_TOLERANCE and abs(cy - y) <= CHECKMARK_TOLERANCE:
+            return choice
+    return None
+
+
+def _open(source):
+    # source is a file path or a (zip path, member name) pair
+    if isinstance(source, tuple):
+        archive_path, member = source
+        with zipfile.ZipFile(archive_path) as archive:
+            return PdfReader(io.BytesIO(archive.read(member)))
+    return PdfReader(source)
+
+
+def extract_form(source, template=(frozenset(), frozenset())):
+    """
+    Read the values written on the first page of a filled form.
+
+    Returns {'fields': {name: text}, 'lubricants': [{column: text}], 'checks':
+    {field: value}, 'error': message or None}. Runs in worker processes, so it
+    only touches the PDF and never the database.
+    """
+    template_strings, template_strokes = template
+    result = {'fields': {}, 'lubricants': [], 'checks': {}, 'error': None}
+    try:
+        reader = _open(source)
+        if not reader.pages:
+            result['error'] = 'PDF has no pages'
+            return result
+        strings, strokes = _page_marks(reader.pages[0])
+    except Exception as e:
+        result['error'] = f'Cannot read PDF: {e}'
+        return result
+
+    lubricants = {}
+    for (x, y), segments in strings.items():
+        if ((x, y), tuple(segments)) in template_strings:
+            continue
+        key = _field_at(x, y)
+        if key is None:
+            continue
+        value = unshape(segments)
+        if not value:
+            continue
+        if isinstance(key, tuple):
+            row, column = key
+            lubricants.setdefault(row, {})[column] = value
+        else:
+            result['fields'][key] = value
+
+    for x, y in strokes - template_strokes:
+        choice = _checkmark_at(x, y)
+        if choice is not None:
+            field, value = choice
+            result['checks'].setdefault(field, value)
+
+    result['lubricants'] = [lubricants[row] for row in sorted(lubricants)]
+    if not result['fields'] and not result['checks']:
+        result['error'] = 'No filled-in values found (scanned forms need OCR first)'
+    return result
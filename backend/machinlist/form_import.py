@@ -0,0 +1,313 @@
+import csv
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import jdatetime
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .events import record_machine_events
+from .form_extraction import extract_form, template_marks
+from .models import MachineRegistration, MachineLubricant, MachineChangeEvent
+from .pdf_utils import get_template_path
+from .serializers import MachineRegistrationSerializer
+from .typeahead import machine_typeahead
+
+REPORT_FIELDS = ['file', 'status', 'machine_code', 'message']
+MAX_MEMBER_BYTES = 20 * 1024 * 1024
+# Forms accepted through the API, where they are parsed inline on the request;
+# larger batches go through the import_machine_forms command, which parses on a process pool
+API_MAX_FILES = 50
+
+# Placeholders the exporter prints for empty values
+EMPTY_VALUES = ('', 'None', '-')
+DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+
+PHASES = {'تک فاز': 1, 'سه فاز': 3}
+CRITICALITY_LABELS = {
+    'کم': 'low',
+    'پایین': 'low',
+    'متوسط': 'medium',
+    'زیاد': 'high',
+    'بالا': 'high',
+    'بحرانی': 'critical',
+}
+DATE_FIELDS = ('company_entry_date', 'installation_date', 'guarantee_expiry_date', 'warranty_expiry_date')
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+DATE_RE = re.compile(r'(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})')
+
+
+class FormImportError(Exception):
+    pass
+
+
+# Sources
+
+def collect_sources(path):
+    """
+    PDF files to read from a folder (recursively), a ZIP archive or a single
+    PDF. Returns (label, source, size) triples; ZIP members are read by the
+    workers.
+    """
+    if os.path.isdir(path):
+        sources = []
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.lower().endswith('.pdf'):
+                    full = os.path.join(root, name)
+                    sources.append((os.path.relpath(full, path), full, os.path.getsize(full)))
+        return sorted(sources)
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return [
+                (info.filename, (path, info.filename), info.file_size)
+                for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith('.pdf')
+            ]
+
+    return [(os.path.basename(path), path, os.path.getsize(path))]
+
+
+def extract_forms(sources, workers=1):
+    # Parsing PDFs is CPU-bound; the command spreads it over a process pool (workers=None: CPU count),
+    # like password hashing in user_import. Never from a web worker, which must not fork
+    template_path = get_template_path()
+    template = template_marks(template_path) if os.path.exists(template_path) else (frozenset(), frozenset())
+    extract = partial(extract_form, template=template)
+
+    if workers == 1 or len(sources) < 2:
+        return [extract(source) for source in sources]
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(sources) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(extract, sources, chunksize=chunksize))
+
+
+# Values
+
+def _clean(value):
+    value = (value or '').translate(DIGITS).strip()
+    return '' if value in EMPTY_VALUES else value
+
+
+def _number(value):
+    match = NUMBER_RE.search(value.replace(',', ''))
+    return match.group() if match else value
+
+
+def _date(value):
+    # The exporter prints ISO dates; hand-filled archive forms use the Jalali calendar
+    match = DATE_RE.search(value)
+    if match is None:
+        return value
+    year, month, day = (int(part) for part in match.groups())
+    if year < 1700:
+        try:
+            return jdatetime.date(year, month, day).togregorian().isoformat()
+        except ValueError:
+            return value
+    return f'{year:04d}-{month:02d}-{day:02d}'
+
+
+def form_data(extracted):
+    """Map extracted text to serializer input. Empty fields are left out."""
+    data = {}
+    for field, raw in extracted['fields'].items():
+        value = _clean(raw)
+        if not value:
+            continue
+        if field == 'phase_count':
+            value = PHASES.get(value, _number(value))
+        elif field == 'criticality_level':
+            value = CRITICALITY_LABELS.get(value, value.lower())
+        elif field == 'current_type':
+            value = value.upper()
+        elif field in DATE_FIELDS:
+            value = _date(value)
+        elif field in ('manufacture_year', 'length_mm', 'width_mm', 'height_mm', 'weight_kg', 'nominal_voltage',
+                       'nominal_power', 'nominal_current', 'maximum_consumption', 'operating_pressure'):
+            value = _number(value)
+        data[field] = value
+
+    data.update(extracted['checks'])
+    # An expiry date on the form implies the box was ticked
+    if data.get('guarantee_expiry_date'):
+        data['has_guarantee'] = True
+    if data.get('warranty_expiry_date'):
+        data['has_warranty'] = True
+
+    lubricants = []
+    for row in extracted['lubricants']:
+        lubricant = {
+            column: _clean(row.get(column)) or None
+            for column in ('lubricant_type', 'alternative_lubricant_type', 'description')
+        }
+        if any(lubricant.values()):
+            lubricants.append(lubricant)
+    if lubricants:
+        data['lubricants'] = lubricants
+    return data
+
+
+def _errors(detail, prefix=''):
+    if isinstance(detail, dict):
+        return [message for key, value in detail.items() for message in _errors(value, f'{prefix}{key}: ')]
+    if isinstance(detail, list):
+        return [message for item in detail for message in _errors(item, prefix)]
+    return [f'{prefix}{detail}']
+
+
+# Writing
+
+def _upsert_typeahead(machines):
+    for machine in machines:
+        machine_typeahead.upsert(machine)
+
+
+def _save_batch(rows):
+    """
+    Upsert one batch of validated rows. New machines go in with bulk_create,
+    existing ones with bulk_update, and the lubricant tables of machines whose
+    form has lubricant rows are replaced. Signals do not fire for bulk writes,
+    so the typeahead index and change-event log are updated here.
+    """
+    created = [row for row in rows if row['instance'] is None]
+    updated = [row for row in rows if row['instance'] is not None]
+
+    with transaction.atomic():
+        for row in created:
+            row['machine'] = MachineRegistration(**row['values'])
+            row['machine'].update_search_documents()
+        MachineRegistration.objects.bulk_create([row['machine'] for row in created])
+
+        fields = set()
+        now = timezone.now()
+        for row in updated:
+            row['machine'] = row['instance']
+            for attr, value in row['values'].items():
+                setattr(row['machine'], attr, value)
+                fields.add(attr)
+            row['machine'].updated_at = now
+            row['machine'].update_search_documents()
+        if updated:
+            MachineRegistration.objects.bulk_update(
+                [row['machine'] for row in updated], sorted(fields | {'updated_at', 'search_title', 'search_body'})
+            )
+
+        replaced = [row for row in rows if row['lubricants']]
+        MachineLubricant.objects.filter(machine__in=[row['machine'] for row in replaced if row['instance'] is not None]).delete()
+        lubricants = []
+        for row in replaced:
+            for number, data in enumerate(row['lubricants'], start=1):
+                lubricant = MachineLubricant(machine=row['machine'], row_number=number, **data)
+                lubricant.link_catalog()
+                lubricants.append(lubricant)
+        MachineLubricant.objects.bulk_create(lubricants)
+
+        record_machine_events([row['machine'].pk for row in created], MachineChangeEvent.CREATED)
+        record_machine_events([row['machine'].pk for row in updated], MachineChangeEvent.UPDATED)
+
+    machines = [row['machine'] for row in rows]
+    transaction.on_commit(lambda: _upsert_typeahead(machines))
+
+
+def _save_rows(rows, report):
+    try:
+        _save_batch(rows)
+    except IntegrityError:
+        # Another writer took one of the unique values; fall back to one row at a time for this batch
+        for row in rows:
+            try:
+                row['serializer'].save()
+            except IntegrityError as e:
+                report.append({'file': row['file'], 'status': 'error', 'machine_code': row['code'], 'message': str(e)})
+            else:
+                report.append({'file': row['file'], 'status': row['status'], 'machine_code': row['code'], 'message': ''})
+        return
+    report.extend(
+        {'file': row['file'], 'status': row['status'], 'machine_code': row['code'], 'message': ''} for row in rows
+    )
+
+
+def import_machine_forms(path, workers=1, batch_size=200, update_existing=True, default_section=None, max_files=None):
+    """
+    Read every filled form under path (folder, ZIP or single PDF) and upsert
+    the machines by machine_code. Returns one report entry per file, in file
+    order, with status created, updated, skipped or error. default_section
+    fills the section of new machines, which the printed form does not carry.
+    Raises FormImportError when path holds more than max_files forms.
+    """
+    sources = collect_sources(path)
+    if max_files is not None and len(sources) > max_files:
+        raise FormImportError(f'At most {max_files} forms can be imported at once; use the import_machine_forms command for larger batches')
+    report = []
+
+    readable = []
+    for label, source, size in sources:
+        if size > MAX_MEMBER_BYTES:
+            report.append({'file': label, 'status': 'error', 'machine_code': '', 'message': 'File is too large'})
+        else:
+            readable.append((label, source))
+
+    extracted = extract_forms([source for _, source in readable], workers=workers)
+
+    parsed, seen = [], set()
+    for (label, _), result in zip(readable, extracted):
+        if result['error']:
+            report.append({'file': label, 'status': 'error', 'machine_code': '', 'message': result['error']})
+            continue
+        data = form_data(result)
+        code = data.get('machine_code', '')
+        if not code:
+            report.append({'file': label, 'status': 'error', 'machine_code': '', 'message': 'Machine code not found on form'})
+        elif code in seen:
+            report.append({'file': label, 'status': 'error', 'machine_code': code, 'message': 'Duplicate machine code in upload'})
+        else:
+            seen.add(code)
+            parsed.append((label, code, data))
+
+    for start in range(0, len(parsed), batch_size):
+        batch = parsed[start:start + batch_size]
+        existing = MachineRegistration.all_objects.in_bulk([code for _, code, _ in batch], field_name='machine_code')
+
+        rows = []
+        for label, code, data in batch:
+            instance = existing.get(code)
+            if instance is not None and not update_existing:
+                report.append({'file': label, 'status': 'skipped', 'machine_code': code, 'message': 'Machine already exists'})
+                continue
+            if instance is not None and instance.decommissioned_at is not None:
+                report.append({'file': label, 'status': 'skipped', 'machine_code': code, 'message': 'Machine is decommissioned'})
+                continue
+
+            if instance is None and default_section:
+                data['section'] = default_section
+            serializer = MachineRegistrationSerializer(instance=instance, data=data, partial=instance is not None)
+            if not serializer.is_valid():
+                report.append({'file': label, 'status': 'error', 'machine_code': code, 'message': '; '.join(_errors(serializer.errors))})
+                continue
+
+            values = dict(serializer.validated_data)
+            rows.append({
+                'file': label,
+                'code': code,
+                'status': 'created' if instance is None else 'updated',
+                'instance': instance,
+                'serializer': serializer,
+                'lubricants': values.pop('lubricants', []),
+                'values': values,
+            })
+        if rows:
+            _save_rows(rows, report)
+
+    order = {label: index for index, (label, _, _) in enumerate(sources)}
+    report.sort(key=lambda entry: order[entry['file']])
+    return report
+
+
+def write_report(report, stream):
+    writer = csv.DictWriter(stream, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(report)
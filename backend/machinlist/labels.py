@@ -0,0 +1,191 @@
+import io
+import re
+import string
+from itertools import groupby
+from django.conf import settings
+from reportlab.graphics.barcode import qrencoder
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from .models import MachineRegistration
+from .pdf_stream import PdfStreamWriter
+from .pdf_utils import register_persian_font, reshape_text
+
+# Label sheets on A4, sizes in mm. More can be added through MACHINE_LABELS['TEMPLATES'].
+LABEL_TEMPLATES = {
+    # 24 per sheet, edge to edge
+    'a4-3x8': {'columns': 3, 'rows': 8, 'width': 70, 'height': 37, 'left': 0, 'top': 0.5,
+               'column_gap': 0, 'row_gap': 0, 'padding': 3, 'font_size': 7},
+    # 14 per sheet (L7163 layout)
+    'a4-2x7': {'columns': 2, 'rows': 7, 'width': 99.1, 'height': 38.1, 'left': 4.65, 'top': 15.15,
+               'column_gap': 2.5, 'row_gap': 0, 'padding': 3, 'font_size': 8},
+    # 8 per sheet (L7165 layout)
+    'a4-2x4': {'columns': 2, 'rows': 4, 'width': 99.1, 'height': 67.7, 'left': 4.65, 'top': 13.1,
+               'column_gap': 2.5, 'row_gap': 0, 'padding': 5, 'font_size': 11},
+}
+
+DEFAULTS = {
+    'TEMPLATE': 'a4-3x8',
+    'TEMPLATES': {},
+    # Encoded in each label's QR code; any machine field in braces, e.g. '{machine_code}/{machine_serial}'
+    'CODE_FORMAT': '{machine_code}',
+    # Pages rendered per reportlab document before they are sent; each carries its own font subset
+    'PAGES_PER_CHUNK': 10,
+    # Rows fetched per round trip of the (server-side on Postgres) cursor
+    'FETCH_SIZE': 1000,
+}
+
+LABEL_FIELDS = ('id', 'machine_code', 'machine_name', 'section', 'location_code', 'location_name')
+
+ELLIPSIS = '…'
+
+
+def get_label_setting(name):
+    return getattr(settings, 'MACHINE_LABELS', {}).get(name, DEFAULTS[name])
+
+
+def get_template(name=None):
+    """The template called name (default TEMPLATE), or None if there is no such template."""
+    templates = {**LABEL_TEMPLATES, **get_label_setting('TEMPLATES')}
+    return templates.get(name or get_label_setting('TEMPLATE'))
+
+
+def code_fields():
+    """
+    The machine fields CODE_FORMAT refers to. Raises ValueError if it is
+    malformed or names something machines don't have, so a sheet can be
+    refused before any of it is sent.
+    """
+    names = set()
+    for _, field, _, _ in string.Formatter().parse(get_label_setting('CODE_FORMAT')):
+        if field is None:
+            continue
+        # '{location_name[0]}' and '{section.upper}' still need location_name and section
+        name = re.match(r'[^.\[]*', field).group()
+        if not name:
+            raise ValueError('CODE_FORMAT fields must be named, e.g. {machine_code}')
+        names.add(name)
+    known = {name for field in MachineRegistration._meta.concrete_fields for name in (field.name, field.attname)}
+    unknown = sorted(names - known)
+    if unknown:
+        raise ValueError(f"CODE_FORMAT refers to unknown machine fields: {', '.join(unknown)}")
+    return names
+
+
+def fit_text(text, font_name, size, width):
+    """Shaped text, cut short with an ellipsis if it is wider than width."""
+    text = str(text or '')
+    shaped = reshape_text(text)
+    if stringWidth(shaped, font_name, size) <= width:
+        return shaped
+    # Cut the logical string (not the shaped, visually ordered one) so the end is what goes
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if stringWidth(reshape_text(text[:middle].rstrip() + ELLIPSIS), font_name, size) <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return reshape_text(text[:low].rstrip() + ELLIPSIS)
+
+
+def draw_code(c, value, x, y, size):
+    """QR code for value in a size x size square at (x, y), quiet zone included."""
+    qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.M)
+    qr.addData(value)
+    qr.version = qr.calculate_version()
+    # make() scores all eight masks, which costs ten times the encoding itself; any mask
+    # decodes, and for codes this small the scoring hardly changes how well they scan
+    qr.makeImpl(False, 0)
+    count = qr.getModuleCount()
+    module = size / (count + 8)
+    path = c.beginPath()
+    for row, modules in enumerate(qr.modules):
+        column = 0
+        for dark, run in groupby(modules):
+            length = len(list(run))
+            if dark:
+                # One rectangle per run of dark modules in a row
+                path.rect(x + (column + 4) * module, y + size - (row + 5) * module, length * module, module)
+            column += length
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def draw_label(c, template, slot, machine, font_name):
+    # Slots fill right to left, top to bottom, like the Persian text on them
+    _, page_height = A4
+    row, column = divmod(slot, template['columns'])
+    width, height = template['width'] * mm, template['height'] * mm
+    padding = template['padding'] * mm
+    right = A4[0] - template['left'] * mm - column * (width + template['column_gap'] * mm)
+    top = page_height - template['top'] * mm - row * (height + template['row_gap'] * mm)
+    left, bottom = right - width, top - height
+
+    # Square code on the left, at most 40% of the width so wide labels keep room for text
+    code_size = min(height - 2 * padding, width * 0.4)
+    code_value = get_label_setting('CODE_FORMAT').format(**machine)
+    draw_code(c, code_value, left + padding, bottom + (height - code_size) / 2, code_size)
+
+    size = template['font_size']
+    text_width = width - code_size - 3 * padding
+    location = machine['location_name']
+    if machine['location_code']:
+        location = f"{location} ({machine['location_code']})" if location else machine['location_code']
+    lines = [
+        (machine['machine_code'], size + 2),
+        (machine['machine_name'], size),
+        (location, size),
+        (machine['section'], size),
+    ]
+    y = top - padding
+    for text, line_size in lines:
+        y -= line_size * 1.2
+        if y < bottom + padding:
+            break
+        c.setFont(font_name, line_size)
+        c.drawRightString(right - padding, y, fit_text(text, font_name, line_size, text_width))
+
+
+def render_labels(machines, template, font_name):
+    """One PDF of labels for machines (a list), as many pages as they fill."""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    per_page = template['columns'] * template['rows']
+    # An empty list still gets one (blank) page
+    for start in range(0, len(machines) or 1, per_page):
+        for slot, machine in enumerate(machines[start:start + per_page]):
+            draw_label(c, template, slot, machine, font_name)
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def label_sheet(queryset, template):
+    """
+    Yield a PDF of labels for the machines in queryset, a few pages at a time.
+    Machines are read through a cursor and each chunk of pages is rendered and
+    sent before the next is read, so memory stays flat however many there are.
+    Callers check code_fields() first: an error past the first chunk can no
+    longer be reported.
+    """
+    fields = LABEL_FIELDS + tuple(sorted(code_fields() - set(LABEL_FIELDS)))
+    font_name = register_persian_font()
+    writer = PdfStreamWriter()
+    yield writer.open()
+
+    batch_size = template['columns'] * template['rows'] * get_label_setting('PAGES_PER_CHUNK')
+    rows = (
+        queryset.prefetch_related(None).order_by('section', 'location_code', 'machine_code')
+        .values(*fields)
+        .iterator(chunk_size=get_label_setting('FETCH_SIZE'))
+    )
+    batch = []
+    for machine in rows:
+        batch.append(machine)
+        if len(batch) == batch_size:
+            yield writer.add(render_labels(batch, template, font_name))
+            batch = []
+    if batch or not writer.kids:
+        yield writer.add(render_labels(batch, template, font_name))
+    yield writer.close()
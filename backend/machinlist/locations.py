@@ -0,0 +1,76 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from .analytics import data_version
+from .events import record_machine_events
+from .models import Location, MachineRegistration, MachineChangeEvent
+from .scoping import scope_queryset
+from .search import refresh_search_documents
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def tree_version():
+    # Moves and renames save the node itself, deletions change the count
+    stamp = Location.objects.aggregate(updated=Max('updated_at'), count=Count('id'))
+    return f"{stamp['count']}-{stamp['updated'].timestamp() if stamp['updated'] else 0}"
+
+
+def location_rollups(user, scope_key='all'):
+    """
+    {location id: {machine_count, installed_power, direct_machine_count}} over
+    the active machines the user can see, where the first two cover the whole
+    subtree. One grouped query over the machines, rolled up the tree in
+    Python along the materialized paths, and cached until a machine or the
+    tree changes.
+    """
+    cache_key = f'machinlist:location-rollups:{scope_key}:{data_version()}:{tree_version()}'
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
+    direct = (
+        scope_queryset(MachineRegistration.objects.filter(location__isnull=False), user)
+        .values('location_id')
+        .annotate(count=Count('id'), power=Sum('nominal_power'))
+        .order_by()
+    )
+    result = {
+        pk: {'machine_count': 0, 'installed_power': 0.0, 'direct_machine_count': 0}
+        for pk in Location.objects.values_list('pk', flat=True)
+    }
+    paths = dict(Location.objects.values_list('pk', 'path'))
+    step = Location.PATH_STEP
+    for row in direct:
+        path = paths.get(row['location_id'])
+        if path is None:
+            continue
+        result[row['location_id']]['direct_machine_count'] = row['count']
+        for i in range(0, len(path), step):
+            node = result[int(path[i:i + step])]
+            node['machine_count'] += row['count']
+            node['installed_power'] += row['power'] or 0.0
+    cache.set(cache_key, result, CACHE_TIMEOUT)
+    return result
+
+
+def sync_location_machines(location):
+    """
+    Copy a renamed or re-coded location onto the machines placed directly in
+    it, whose location_code/location_name mirror the node.
+    """
+    with transaction.atomic():
+        machines = MachineRegistration.all_objects.filter(location=location).exclude(
+            location_code=location.code, location_name=location.name
+        )
+        ids = list(machines.values_list('pk', flat=True))
+        if not ids:
+            return 0
+        # updated_at too: exports are cached by it
+        MachineRegistration.all_objects.filter(pk__in=ids).update(
+            location_code=location.code, location_name=location.name, updated_at=timezone.now()
+        )
+        refresh_search_documents(ids)
+        record_machine_events(ids, MachineChangeEvent.UPDATED)
+    return len(ids)
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from machinlist.archive import archivable_machines, archive_machines
+
+
+class Command(BaseCommand):
+    help = 'Moves decommissioned machines and their lubricants into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=0, help='Only archive machines decommissioned at least this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500, help='Machines moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many machines would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+
+        if options['dry_run']:
+            count = archivable_machines(cutoff).count()
+            self.stdout.write(f'{count} decommissioned machines would be archived')
+            return
+
+        count = archive_machines(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {count} machines'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from machinlist.attachments import finish_pending_uploads, generate_pending_thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        'Stores completed uploads left for the background and generates attachment thumbnails that are still pending; '
+        'run it periodically (e.g. every minute from cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry thumbnails that failed before')
+        parser.add_argument('--workers', type=int, default=None, help='Decoding processes (default: THUMBNAIL_WORKERS)')
+
+    def handle(self, *args, **options):
+        finished = finish_pending_uploads()
+        if finished:
+            self.stdout.write(self.style.SUCCESS(f'Uploads stored: {finished}'))
+        counts = generate_pending_thumbnails(retry_failed=options['retry_failed'], workers=options['workers'])
+        summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f'Thumbnails: {summary}'))
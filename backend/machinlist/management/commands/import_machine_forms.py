@@ -0,0 +1,41 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from machinlist.form_import import import_machine_forms, write_report
+
+
+class Command(BaseCommand):
+    help = 'Reads filled machine registration PDF forms (folder, ZIP or single file) and upserts the machines by code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Folder, ZIP archive or PDF file')
+        parser.add_argument('--report', type=str, help='Write the per-file report CSV here (default: stdout)')
+        parser.add_argument('--workers', type=int, default=None, help='PDF parsing processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Machines written per batch')
+        parser.add_argument('--section', type=str, help='Section for new machines (not printed on the form)')
+        parser.add_argument('--no-update', action='store_true', help='Skip forms whose machine code already exists')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist")
+
+        report = import_machine_forms(
+            options['path'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            update_existing=not options['no_update'],
+            default_section=options['section'],
+        )
+
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as f:
+                write_report(report, f)
+        else:
+            write_report(report, sys.stdout)
+
+        counts = {}
+        for entry in report:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'no files'
+        style = self.style.WARNING if counts.get('error') else self.style.SUCCESS
+        self.stderr.write(style(f'Imported forms: {summary}'))
@@ -0,0 +1,41 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from machinlist.user_import import import_users, write_report
+
+
+class Command(BaseCommand):
+    help = 'Bulk-creates users from a CSV file (columns: email, password, username, role, is_staff, is_active)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', type=str, help='Path to the CSV file')
+        parser.add_argument('--report', type=str, help='Write the per-row report CSV here (default: stdout)')
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users written per bulk_create')
+        parser.add_argument('--default-role', type=str, default='user', help='Role for rows without one')
+
+    def handle(self, *args, **options):
+        try:
+            stream = open(options['csv_file'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot open {options['csv_file']}: {e}")
+
+        with stream:
+            report = import_users(
+                stream,
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+                default_role=options['default_role'],
+            )
+
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as f:
+                write_report(report, f)
+        else:
+            write_report(report, sys.stdout)
+
+        counts = {}
+        for entry in report:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        summary = ', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'no rows'
+        style = self.style.WARNING if counts.get('error') else self.style.SUCCESS
+        self.stderr.write(style(f'Imported users: {summary}'))
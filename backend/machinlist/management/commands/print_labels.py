@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from machinlist.labels import label_sheet, code_fields, get_template
+from machinlist.models import MachineRegistration
+
+
+class Command(BaseCommand):
+    help = 'Writes a label sheet PDF for the active machines, optionally of one section'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='PDF file to write')
+        parser.add_argument('--section', default=None)
+        parser.add_argument('--template', default=None, help='Label template (default: MACHINE_LABELS TEMPLATE)')
+
+    def handle(self, *args, **options):
+        template = get_template(options['template'])
+        if template is None:
+            raise CommandError(f"Unknown label template: {options['template']}")
+        try:
+            code_fields()
+        except ValueError as e:
+            raise CommandError(str(e))
+        queryset = MachineRegistration.objects.all()
+        if options['section']:
+            queryset = queryset.filter(section=options['section'])
+        with open(options['output'], 'wb') as f:
+            for chunk in label_sheet(queryset, template):
+                f.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote labels for {queryset.count()} machines to {options['output']}"))
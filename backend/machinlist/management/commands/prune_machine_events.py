@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from machinlist.events import get_events_setting, prune_events
+
+
+class Command(BaseCommand):
+    help = 'Deletes machine change events older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None, help='Retention in hours (default: MACHINE_EVENTS RETENTION_HOURS)')
+
+    def handle(self, *args, **options):
+        hours = options['hours'] if options['hours'] is not None else get_events_setting('RETENTION_HOURS')
+        deleted = prune_events(hours)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} machine change events older than {hours}h'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from machinlist.readings import get_readings_setting, prune_readings
+
+
+class Command(BaseCommand):
+    help = 'Deletes rolled-up raw readings and hourly rollups older than their retention windows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=int, default=None, help='Raw retention in days (default: MACHINE_READINGS RAW_RETENTION_DAYS)')
+        parser.add_argument('--hourly-days', type=int, default=None, help='Hourly rollup retention in days (default: MACHINE_READINGS HOURLY_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        raw_days = options['raw_days'] if options['raw_days'] is not None else get_readings_setting('RAW_RETENTION_DAYS')
+        hourly_days = options['hourly_days'] if options['hourly_days'] is not None else get_readings_setting('HOURLY_RETENTION_DAYS')
+        raw, hourly = prune_readings(raw_days, hourly_days)
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {raw} raw readings older than {raw_days}d and {hourly} hourly rollups older than {hourly_days}d'
+        ))
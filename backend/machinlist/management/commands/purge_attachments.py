@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from machinlist.attachments import get_attachment_setting, purge_attachments
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired unfinished attachment uploads and stored files no attachment refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None, help='Upload expiry in hours (default: ATTACHMENTS UPLOAD_EXPIRY_HOURS)')
+
+    def handle(self, *args, **options):
+        hours = options['hours'] if options['hours'] is not None else get_attachment_setting('UPLOAD_EXPIRY_HOURS')
+        uploads, blobs = purge_attachments(expiry_hours=hours)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {uploads} expired uploads and {blobs} unreferenced files'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from machinlist.models import MachineRegistration
+from machinlist.search import refresh_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the normalized full-text search columns of every machine (e.g. after normalization rules change)'
+
+    def handle(self, *args, **options):
+        ids = list(MachineRegistration.all_objects.order_by('pk').values_list('pk', flat=True))
+        refresh_search_documents(ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search documents for {len(ids)} machines'))
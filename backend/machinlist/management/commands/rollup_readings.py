@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from machinlist.readings import rollup_readings
+
+
+class Command(BaseCommand):
+    help = 'Folds machine readings received since the last run into the hourly and daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Readings per transaction (default: MACHINE_READINGS ROLLUP_BATCH)')
+
+    def handle(self, *args, **options):
+        rolled = rollup_readings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {rolled} readings'))
@@ -0,0 +1,56 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .db_router import allow_replica_reads, reset_replica_reads, pin_to_primary, has_written, get_replica_setting
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks safe requests as eligible for replica reads, unless the client wrote
+    within PIN_SECONDS (tracked with a short-lived cookie so it holds across
+    workers). A request that writes sets that cookie, giving the client
+    read-your-writes on its next requests while the replicas catch up.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._start(request)
+        try:
+            response = self.get_response(request)
+            return self._finish(request, response)
+        finally:
+            reset_replica_reads(token)
+
+    async def __acall__(self, request):
+        token = self._start(request)
+        try:
+            response = await self.get_response(request)
+            return self._finish(request, response)
+        finally:
+            reset_replica_reads(token)
+
+    def _start(self, request):
+        token = allow_replica_reads()
+        if request.method not in SAFE_METHODS or get_replica_setting('COOKIE_NAME') in request.COOKIES:
+            pin_to_primary()
+        return token
+
+    def _finish(self, request, response):
+        if has_written():
+            response.set_cookie(
+                get_replica_setting('COOKIE_NAME'),
+                '1',
+                max_age=get_replica_setting('PIN_SECONDS'),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
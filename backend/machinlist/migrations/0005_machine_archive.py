@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:19
+
+import django.core.serializers.json
+import django.db.models.manager
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0004_user_username'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMachine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveIntegerField(db_index=True)),
+                ('section', models.CharField(db_index=True, max_length=150)),
+                ('machine_name', models.CharField(max_length=150)),
+                ('machine_code', models.CharField(db_index=True, max_length=150)),
+                ('machine_serial', models.CharField(max_length=150)),
+                ('location_code', models.CharField(max_length=100)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('lubricants', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('decommissioned_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['-archived_at'],
+            },
+        ),
+        migrations.AlterModelManagers(
+            name='machineregistration',
+            managers=[
+                ('all_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='machineregistration',
+            name='decommissioned_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Decommissioned At'),
+        ),
+    ]
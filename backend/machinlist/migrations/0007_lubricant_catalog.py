@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0006_machine_change_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lubricant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('normalized_name', models.CharField(max_length=255, unique=True, verbose_name='Normalized Name')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='machinelubricant',
+            name='alternative_lubricant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='alternative_usages', to='machinlist.lubricant'),
+        ),
+        migrations.AddField(
+            model_name='machinelubricant',
+            name='lubricant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='machine_usages', to='machinlist.lubricant'),
+        ),
+        migrations.CreateModel(
+            name='LubricantAlias',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=255, verbose_name='Alias')),
+                ('normalized_alias', models.CharField(max_length=255, unique=True, verbose_name='Normalized Alias')),
+                ('lubricant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='machinlist.lubricant')),
+            ],
+        ),
+    ]
@@ -0,0 +1,71 @@
+import re
+from collections import Counter, defaultdict
+
+from django.db import migrations
+
+# Frozen copy of machinlist.normalization.normalize_lubricant_name as of this migration,
+# so later changes to the live normalizer do not change what this migration writes
+PERSIAN_CHAR_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'آ': 'ا', 'ؤ': 'و',
+    '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
+    '۵': '5', '۶': '6', '۷': '7', '۸': '8', '۹': '9',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+    '\u200c': ' ', '\u200d': '', '\u0640': '',
+})
+DIACRITICS_RE = re.compile('[\u064b-\u0670\u06d6-\u06ed]')
+WHITESPACE_RE = re.compile(r'\s+')
+TOKEN_SPLIT_RE = re.compile(r'[\s\-_/\\.,:;()]+')
+
+
+def normalize_lubricant_name(name):
+    if name is None:
+        return ''
+    text = str(name).translate(PERSIAN_CHAR_MAP)
+    text = DIACRITICS_RE.sub('', text)
+    text = WHITESPACE_RE.sub(' ', text).strip().casefold()
+    return ' '.join(token for token in TOKEN_SPLIT_RE.split(text) if token)
+
+
+def populate_catalog(apps, schema_editor):
+    Lubricant = apps.get_model('machinlist', 'Lubricant')
+    MachineLubricant = apps.get_model('machinlist', 'MachineLubricant')
+
+    # Group the free-text spellings by normalized name; the most common spelling becomes the catalog name
+    spellings = defaultdict(Counter)
+    for values in MachineLubricant.objects.values_list('lubricant_type', 'alternative_lubricant_type').iterator():
+        for value in values:
+            normalized = normalize_lubricant_name(value)
+            if normalized:
+                spellings[normalized][value.strip()] += 1
+
+    existing = set(Lubricant.objects.values_list('normalized_name', flat=True))
+    Lubricant.objects.bulk_create([
+        Lubricant(name=counter.most_common(1)[0][0], normalized_name=normalized)
+        for normalized, counter in spellings.items()
+        if normalized not in existing
+    ])
+    catalog = dict(Lubricant.objects.values_list('normalized_name', 'id'))
+
+    batch = []
+    for row in MachineLubricant.objects.only('id', 'lubricant_type', 'alternative_lubricant_type').iterator():
+        row.lubricant_id = catalog.get(normalize_lubricant_name(row.lubricant_type))
+        row.alternative_lubricant_id = catalog.get(normalize_lubricant_name(row.alternative_lubricant_type))
+        batch.append(row)
+        if len(batch) >= 1000:
+            MachineLubricant.objects.bulk_update(batch, ['lubricant', 'alternative_lubricant'])
+            batch = []
+    if batch:
+        MachineLubricant.objects.bulk_update(batch, ['lubricant', 'alternative_lubricant'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0007_lubricant_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0008_populate_lubricant_catalog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='machineregistration',
+            name='company_entry_date',
+            field=models.DateField(db_index=True, verbose_name='Company Entry Date'),
+        ),
+    ]
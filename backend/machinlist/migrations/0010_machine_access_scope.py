@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0009_company_entry_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MachineAccessScope',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(blank=True, default='', max_length=150, verbose_name='Section')),
+                ('location_code', models.CharField(blank=True, default='', max_length=100, verbose_name='Location Code')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='machineregistration',
+            index=models.Index(fields=['section', 'location_code'], name='machine_section_location_idx'),
+        ),
+        migrations.AddField(
+            model_name='machineaccessscope',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='machine_scopes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='machineaccessscope',
+            constraint=models.UniqueConstraint(fields=('user', 'section', 'location_code'), name='unique_machine_access_scope'),
+        ),
+        migrations.AddConstraint(
+            model_name='machineaccessscope',
+            constraint=models.CheckConstraint(condition=models.Q(('location_code', ''), ('section', ''), _negated=True), name='machine_access_scope_not_empty'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:41
+
+import django.core.serializers.json
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0010_machine_access_scope'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveBigIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('thumbnail_status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('unavailable', 'Unavailable'), ('failed', 'Failed')], db_index=True, default='pending', max_length=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedmachine',
+            name='attachments',
+            field=models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('manual', 'Manual'), ('nameplate', 'Nameplate Photo'), ('wiring', 'Wiring Diagram'), ('other', 'Other')], default='other', max_length=10)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('received', models.PositiveBigIntegerField(default=0)),
+                ('writing_until', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('machine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_uploads', to='machinlist.machineregistration')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MachineAttachment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('manual', 'Manual'), ('nameplate', 'Nameplate Photo'), ('wiring', 'Wiring Diagram'), ('other', 'Other')], default='other', max_length=10, verbose_name='Kind')),
+                ('filename', models.CharField(max_length=255, verbose_name='File Name')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='attachments', to='machinlist.attachmentblob')),
+                ('machine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='machinlist.machineregistration')),
+                ('uploaded_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['kind', 'filename'],
+            },
+        ),
+    ]
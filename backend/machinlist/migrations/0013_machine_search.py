@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:46
+
+from django.db import migrations, models
+from machinlist.normalization import search_document
+
+SEARCH_TITLE_FIELDS = ('machine_name', 'machine_code', 'machine_model', 'machine_serial',
+                       'supplier_company_name', 'manufacturer_company_name')
+SEARCH_BODY_FIELDS = ('electrical_technical_description', 'supplier_address', 'manufacturer_address', 'location_name')
+
+
+def fill_search_documents(apps, schema_editor):
+    MachineRegistration = apps.get_model('machinlist', 'MachineRegistration')
+    batch = []
+    for machine in MachineRegistration._default_manager.iterator(chunk_size=500):
+        machine.search_title = search_document(getattr(machine, field) for field in SEARCH_TITLE_FIELDS)
+        machine.search_body = search_document(getattr(machine, field) for field in SEARCH_BODY_FIELDS)
+        batch.append(machine)
+        if len(batch) == 500:
+            MachineRegistration._default_manager.bulk_update(batch, ['search_title', 'search_body'])
+            batch = []
+    MachineRegistration._default_manager.bulk_update(batch, ['search_title', 'search_body'])
+
+
+def create_search_index(apps, schema_editor):
+    # Same expression as machinlist.search.machine_search_vector, so the planner can use the index
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    MachineRegistration = apps.get_model('machinlist', 'MachineRegistration')
+    schema_editor.add_index(MachineRegistration, GinIndex(
+        SearchVector('search_title', weight='A', config='simple')
+        + SearchVector('search_body', weight='B', config='simple'),
+        name='machine_search_vector_idx',
+    ))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS machine_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0012_machine_readings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='machineregistration',
+            name='search_body',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='machineregistration',
+            name='search_title',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
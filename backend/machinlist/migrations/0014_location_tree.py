@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+PATH_STEP = 6
+
+
+def build_locations(apps, schema_editor):
+    """
+    One root per section and one child per location code within it, named
+    after the machines' location_name; every machine is placed in its child.
+    Deeper levels are added through the API once the plants are mapped.
+    """
+    Location = apps.get_model('machinlist', 'Location')
+    MachineRegistration = apps.get_model('machinlist', 'MachineRegistration')
+    machines = MachineRegistration._default_manager
+
+    def create(name, code, parent):
+        node = Location._default_manager.create(name=name, code=code, parent=parent, path='', depth=0)
+        parent_path = parent.path if parent else ''
+        node.path = parent_path + str(node.pk).zfill(PATH_STEP)
+        node.depth = len(parent_path) // PATH_STEP
+        Location._default_manager.filter(pk=node.pk).update(path=node.path, depth=node.depth)
+        return node
+
+    roots = {}
+    pairs = machines.values_list('section', 'location_code').distinct().order_by('section', 'location_code')
+    for section, location_code in pairs:
+        if section not in roots:
+            roots[section] = create(section, section, None)
+        name = (
+            machines.filter(section=section, location_code=location_code)
+            .order_by('pk').values_list('location_name', flat=True).first()
+        )
+        node = create(name or location_code, location_code, roots[section])
+        machines.filter(section=section, location_code=location_code).update(location=node)
+
+
+def clear_locations(apps, schema_editor):
+    Location = apps.get_model('machinlist', 'Location')
+    apps.get_model('machinlist', 'MachineRegistration')._default_manager.update(location=None)
+    # Children first, since parent is protected
+    for node in Location._default_manager.order_by('-depth'):
+        node.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0013_machine_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('code', models.CharField(max_length=100, verbose_name='Code')),
+                ('path', models.CharField(db_index=True, editable=False, max_length=252)),
+                ('depth', models.PositiveSmallIntegerField(default=0, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='children', to='machinlist.location')),
+            ],
+            options={
+                'ordering': ['path'],
+            },
+        ),
+        migrations.AddField(
+            model_name='machineregistration',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='machines', to='machinlist.location', verbose_name='Location'),
+        ),
+        migrations.AddConstraint(
+            model_name='location',
+            constraint=models.UniqueConstraint(fields=('parent', 'code'), name='unique_location_code_per_parent'),
+        ),
+        migrations.AddConstraint(
+            model_name='location',
+            constraint=models.UniqueConstraint(condition=models.Q(('parent__isnull', True)), fields=('code',), name='unique_root_location_code'),
+        ),
+        migrations.RunPython(build_locations, clear_locations),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:40
+
+from django.db import migrations
+
+# The admin searches locations with startswith. On Postgres a LIKE prefix can only use a
+# btree index under the C collation or with a pattern operator class; the unique fields the
+# other admins search get such an index (<name>_like) from Django, these two have none.
+LOCATION_PATTERN_INDEXES = (
+    ('location_code_like_idx', 'code'),
+    ('location_name_like_idx', 'name'),
+)
+
+
+def create_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import OpClass
+    from django.db import models
+
+    Location = apps.get_model('machinlist', 'Location')
+    for name, field in LOCATION_PATTERN_INDEXES:
+        schema_editor.add_index(Location, models.Index(OpClass(field, name='varchar_pattern_ops'), name=name))
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, _ in LOCATION_PATTERN_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0014_location_tree'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
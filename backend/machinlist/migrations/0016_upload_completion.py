@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machinlist', '0015_location_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachmentupload',
+            name='attachment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='machinlist.machineattachment'),
+        ),
+        migrations.AddField(
+            model_name='attachmentupload',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
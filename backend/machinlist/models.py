@@ -1,5 +1,12 @@
 from enum import unique
-from django.db import models
+import uuid
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from .normalization import normalize_lubricant_name, search_document
 from django.contrib.auth.models import (
     AbstractBaseUser,
     PermissionsMixin,
@@ -48,6 +55,96 @@ class User(AbstractBaseUser,PermissionsMixin):
         return self.email
 
 
+class ActiveMachineManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(decommissioned_at__isnull=True)
+
+
+class Location(models.Model):
+    """
+    A node of the plant/hall/line hierarchy. path is the materialized path of
+    fixed-width, zero-padded ids from the root down (digits only, so it sorts
+    the same under any collation); a subtree is one range on the path index.
+    """
+    PATH_STEP = 6
+
+    name = models.CharField(max_length=255, verbose_name="Name")
+    code = models.CharField(max_length=100, verbose_name="Code")
+    parent = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='children')
+    path = models.CharField(max_length=252, db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['path']
+        constraints = [
+            models.UniqueConstraint(fields=['parent', 'code'], name='unique_location_code_per_parent'),
+            models.UniqueConstraint(fields=['code'], condition=models.Q(parent__isnull=True), name='unique_root_location_code'),
+        ]
+
+    @classmethod
+    def subtree_bounds(cls, path):
+        # Every path in the subtree starts with path, so it sorts in [path, path + 1) at the same width
+        return path, str(int(path) + 1).zfill(len(path))
+
+    def subtree_filter(self, prefix=''):
+        lower, upper = self.subtree_bounds(self.path)
+        return {f'{prefix}path__gte': lower, f'{prefix}path__lt': upper}
+
+    def ancestor_ids(self):
+        step = self.PATH_STEP
+        return [int(self.path[i:i + step]) for i in range(0, len(self.path) - step, step)]
+
+    @classmethod
+    def stored_path(cls, pk):
+        # Locked, so the subtree cannot be moved by someone else until the transaction ends
+        return cls.objects.select_for_update().filter(pk=pk).values_list('path', flat=True).get()
+
+    def clean(self):
+        if self.pk is not None and self.parent_id is not None:
+            # Stored paths: this instance or its cached parent may predate another move
+            paths = dict(Location.objects.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path'))
+            if paths.get(self.parent_id, '').startswith(paths.get(self.pk, self.path)):
+                raise ValidationError({'parent': "A location cannot be moved under itself or its descendants."})
+
+    def path_segment(self):
+        # A wider id would shift every boundary after it and corrupt the subtree ranges
+        segment = str(self.pk).zfill(self.PATH_STEP)
+        if len(segment) > self.PATH_STEP:
+            raise ValueError(f"Location ids are limited to {self.PATH_STEP} digits")
+        return segment
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # Paths come from the database, not from this instance or its cached parent, which may
+            # have been loaded before another move re-rooted them
+            parent_path = self.stored_path(self.parent_id) if self.parent_id else ''
+            if self.pk is None:
+                # The path ends with the node's own id, which the insert assigns
+                super().save(*args, **kwargs)
+                self.path = parent_path + self.path_segment()
+                self.depth = len(parent_path) // self.PATH_STEP
+                Location.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+            old_path = self.stored_path(self.pk)
+            new_path = parent_path + self.path_segment()
+            if new_path != old_path:
+                if parent_path.startswith(old_path):
+                    raise ValueError("A location cannot be moved under itself or its descendants")
+                # Re-root the whole subtree with one UPDATE
+                lower, upper = self.subtree_bounds(old_path)
+                Location.objects.filter(path__gte=lower, path__lt=upper).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (len(new_path) - len(old_path)) // self.PATH_STEP,
+                )
+                self.path = new_path
+                self.depth = len(parent_path) // self.PATH_STEP
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} ({self.code})"
+
+
 class MachineRegistration(models.Model):
     section = models.CharField(max_length=150)
     machine_name = models.CharField(max_length=150,unique=True)
@@ -55,7 +152,7 @@ class MachineRegistration(models.Model):
     machine_model = models.CharField(max_length=150,unique=True)
     machine_serial = models.CharField(max_length=150,unique=True)
     manufacture_year = models.PositiveIntegerField(verbose_name="Manufacture Year")
-    company_entry_date = models.DateField(verbose_name="Company Entry Date")
+    company_entry_date = models.DateField(verbose_name="Company Entry Date", db_index=True)
     installation_date = models.DateField(verbose_name="Installation Date", null=True, blank=True)
     criticality_level = models.CharField(
         max_length=50,
@@ -69,6 +166,10 @@ class MachineRegistration(models.Model):
     )
     location_name = models.CharField(max_length=255, verbose_name="Location Name")
     location_code = models.CharField(max_length=100, verbose_name="Location Code")
+    # When set, location_code and location_name mirror the node (see MachineRegistrationSerializer.validate)
+    location = models.ForeignKey(
+        Location, on_delete=models.SET_NULL, null=True, blank=True, related_name='machines', verbose_name="Location"
+    )
 
     # Dimensions & Weight
     length_mm = models.FloatField(verbose_name="Length (mm)", null=True, blank=True)
@@ -127,11 +228,183 @@ class MachineRegistration(models.Model):
     # Meta
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    decommissioned_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name="Decommissioned At")
+
+    # Normalized words of the text fields, rebuilt on save; indexed for full-text search, see machinlist/search.py
+    search_title = models.TextField(default='', editable=False)
+    search_body = models.TextField(default='', editable=False)
+
+    # all_objects stays the default manager so uniqueness checks and admin see every row;
+    # objects only returns machines still on the floor
+    all_objects = models.Manager()
+    objects = ActiveMachineManager()
+
+    class Meta:
+        indexes = [
+            # Access scopes filter on section and location together
+            models.Index(fields=['section', 'location_code'], name='machine_section_location_idx'),
+        ]
+
+    SEARCH_TITLE_FIELDS = ('machine_name', 'machine_code', 'machine_model', 'machine_serial',
+                           'supplier_company_name', 'manufacturer_company_name')
+    SEARCH_BODY_FIELDS = ('electrical_technical_description', 'supplier_address', 'manufacturer_address', 'location_name')
+
+    def update_search_documents(self):
+        self.search_title = search_document(getattr(self, field) for field in self.SEARCH_TITLE_FIELDS)
+        self.search_body = search_document(getattr(self, field) for field in self.SEARCH_BODY_FIELDS)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.update_search_documents()
+        elif set(update_fields) & set(self.SEARCH_TITLE_FIELDS + self.SEARCH_BODY_FIELDS):
+            self.update_search_documents()
+            kwargs['update_fields'] = {*update_fields, 'search_title', 'search_body'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.machine_name} ({self.machine_code})"
 
 
+class MachineAccessScope(models.Model):
+    # Grants a user the machines of one section and/or location; a blank column matches any value
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='machine_scopes')
+    section = models.CharField(max_length=150, blank=True, default='', verbose_name="Section")
+    location_code = models.CharField(max_length=100, blank=True, default='', verbose_name="Location Code")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'section', 'location_code'], name='unique_machine_access_scope'),
+            models.CheckConstraint(
+                condition=~models.Q(section='', location_code=''),
+                name='machine_access_scope_not_empty',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.section or '*'} / {self.location_code or '*'}"
+
+
+class AttachmentBlob(models.Model):
+    # One stored file, addressed by its SHA-256; identical uploads share it. See machinlist/attachments.py
+    THUMBNAIL_PENDING = 'pending'
+    THUMBNAIL_READY = 'ready'
+    THUMBNAIL_UNAVAILABLE = 'unavailable'
+    THUMBNAIL_FAILED = 'failed'
+    THUMBNAIL_CHOICES = (
+        (THUMBNAIL_PENDING, 'Pending'),
+        (THUMBNAIL_READY, 'Ready'),
+        (THUMBNAIL_UNAVAILABLE, 'Unavailable'),
+        (THUMBNAIL_FAILED, 'Failed'),
+    )
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    content_type = models.CharField(max_length=100)
+    thumbnail_status = models.CharField(max_length=12, choices=THUMBNAIL_CHOICES, default=THUMBNAIL_PENDING, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+
+class MachineAttachment(models.Model):
+    MANUAL = 'manual'
+    NAMEPLATE = 'nameplate'
+    WIRING = 'wiring'
+    OTHER = 'other'
+    KIND_CHOICES = (
+        (MANUAL, 'Manual'),
+        (NAMEPLATE, 'Nameplate Photo'),
+        (WIRING, 'Wiring Diagram'),
+        (OTHER, 'Other'),
+    )
+
+    machine = models.ForeignKey(MachineRegistration, on_delete=models.CASCADE, related_name='attachments')
+    # Unreferenced blobs are removed by purge_attachments, never on delete, so a concurrent upload can still reuse them
+    blob = models.ForeignKey(AttachmentBlob, on_delete=models.PROTECT, related_name='attachments')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=OTHER, verbose_name="Kind")
+    filename = models.CharField(max_length=255, verbose_name="File Name")
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['kind', 'filename']
+
+    def __str__(self):
+        return f"{self.filename} ({self.machine_id})"
+
+
+class AttachmentUpload(models.Model):
+    # A resumable upload in progress; its bytes are appended to a part file until received == size
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    machine = models.ForeignKey(MachineRegistration, on_delete=models.CASCADE, related_name='attachment_uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=10, choices=MachineAttachment.KIND_CHOICES, default=MachineAttachment.OTHER)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # Set while one request appends a chunk, so concurrent appends to the same upload are refused
+    writing_until = models.DateTimeField(null=True, blank=True)
+    # Set when every byte arrived but the file is left for generate_thumbnails to hash and store
+    completed_at = models.DateTimeField(null=True, blank=True)
+    attachment = models.ForeignKey('MachineAttachment', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+
+class LubricantManager(models.Manager):
+    def resolve(self, name, create=True):
+        # Maps free text to its catalog entry by alias, then by normalized name. Aliases win: they are
+        # curated, while a name match may be an entry auto-created from the same spelling
+        normalized = normalize_lubricant_name(name)
+        if not normalized:
+            return None
+        alias = LubricantAlias.objects.select_related('lubricant').filter(normalized_alias=normalized).first()
+        if alias is not None:
+            return alias.lubricant
+        lubricant = self.filter(normalized_name=normalized).first()
+        if lubricant is None and create:
+            lubricant, _ = self.get_or_create(normalized_name=normalized, defaults={'name': name.strip()})
+        return lubricant
+
+
+class Lubricant(models.Model):
+    name = models.CharField(max_length=255, verbose_name="Name")
+    normalized_name = models.CharField(max_length=255, unique=True, verbose_name="Normalized Name")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LubricantManager()
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    def merge_into(self, target):
+        # Moves this entry's machine rows onto target and deletes it
+        MachineLubricant.objects.filter(lubricant=self).update(lubricant=target)
+        MachineLubricant.objects.filter(alternative_lubricant=self).update(alternative_lubricant=target)
+        self.delete()
+
+
+class LubricantAlias(models.Model):
+    lubricant = models.ForeignKey(Lubricant, on_delete=models.CASCADE, related_name='aliases')
+    alias = models.CharField(max_length=255, verbose_name="Alias")
+    normalized_alias = models.CharField(max_length=255, unique=True, verbose_name="Normalized Alias")
+
+    def save(self, *args, **kwargs):
+        self.normalized_alias = normalize_lubricant_name(self.alias)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.alias} -> {self.lubricant.name}"
+
+
 class MachineLubricant(models.Model):
     machine = models.ForeignKey(
         MachineRegistration,
@@ -143,9 +416,139 @@ class MachineLubricant(models.Model):
     alternative_lubricant_type = models.CharField(max_length=255, verbose_name="Alternative Lubricant Type", null=True, blank=True)
     description = models.TextField(verbose_name="Description", null=True, blank=True)
 
+    # Catalog links resolved from the free-text columns on save
+    lubricant = models.ForeignKey(
+        Lubricant,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='machine_usages'
+    )
+    alternative_lubricant = models.ForeignKey(
+        Lubricant,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='alternative_usages'
+    )
+
     class Meta:
         ordering = ['row_number']
 
+    def link_catalog(self):
+        self.lubricant = Lubricant.objects.resolve(self.lubricant_type)
+        self.alternative_lubricant = Lubricant.objects.resolve(self.alternative_lubricant_type)
+
+    def save(self, *args, **kwargs):
+        self.link_catalog()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.machine.machine_name} - Lubricant {self.row_number}"
-    
+
+
+class ArchivedMachine(models.Model):
+    # Snapshot of a decommissioned machine and its lubricants, moved out of the hot table
+    original_id = models.PositiveIntegerField(db_index=True)
+    section = models.CharField(max_length=150, db_index=True)
+    machine_name = models.CharField(max_length=150)
+    machine_code = models.CharField(max_length=150, db_index=True)
+    machine_serial = models.CharField(max_length=150)
+    location_code = models.CharField(max_length=100)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    lubricants = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+    attachments = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+    decommissioned_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-archived_at']
+
+    def __str__(self):
+        return f"{self.machine_name} ({self.machine_code}) - archived"
+
+
+class MachineChangeEvent(models.Model):
+    # Append-only change log read by the server-sent event stream; pruned by prune_machine_events
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = (
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    machine_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.action} machine {self.machine_id} (#{self.id})"
+
+
+class MachineReading(models.Model):
+    # Append-only runtime readings. machine_id is deliberately not a foreign key: inserts take no lock on
+    # registry rows and need no index on them. Indexed by BRIN on recorded_at, see migration 0012
+    CURRENT = 'current'
+    POWER = 'power'
+    PRESSURE = 'pressure'
+    OPERATING_HOURS = 'operating_hours'
+    METRIC_CHOICES = (
+        (CURRENT, 'Current (A)'),
+        (POWER, 'Power (kW)'),
+        (PRESSURE, 'Pressure'),
+        (OPERATING_HOURS, 'Operating Hours'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    machine_id = models.PositiveIntegerField()
+    metric = models.CharField(max_length=16, choices=METRIC_CHOICES)
+    value = models.FloatField()
+    # Judged against the machine's nominal rating when the reading arrives
+    out_of_spec = models.BooleanField(default=False)
+    recorded_at = models.DateTimeField()
+    received_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.metric}={self.value} machine {self.machine_id} @ {self.recorded_at}"
+
+
+class MachineReadingRollup(models.Model):
+    # Hourly/daily aggregates of MachineReading, maintained incrementally by rollup_readings
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = (
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    machine_id = models.PositiveIntegerField()
+    metric = models.CharField(max_length=16, choices=MachineReading.METRIC_CHOICES)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    total = models.FloatField()
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+    out_of_spec = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index behind per-machine series and out-of-spec queries
+            models.UniqueConstraint(fields=['machine_id', 'metric', 'period', 'bucket'], name='unique_reading_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} machine {self.machine_id} {self.period} {self.bucket}"
+
+
+class ReadingRollupState(models.Model):
+    # Single row: readings with id <= last_reading_id are already in the rollups
+    last_reading_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Rolled up to reading {self.last_reading_id}"
@@ -0,0 +1,75 @@
+import re
+
+# Arabic code points that Persian keyboards and legacy data mix with the
+# Persian ones; folded to a single form so lookups match either spelling.
+PERSIAN_CHAR_MAP = str.maketrans({
+    'ي': 'ی',
+    'ى': 'ی',
+    'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه',
+    'ۀ': 'ه',
+    'أ': 'ا',
+    'إ': 'ا',
+    'ٱ': 'ا',
+    'آ': 'ا',
+    'ؤ': 'و',
+    # Persian and Arabic-Indic digits -> Latin digits
+    '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
+    '۵': '5', '۶': '6', '۷': '7', '۸': '8', '۹': '9',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+    # ZWNJ / ZWJ / tatweel
+    '\u200c': ' ',
+    '\u200d': '',
+    '\u0640': '',
+})
+
+# Harakat and other combining marks
+DIACRITICS_RE = re.compile('[\u064b-\u0670\u06d6-\u06ed]')
+WHITESPACE_RE = re.compile(r'\s+')
+TOKEN_SPLIT_RE = re.compile(r'[\s\-_/\\.,:;()]+')
+WORD_RE = re.compile(r'[^\W_]+')
+ZWNJ_WORD_RE = re.compile('[^\\W_]+(?:\u200c[^\\W_]+)+')
+
+
+def normalize_persian(text):
+    if text is None:
+        return ""
+    if not isinstance(text, str):
+        text = str(text)
+    text = text.translate(PERSIAN_CHAR_MAP)
+    text = DIACRITICS_RE.sub('', text)
+    text = WHITESPACE_RE.sub(' ', text)
+    return text.strip().casefold()
+
+
+def tokenize(text):
+    return [token for token in TOKEN_SPLIT_RE.split(normalize_persian(text)) if token]
+
+
+def normalize_lubricant_name(name):
+    # Catalog key for lubricant free text: "Shell  Omala-220" and "shell omala 220" collapse together
+    return ' '.join(tokenize(name))
+
+
+def search_words(text):
+    """
+    Words of text for full-text search, normalized like normalize_persian. A
+    word written with a ZWNJ is kept both split and joined, so it is found
+    whether the user types the ZWNJ, a space or neither.
+    """
+    if not text:
+        return []
+    if not isinstance(text, str):
+        text = str(text)
+    words = WORD_RE.findall(normalize_persian(text))
+    for compound in ZWNJ_WORD_RE.findall(text):
+        words.extend(WORD_RE.findall(normalize_persian(compound.replace('\u200c', ''))))
+    return words
+
+
+def search_document(values):
+    # Space-delimited on both ends so a plain substring test for ' word' is a word-prefix match
+    words = [word for value in values for word in search_words(value)]
+    return f" {' '.join(words)} " if words else ''
@@ -0,0 +1,212 @@
+import io
+import os
+import re
+import threading
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+
+OVERLAY_XOBJECT_NAME = NameObject('/MachineOverlay')
+STARTXREF_RE = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+
+
+class IncrementalPdfTemplate:
+    """
+    A single-page PDF template kept as raw bytes.
+
+    Each render copies the template bytes verbatim and appends an incremental
+    update (PDF 32000-1, 7.5.6) holding only the overlay form XObject, its
+    resources and a replacement page object. Fonts, images and content
+    streams of the template are never re-serialized.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if not self.data.endswith(b'\n'):
+            self.data += b'\n'
+
+        match = STARTXREF_RE.search(self.data)
+        if match is None:
+            raise ValueError(f"Could not locate startxref in {path}")
+        self.prev_xref = int(match.group(1))
+
+        reader = PdfReader(io.BytesIO(self.data))
+        trailer = reader.trailer
+        self.size = int(trailer['/Size'])
+        self.root = trailer.raw_get('/Root')
+        self.info = trailer.raw_get('/Info') if '/Info' in trailer else None
+        self.file_id = trailer.get('/ID')
+
+        page = reader.pages[0]
+        self.page_ref = page.indirect_reference
+        self.page = DictionaryObject(page)
+        resources = page.get('/Resources')
+        self.resources = DictionaryObject(resources.get_object()) if resources is not None else DictionaryObject()
+        xobjects = self.resources.get('/XObject')
+        self.xobjects = DictionaryObject(xobjects.get_object()) if xobjects is not None else DictionaryObject()
+        contents = page.raw_get('/Contents') if '/Contents' in page else None
+        if contents is None:
+            self.contents = []
+        elif isinstance(contents, IndirectObject) and isinstance(contents.get_object(), ArrayObject):
+            self.contents = list(contents.get_object())
+        elif isinstance(contents, ArrayObject):
+            self.contents = list(contents)
+        else:
+            self.contents = [contents]
+
+    def render(self, overlay):
+        overlay_page = PdfReader(overlay).pages[0]
+        update = _IncrementalUpdate(self.size)
+
+        form = self._overlay_form(overlay_page, update)
+        form_ref = update.add(form)
+        push_ref = update.add(_stream(b'q\n'))
+        pop_ref = update.add(_stream(b'\nQ\nq ' + OVERLAY_XOBJECT_NAME.encode() + b' Do Q\n'))
+
+        xobjects = DictionaryObject(self.xobjects)
+        xobjects[OVERLAY_XOBJECT_NAME] = form_ref
+        resources = DictionaryObject(self.resources)
+        resources[NameObject('/XObject')] = xobjects
+
+        page = DictionaryObject(self.page)
+        page[NameObject('/Resources')] = resources
+        page[NameObject('/Contents')] = ArrayObject([push_ref, *self.contents, pop_ref])
+        update.replace(self.page_ref, page)
+
+        output = io.BytesIO()
+        output.write(self.data)
+        update.write(output, self)
+        output.seek(0)
+        return output
+
+    def _overlay_form(self, overlay_page, update):
+        contents = overlay_page.get_contents()
+        raw = overlay_page.raw_get('/Contents')
+        if isinstance(raw, IndirectObject) and isinstance(raw.get_object(), StreamObject):
+            # Single stream: reuse its encoded bytes as-is
+            form = update.copy_stream(raw.get_object())
+        else:
+            form = _stream(contents.get_data() if contents is not None else b'').flate_encode()
+
+        form[NameObject('/Type')] = NameObject('/XObject')
+        form[NameObject('/Subtype')] = NameObject('/Form')
+        form[NameObject('/BBox')] = ArrayObject(overlay_page.mediabox)
+        resources = overlay_page.get('/Resources')
+        form[NameObject('/Resources')] = update.import_object(resources) if resources is not None else DictionaryObject()
+        return form
+
+
+class _IncrementalUpdate:
+    def __init__(self, first_number):
+        self.next_number = first_number
+        self.objects = {}   # object number -> (generation, object)
+        self.imported = {}  # (idnum, generation) in the overlay -> new reference
+
+    def add(self, obj):
+        number = self.next_number
+        self.next_number += 1
+        self.objects[number] = (0, obj)
+        return IndirectObject(number, 0, None)
+
+    def replace(self, reference, obj):
+        self.objects[reference.idnum] = (reference.generation, obj)
+
+    def import_object(self, obj):
+        # Copy an object graph from the overlay PDF, renumbering indirect objects past the template's /Size
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in self.imported:
+                number = self.next_number
+                self.next_number += 1
+                self.imported[key] = IndirectObject(number, 0, None)
+                self.objects[number] = (0, self.import_object(obj.get_object()))
+            return self.imported[key]
+        if isinstance(obj, StreamObject):
+            return self.copy_stream(obj)
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({
+                key: self.import_object(value)
+                for key, value in obj.items()
+                if key != '/Parent'
+            })
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.import_object(value) for value in obj)
+        return obj
+
+    def copy_stream(self, stream):
+        copy = EncodedStreamObject() if '/Filter' in stream else DecodedStreamObject()
+        copy._data = stream._data
+        for key, value in stream.items():
+            if key != '/Length':
+                copy[key] = self.import_object(value)
+        return copy
+
+    def write(self, output, template):
+        offsets = {}
+        for number in sorted(self.objects):
+            generation, obj = self.objects[number]
+            offsets[number] = (output.tell(), generation)
+            output.write(f"{number} {generation} obj\n".encode())
+            obj.write_to_stream(output)
+            output.write(b"\nendobj\n")
+
+        xref_offset = output.tell()
+        output.write(b"xref\n")
+        for start, numbers in _runs(sorted(offsets)):
+            output.write(f"{start} {len(numbers)}\n".encode())
+            for number in numbers:
+                offset, generation = offsets[number]
+                output.write(f"{offset:010d} {generation:05d} n\r\n".encode())
+
+        trailer = DictionaryObject()
+        trailer[NameObject('/Size')] = NumberObject(max(template.size, self.next_number))
+        trailer[NameObject('/Root')] = template.root
+        if template.info is not None:
+            trailer[NameObject('/Info')] = template.info
+        if template.file_id is not None:
+            trailer[NameObject('/ID')] = template.file_id
+        trailer[NameObject('/Prev')] = NumberObject(template.prev_xref)
+        output.write(b"trailer\n")
+        trailer.write_to_stream(output)
+        output.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+def _stream(data):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return stream
+
+
+def _runs(numbers):
+    run = []
+    for number in numbers:
+        if run and number != run[-1] + 1:
+            yield run[0], run
+            run = []
+        run.append(number)
+    if run:
+        yield run[0], run
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_incremental_template(path):
+    # Parsed once per process; reloaded if the template file is replaced on disk
+    mtime = os.path.getmtime(path)
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, IncrementalPdfTemplate(path))
+            _templates[path] = cached
+        return cached[1]
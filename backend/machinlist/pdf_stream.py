@@ -0,0 +1,91 @@
+import io
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject
+
+PAGES_ID = 1
+CATALOG_ID = 2
+
+
+class PdfStreamWriter:
+    """
+    Writes one PDF front to back out of separately rendered PDFs (chunks).
+
+    reportlab keeps every page of a canvas until save(), so a long document is
+    rendered as a series of small chunk PDFs instead. Each chunk's objects are
+    renumbered into the output and handed back as bytes right away; only the
+    byte offsets and page object numbers are kept, and the shared page tree,
+    catalog and cross-reference table are written by close().
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = [None, None, None]   # object number -> byte offset; 1 and 2 are written last
+        self.kids = []
+
+    def _write(self, out, data):
+        out.write(data)
+        self.offset += len(data)
+
+    def _object(self, out, number, obj):
+        self.offsets[number] = self.offset
+        body = io.BytesIO()
+        obj.write_to_stream(body)
+        self._write(out, b'%d 0 obj\n' % number + body.getvalue() + b'\nendobj\n')
+
+    def open(self):
+        out = io.BytesIO()
+        self._write(out, b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        return out.getvalue()
+
+    def add(self, data):
+        """Append the pages of the PDF in data; returns the bytes to send."""
+        reader = PdfReader(io.BytesIO(data))
+        trailer = reader.trailer
+        root = trailer.raw_get('/Root')
+        pages = reader.get_object(root).raw_get('/Pages')
+        # The chunk's own catalog, page tree and info dict are replaced by the output's
+        skip = {root.idnum, pages.idnum}
+        if '/Info' in trailer:
+            skip.add(trailer.raw_get('/Info').idnum)
+
+        numbers = {}
+        for idnum in range(1, trailer['/Size']):
+            if idnum not in skip:
+                numbers[idnum] = len(self.offsets)
+                self.offsets.append(None)
+        page_ids = [page.indirect_reference.idnum for page in reader.pages]
+
+        def renumber(obj):
+            if isinstance(obj, IndirectObject):
+                return IndirectObject(PAGES_ID if obj.idnum == pages.idnum else numbers[obj.idnum], 0, None)
+            # Raw access: the pypdf accessors would resolve references instead of returning them
+            if isinstance(obj, DictionaryObject):
+                for key, value in list(dict.items(obj)):
+                    dict.__setitem__(obj, key, renumber(value))
+            elif isinstance(obj, ArrayObject):
+                for index, value in enumerate(list(list.__iter__(obj))):
+                    list.__setitem__(obj, index, renumber(value))
+            return obj
+
+        out = io.BytesIO()
+        for idnum, number in numbers.items():
+            obj = reader.get_object(idnum)
+            self._object(out, number, renumber(obj))
+        self.kids.extend(numbers[idnum] for idnum in page_ids)
+        return out.getvalue()
+
+    def close(self):
+        """Page tree, catalog, cross-reference table and trailer."""
+        out = io.BytesIO()
+        kids = ' '.join(f'{number} 0 R' for number in self.kids)
+        self.offsets[PAGES_ID] = self.offset
+        self._write(out, f'{PAGES_ID} 0 obj\n<< /Type /Pages /Count {len(self.kids)} /Kids [ {kids} ] >>\nendobj\n'.encode())
+        self.offsets[CATALOG_ID] = self.offset
+        self._write(out, f'{CATALOG_ID} 0 obj\n<< /Type /Catalog /Pages {PAGES_ID} 0 R >>\nendobj\n'.encode())
+
+        xref = self.offset
+        size = len(self.offsets)
+        self._write(out, f'xref\n0 {size}\n0000000000 65535 f \n'.encode())
+        self._write(out, ''.join(f'{offset:010d} 00000 n \n' for offset in self.offsets[1:]).encode())
+        self._write(out, f'trailer\n<< /Size {size} /Root {CATALOG_ID} 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+        return out.getvalue()
@@ -2,30 +2,16 @@ import io
 import os
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 import arabic_reshaper
 from bidi.algorithm import get_display
 from pypdf import PdfReader, PdfWriter
+from django.conf import settings
+from .pdf_incremental import get_incremental_template
+from .fonts import font_registry
 
 def register_persian_font():
-    # Try common Persian-supporting fonts on Windows
-    possible_fonts = [
-        ("Tahoma", "C:/Windows/Fonts/tahoma.ttf"),
-        ("Arial", "C:/Windows/Fonts/arial.ttf"),
-        ("Segoe UI", "C:/Windows/Fonts/segoeui.ttf")
-    ]
-    
-    for font_name, font_path in possible_fonts:
-        if os.path.exists(font_path):
-            try:
-                pdfmetrics.registerFont(TTFont(font_name, font_path))
-                return font_name
-            except Exception as e:
-                print(f"Error registering font {font_name}: {e}")
-                continue
-                
-    return 'Helvetica'
+    # Resolved and registered once per process, see fonts.FontRegistry
+    return font_registry.get_font_name()
 
 def reshape_text(text):
     if not text:
@@ -36,16 +22,14 @@ def reshape_text(text):
     bidi_text = get_display(reshaped_text)
     return bidi_text
 
-def fill_machine_pdf(machine_data):
+def get_template_path():
     # Path to template
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     # Go up one more level to project root
     project_root = os.path.dirname(base_dir)
-    template_path = os.path.join(project_root, "Files", "001-فرم شناسنامه ماشین آلات.pdf")
-
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template not found at {template_path}")
+    return os.path.join(project_root, "Files", "001-فرم شناسنامه ماشین آلات.pdf")
 
+def render_machine_overlay(machine_data):
     # Create text overlay
     packet = io.BytesIO()
     c = canvas.Canvas(packet, pagesize=A4)
@@ -201,6 +185,21 @@ def fill_machine_pdf(machine_data):
 
     c.save()
     packet.seek(0)
+    return packet
+
+def fill_machine_pdf(machine_data, incremental=None):
+    template_path = get_template_path()
+
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Template not found at {template_path}")
+
+    packet = render_machine_overlay(machine_data)
+
+    if incremental is None:
+        incremental = getattr(settings, 'PDF_EXPORT_INCREMENTAL', True)
+    if incremental:
+        return get_incremental_template(template_path).render(packet)
+
     new_pdf = PdfReader(packet)
     
     # Read existing PDF
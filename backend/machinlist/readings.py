@@ -0,0 +1,376 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import MachineRegistration, MachineReading, MachineReadingRollup, ReadingRollupState
+from .scoping import scope_queryset
+
+DEFAULTS = {
+    'MAX_BATCH': 5000,             # readings accepted per ingest request
+    'TOLERANCE': 0.1,              # a reading more than 10% above the nominal rating is out of spec
+    'MAX_FUTURE_SECONDS': 300,     # clock skew allowed on recorded_at
+    'SETTLE_SECONDS': 30,          # readings younger than this are left for the next rollup run
+    'ROLLUP_BATCH': 50000,         # raw readings aggregated per rollup transaction
+    'RAW_RETENTION_DAYS': 30,
+    'HOURLY_RETENTION_DAYS': 365,  # daily rollups are kept indefinitely
+    'RAW_MAX_SPAN_HOURS': 6,       # longer raw queries are answered from the rollups instead
+    'MAX_POINTS': 5000,
+}
+
+# Metric -> MachineRegistration column holding its rating
+SPEC_FIELDS = {
+    MachineReading.CURRENT: 'nominal_current',
+    MachineReading.POWER: 'nominal_power',
+    MachineReading.PRESSURE: 'operating_pressure',
+}
+
+TRUNC = {
+    MachineReadingRollup.HOUR: TruncHour,
+    MachineReadingRollup.DAY: TruncDay,
+}
+
+METRICS = {metric for metric, _ in MachineReading.METRIC_CHOICES}
+
+
+def get_readings_setting(name):
+    return getattr(settings, 'MACHINE_READINGS', {}).get(name, DEFAULTS[name])
+
+
+class ReadingError(Exception):
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+
+
+# Ingestion
+
+def _parse_time(value):
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        if isinstance(value, str):
+            parsed = parse_datetime(value)
+            if parsed is not None and timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            return parsed
+    except (ValueError, OverflowError, OSError):
+        # Impossible dates (2026-02-30) and timestamps out of range
+        pass
+    return None
+
+
+def _parse_row(row, latest):
+    if not isinstance(row, dict):
+        raise ValueError('Each reading must be an object')
+    try:
+        machine_id = int(row['machine'])
+        value = float(row['value'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("'machine' and 'value' must be numbers")
+    if not math.isfinite(value):
+        raise ValueError("'value' must be finite")
+    metric = row.get('metric')
+    if metric not in METRICS:
+        raise ValueError(f"'metric' must be one of: {', '.join(sorted(METRICS))}")
+    recorded_at = _parse_time(row.get('recorded_at'))
+    if recorded_at is None:
+        raise ValueError("'recorded_at' must be an ISO 8601 datetime or epoch seconds")
+    if recorded_at > latest:
+        raise ValueError("'recorded_at' is in the future")
+    return machine_id, metric, value, recorded_at
+
+
+def ingest_readings(rows, user):
+    """
+    Validate and append a batch of readings ({machine, metric, value,
+    recorded_at}). The batch is rejected as a whole if any row is invalid or
+    names a machine that is decommissioned or outside the user's scopes. The
+    registry is read once per batch, for the ratings the readings are judged
+    against. Returns the number of readings stored.
+    """
+    if not isinstance(rows, list) or not rows:
+        raise ReadingError('Send a non-empty list of readings.')
+    if len(rows) > get_readings_setting('MAX_BATCH'):
+        raise ReadingError(f'At most {get_readings_setting("MAX_BATCH")} readings per request.')
+
+    latest = timezone.now() + timedelta(seconds=get_readings_setting('MAX_FUTURE_SECONDS'))
+    parsed, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            parsed.append(_parse_row(row, latest))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise ReadingError('Invalid readings.', errors[:50])
+
+    machine_ids = {machine_id for machine_id, _, _, _ in parsed}
+    ratings = {
+        row['pk']: row
+        for row in scope_queryset(MachineRegistration.objects.filter(pk__in=machine_ids), user)
+        .values('pk', *SPEC_FIELDS.values())
+    }
+    unknown = machine_ids - set(ratings)
+    if unknown:
+        raise ReadingError('Unknown machines.', [{'machine': machine_id} for machine_id in sorted(unknown)[:50]])
+
+    factor = 1 + get_readings_setting('TOLERANCE')
+    received_at = timezone.now()
+    readings = []
+    for machine_id, metric, value, recorded_at in parsed:
+        rating = ratings[machine_id].get(SPEC_FIELDS.get(metric))
+        readings.append(MachineReading(
+            machine_id=machine_id,
+            metric=metric,
+            value=value,
+            out_of_spec=bool(rating) and value > rating * factor,
+            recorded_at=recorded_at,
+            received_at=received_at,
+        ))
+    MachineReading.objects.bulk_create(readings, batch_size=1000)
+    return len(readings)
+
+
+# Rollups
+
+def _aggregate(readings, period):
+    return (
+        readings.annotate(bucket=TRUNC[period]('recorded_at'))
+        .values('machine_id', 'metric', 'bucket')
+        .annotate(
+            count=Count('id'),
+            total=Sum('value'),
+            minimum=Min('value'),
+            maximum=Max('value'),
+            out_of_spec=Count('id', filter=Q(out_of_spec=True)),
+        )
+        .order_by()
+    )
+
+
+def _merge(period, groups):
+    # Fold freshly aggregated groups into the stored buckets: one read, one insert and one update batch
+    if not groups:
+        return
+    existing = {
+        (rollup.machine_id, rollup.metric, rollup.bucket): rollup
+        for rollup in MachineReadingRollup.objects.filter(
+            period=period,
+            machine_id__in={group['machine_id'] for group in groups},
+            bucket__in={group['bucket'] for group in groups},
+        )
+    }
+    created, updated = [], []
+    for group in groups:
+        key = (group['machine_id'], group['metric'], group['bucket'])
+        rollup = existing.get(key)
+        if rollup is None:
+            created.append(MachineReadingRollup(period=period, **group))
+            continue
+        rollup.count += group['count']
+        rollup.total += group['total']
+        rollup.minimum = min(rollup.minimum, group['minimum'])
+        rollup.maximum = max(rollup.maximum, group['maximum'])
+        rollup.out_of_spec += group['out_of_spec']
+        updated.append(rollup)
+    MachineReadingRollup.objects.bulk_create(created, batch_size=1000)
+    MachineReadingRollup.objects.bulk_update(updated, ['count', 'total', 'minimum', 'maximum', 'out_of_spec'], batch_size=1000)
+
+
+def rollup_readings(batch_size=None):
+    """
+    Fold readings appended since the last run into the hourly and daily
+    rollups, batch_size readings per transaction. Each batch advances the
+    watermark in the same transaction, so every reading is counted exactly
+    once however late it arrives. Returns the number of readings rolled up.
+    """
+    batch_size = batch_size or get_readings_setting('ROLLUP_BATCH')
+    rolled = 0
+    while True:
+        with transaction.atomic():
+            # The row lock also keeps two concurrent runs from folding the same batch
+            state, _ = ReadingRollupState.objects.select_for_update().get_or_create(pk=1)
+            settled = timezone.now() - timedelta(seconds=get_readings_setting('SETTLE_SECONDS'))
+            pending = MachineReading.objects.filter(id__gt=state.last_reading_id, received_at__lt=settled)
+            upper = list(pending.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size])
+            upper = upper[0] if upper else pending.aggregate(upper=Max('id'))['upper']
+            if upper is None:
+                return rolled
+            batch = MachineReading.objects.filter(id__gt=state.last_reading_id, id__lte=upper)
+            for period in TRUNC:
+                _merge(period, list(_aggregate(batch, period)))
+            rolled += batch.count()
+            state.last_reading_id = upper
+            state.save(update_fields=['last_reading_id', 'updated_at'])
+
+
+def delete_machine_readings(machine_ids):
+    # Readings and rollups refer to machines by plain id (no cascade), so deleted machines take them along here
+    for model in (MachineReading, MachineReadingRollup):
+        readings = model.objects.filter(machine_id__in=machine_ids)
+        readings._raw_delete(readings.db)
+
+
+def rolled_up_to():
+    state = ReadingRollupState.objects.filter(pk=1).first()
+    return state.last_reading_id if state else 0
+
+
+def prune_readings(raw_days=None, hourly_days=None, batch_size=10000):
+    """
+    Delete raw readings past raw_days that are already rolled up, and hourly
+    rollups past hourly_days. Raw rows go in id-ordered batches with plain
+    DELETEs so no single statement holds locks for long. Returns (raw, hourly).
+    """
+    now = timezone.now()
+    raw_days = get_readings_setting('RAW_RETENTION_DAYS') if raw_days is None else raw_days
+    hourly_days = get_readings_setting('HOURLY_RETENTION_DAYS') if hourly_days is None else hourly_days
+
+    expired = MachineReading.objects.filter(id__lte=rolled_up_to(), recorded_at__lt=now - timedelta(days=raw_days))
+    raw = 0
+    while True:
+        upper = list(expired.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size])
+        upper = upper[0] if upper else expired.aggregate(upper=Max('id'))['upper']
+        if upper is None:
+            break
+        chunk = expired.filter(id__lte=upper)
+        raw += chunk._raw_delete(chunk.db)
+
+    hourly = MachineReadingRollup.objects.filter(
+        period=MachineReadingRollup.HOUR, bucket__lt=now - timedelta(days=hourly_days)
+    )
+    return raw, hourly._raw_delete(hourly.db)
+
+
+# Queries
+
+def _tail(machine_ids, metric, start, end):
+    # Readings not rolled up yet, so answers are current without waiting for the next rollup run
+    readings = MachineReading.objects.filter(id__gt=rolled_up_to(), recorded_at__gte=start, recorded_at__lt=end)
+    if machine_ids is not None:
+        readings = readings.filter(machine_id__in=machine_ids)
+    if metric:
+        readings = readings.filter(metric=metric)
+    return readings
+
+
+def pick_resolution(start, end):
+    span = end - start
+    if span <= timedelta(hours=get_readings_setting('RAW_MAX_SPAN_HOURS')):
+        return 'raw'
+    if span <= timedelta(days=31) and start >= timezone.now() - timedelta(days=get_readings_setting('HOURLY_RETENTION_DAYS')):
+        return MachineReadingRollup.HOUR
+    return MachineReadingRollup.DAY
+
+
+def reading_series(machine, metric, start, end, resolution=None):
+    """
+    One machine's readings of metric between start and end, either raw or as
+    hourly/daily buckets (count, avg, min, max, out_of_spec) merged from the
+    rollups and the not-yet-rolled-up tail.
+    """
+    resolution = resolution or pick_resolution(start, end)
+    rating_field = SPEC_FIELDS.get(metric)
+    rating = getattr(machine, rating_field) if rating_field else None
+    result = {
+        'machine': machine.pk,
+        'metric': metric,
+        'resolution': resolution,
+        'nominal': rating,
+        'limit': rating * (1 + get_readings_setting('TOLERANCE')) if rating else None,
+    }
+    limit = get_readings_setting('MAX_POINTS')
+
+    if resolution == 'raw':
+        if end - start > timedelta(hours=get_readings_setting('RAW_MAX_SPAN_HOURS')):
+            raise ReadingError(f'Raw readings are limited to {get_readings_setting("RAW_MAX_SPAN_HOURS")} hours; use hour or day.')
+        rows = (
+            MachineReading.objects.filter(machine_id=machine.pk, metric=metric, recorded_at__gte=start, recorded_at__lt=end)
+            .order_by('recorded_at')
+            .values_list('recorded_at', 'value', 'out_of_spec')[:limit]
+        )
+        result['series'] = [{'t': t, 'value': value, 'out_of_spec': flag} for t, value, flag in rows]
+        result['out_of_spec'] = sum(point['out_of_spec'] for point in result['series'])
+        return result
+
+    buckets = {}
+    stored = (
+        MachineReadingRollup.objects.filter(
+            machine_id=machine.pk, metric=metric, period=resolution, bucket__gte=start, bucket__lt=end
+        )
+        .values('bucket', 'count', 'total', 'minimum', 'maximum', 'out_of_spec')
+    )
+    for group in list(stored) + list(_aggregate(_tail([machine.pk], metric, start, end), resolution)):
+        bucket = buckets.get(group['bucket'])
+        if bucket is None:
+            buckets[group['bucket']] = dict(group)
+            continue
+        bucket['count'] += group['count']
+        bucket['total'] += group['total']
+        bucket['minimum'] = min(bucket['minimum'], group['minimum'])
+        bucket['maximum'] = max(bucket['maximum'], group['maximum'])
+        bucket['out_of_spec'] += group['out_of_spec']
+
+    result['series'] = [
+        {
+            't': key,
+            'count': bucket['count'],
+            'avg': bucket['total'] / bucket['count'],
+            'min': bucket['minimum'],
+            'max': bucket['maximum'],
+            'out_of_spec': bucket['out_of_spec'],
+        }
+        for key, bucket in sorted(buckets.items())[:limit]
+    ]
+    result['out_of_spec'] = sum(point['out_of_spec'] for point in result['series'])
+    return result
+
+
+def out_of_spec_counts(user, start, end, metric=None):
+    """
+    Machines with out-of-spec readings between start and end, worst first:
+    [{machine, machine_code, machine_name, metric, readings, out_of_spec}].
+    """
+    period = pick_resolution(start, end)
+    if period == 'raw':
+        period = MachineReadingRollup.HOUR
+    stored = MachineReadingRollup.objects.filter(period=period, bucket__gte=start, bucket__lt=end)
+    if metric:
+        stored = stored.filter(metric=metric)
+
+    totals = {}
+    groups = list(
+        stored.values('machine_id', 'metric').annotate(readings=Sum('count'), flagged=Sum('out_of_spec')).order_by()
+    ) + list(
+        _tail(None, metric, start, end).values('machine_id', 'metric')
+        .annotate(readings=Count('id'), flagged=Count('id', filter=Q(out_of_spec=True))).order_by()
+    )
+    for group in groups:
+        entry = totals.setdefault((group['machine_id'], group['metric']), [0, 0])
+        entry[0] += group['readings']
+        entry[1] += group['flagged']
+
+    flagged_ids = {machine_id for (machine_id, _), (_, flagged) in totals.items() if flagged}
+    machines = {
+        row['pk']: row
+        for row in scope_queryset(MachineRegistration.all_objects.filter(pk__in=flagged_ids), user)
+        .values('pk', 'machine_code', 'machine_name')
+    }
+    results = [
+        {
+            'machine': machine_id,
+            'machine_code': machines[machine_id]['machine_code'],
+            'machine_name': machines[machine_id]['machine_name'],
+            'metric': metric_name,
+            'readings': readings,
+            'out_of_spec': flagged,
+        }
+        for (machine_id, metric_name), (readings, flagged) in totals.items()
+        if flagged and machine_id in machines
+    ]
+    results.sort(key=lambda row: (-row['out_of_spec'], row['machine_code']))
+    return {'resolution': period, 'results': results}
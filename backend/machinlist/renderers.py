@@ -0,0 +1,79 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    Renders a list of objects column by column: field names once, then one
+    value array per field. Low-cardinality fields (the known ones, plus any
+    string column with few distinct values) are dictionary encoded as indexes
+    into ``dictionaries[field]``; nested object lists such as lubricants become
+    arrays of rows described by ``nested_fields[field]``. Selected with
+    ``Accept: application/vnd.machinlist.columnar+json`` or ``?format=columnar``.
+    Anything that isn't a list (detail views, errors) renders as plain JSON
+    with the plain JSON content type.
+    """
+    media_type = 'application/vnd.machinlist.columnar+json'
+    format = 'columnar'
+
+    dictionary_fields = (
+        'section',
+        'criticality_level',
+        'current_type',
+        'automation_level',
+        'foundation_type',
+        'location_name',
+        'location_code',
+        'phase_count',
+    )
+    # Other string columns are dictionary encoded when distinct values <= rows * ratio
+    adaptive_ratio = 0.25
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is None or response.status_code < 400:
+            if isinstance(data, list):
+                return super().render(self.to_columns(data), accepted_media_type, renderer_context)
+            if isinstance(data, dict) and isinstance(data.get('results'), list):
+                return super().render({**data, 'results': self.to_columns(data['results'])}, accepted_media_type, renderer_context)
+        # Not columnar, so don't label it as such
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return super().render(data, JSONRenderer.media_type, renderer_context)
+
+    def to_columns(self, rows):
+        fields = list(rows[0].keys()) if rows else []
+        columns = []
+        dictionaries = {}
+        nested_fields = {}
+
+        for field in fields:
+            values = [row.get(field) for row in rows]
+            present = [value for value in values if value is not None]
+
+            if present and all(isinstance(value, list) for value in present):
+                keys = next((list(item.keys()) for value in present for item in value if isinstance(item, dict)), None)
+                if keys is not None:
+                    nested_fields[field] = keys
+                    values = [
+                        None if value is None else [[item.get(key) for key in keys] for item in value]
+                        for value in values
+                    ]
+            elif field in self.dictionary_fields or self.is_low_cardinality(present, len(rows)):
+                index = {}
+                values = [None if value is None else index.setdefault(value, len(index)) for value in values]
+                dictionaries[field] = list(index)
+            columns.append(values)
+
+        return {
+            'format': 'columnar',
+            'count': len(rows),
+            'fields': fields,
+            'columns': columns,
+            'dictionaries': dictionaries,
+            'nested_fields': nested_fields,
+        }
+
+    def is_low_cardinality(self, present, row_count):
+        if not present or not all(isinstance(value, str) for value in present):
+            return False
+        return len(set(present)) <= row_count * self.adaptive_ratio
@@ -0,0 +1,63 @@
+import hashlib
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from .models import MachineAccessScope
+
+
+def scopes_required():
+    # False keeps users without any assignment unrestricted, so scopes can be rolled out gradually
+    return getattr(settings, 'MACHINE_SCOPES_REQUIRED', False)
+
+
+def get_user_scopes(user):
+    """
+    (section, location_code) pairs the user may access, or None when the user
+    is unrestricted. Loaded once per user object (i.e. once per request).
+    """
+    if not user or not user.is_authenticated:
+        return []
+    if user.is_superuser or user.role == 'admin':
+        return None
+    if not hasattr(user, '_machine_scopes'):
+        user._machine_scopes = list(
+            MachineAccessScope.objects.filter(user=user).order_by('section', 'location_code').values_list('section', 'location_code')
+        )
+    if not user._machine_scopes and not scopes_required():
+        return None
+    return user._machine_scopes
+
+
+def scope_queryset(queryset, user, section_field='section', location_field='location_code'):
+    """
+    Restrict any queryset with section/location columns to the user's scopes.
+    The check is an EXISTS semi-join against the user's (indexed) scope rows,
+    so the database discards other rows before they are fetched or counted.
+    """
+    scopes = get_user_scopes(user)
+    if scopes is None:
+        return queryset
+    if not scopes:
+        return queryset.none()
+    granted = MachineAccessScope.objects.filter(user=user).filter(
+        Q(section='') | Q(section=OuterRef(section_field)),
+        Q(location_code='') | Q(location_code=OuterRef(location_field)),
+    )
+    return queryset.filter(Exists(granted))
+
+
+def can_access(user, section, location_code):
+    scopes = get_user_scopes(user)
+    if scopes is None:
+        return True
+    return any(
+        scope_section in ('', section) and scope_location in ('', location_code)
+        for scope_section, scope_location in scopes
+    )
+
+
+def scope_key(user):
+    # Cache key component shared by every user with the same grants
+    scopes = get_user_scopes(user)
+    if scopes is None:
+        return 'all'
+    return hashlib.sha1(repr(scopes).encode('utf-8')).hexdigest()[:16]
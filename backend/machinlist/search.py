@@ -0,0 +1,73 @@
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from .models import MachineRegistration
+from .normalization import search_words
+
+MAX_TERMS = 8
+REFRESH_BATCH = 500
+
+
+def machine_search_vector():
+    """
+    The weighted tsvector over the normalized search columns. Migration 0013
+    builds a GIN index over this exact expression, so queries must use it
+    unchanged. The 'simple' configuration does no stemming (there is no Persian
+    dictionary); normalization happens in Python before the text is stored.
+    """
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('search_title', weight='A', config='simple')
+        + SearchVector('search_body', weight='B', config='simple')
+    )
+
+
+def search_terms(query):
+    terms = []
+    for word in search_words(query):
+        if word not in terms:
+            terms.append(word)
+    return terms[:MAX_TERMS]
+
+
+def search_machines(queryset, query):
+    """
+    Machines matching every word of query as a word prefix, best match first.
+    On PostgreSQL this is an index-backed tsquery ranked by ts_rank, with name,
+    code, model, serial and company matches weighted above addresses and
+    descriptions. Other databases get the same matching as a substring scan.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    if connections[queryset.db].vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        vector = machine_search_vector()
+        tsquery = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config='simple')
+        return (
+            queryset.annotate(search=vector)
+            .filter(search=tsquery)
+            .annotate(rank=SearchRank(vector, tsquery))
+            .order_by('-rank', 'machine_code')
+        )
+
+    matches = Q()
+    rank = Value(0)
+    for term in terms:
+        needle = f' {term}'
+        matches &= Q(search_title__contains=needle) | Q(search_body__contains=needle)
+        rank += Case(When(search_title__contains=needle, then=Value(2)), default=Value(1), output_field=IntegerField())
+    return queryset.filter(matches).annotate(rank=rank).order_by('-rank', 'machine_code')
+
+
+def refresh_search_documents(ids):
+    # For writes that bypass save(), e.g. queryset.update() in bulk_update_machines
+    fields = ('pk',) + MachineRegistration.SEARCH_TITLE_FIELDS + MachineRegistration.SEARCH_BODY_FIELDS
+    ids = list(ids)
+    for start in range(0, len(ids), REFRESH_BATCH):
+        machines = list(MachineRegistration.all_objects.filter(pk__in=ids[start:start + REFRESH_BATCH]).only(*fields))
+        for machine in machines:
+            machine.update_search_documents()
+        MachineRegistration.all_objects.bulk_update(machines, ['search_title', 'search_body'])
@@ -1,5 +1,12 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
-from .models import User, MachineRegistration, MachineLubricant
+import os
+from .models import (
+    User, MachineRegistration, MachineLubricant, ArchivedMachine, Lubricant, LubricantAlias, MachineAccessScope,
+    MachineAttachment, AttachmentUpload, Location,
+)
+from .normalization import normalize_lubricant_name
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -19,15 +26,31 @@ class UserSerializer(serializers.ModelSerializer):
 class MachineLubricantSerializer(serializers.ModelSerializer):
     class Meta:
         model = MachineLubricant
-        fields = ['row_number', 'lubricant_type', 'alternative_lubricant_type', 'description']
+        fields = ['row_number', 'lubricant_type', 'alternative_lubricant_type', 'description', 'lubricant', 'alternative_lubricant']
+        read_only_fields = ['lubricant', 'alternative_lubricant']
 
 class MachineRegistrationSerializer(serializers.ModelSerializer):
     lubricants = MachineLubricantSerializer(many=True, required=False)
 
     class Meta:
         model = MachineRegistration
-        fields = '__all__'
+        exclude = ['search_title', 'search_body']
+        read_only_fields = ['decommissioned_at']
+
+    def validate(self, attrs):
+        # A machine placed in the tree takes its location code and name from the node
+        location = attrs.get('location')
+        if location is not None:
+            attrs['location_code'] = location.code
+            attrs['location_name'] = location.name
+        elif 'location' not in attrs and self.instance is not None and self.instance.location_id is not None:
+            # Editing the flat code or name by hand takes the machine out of the tree
+            if attrs.get('location_code', self.instance.location_code) != self.instance.location_code or \
+                    attrs.get('location_name', self.instance.location_name) != self.instance.location_name:
+                attrs['location'] = None
+        return attrs
 
+    @transaction.atomic
     def create(self, validated_data):
         lubricants_data = validated_data.pop('lubricants', [])
         machine = MachineRegistration.objects.create(**validated_data)
@@ -40,6 +63,7 @@ class MachineRegistrationSerializer(serializers.ModelSerializer):
             )
         return machine
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         lubricants_data = validated_data.pop('lubricants', None)
         
@@ -58,4 +82,215 @@ class MachineRegistrationSerializer(serializers.ModelSerializer):
                     **lubricant_data
                 )
         
-        return instance
\ No newline at end of file
+        return instance
+
+class ArchivedMachineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedMachine
+        fields = '__all__'
+
+class LubricantSerializer(serializers.ModelSerializer):
+    aliases = serializers.ListField(child=serializers.CharField(max_length=255), required=False, write_only=True)
+    machine_count = serializers.IntegerField(read_only=True)
+    alternative_machine_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Lubricant
+        fields = ['id', 'name', 'normalized_name', 'aliases', 'machine_count', 'alternative_machine_count', 'created_at']
+        read_only_fields = ['normalized_name', 'created_at']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['aliases'] = [alias.alias for alias in instance.aliases.all()]
+        return data
+
+    def validate_name(self, value):
+        normalized = normalize_lubricant_name(value)
+        if not normalized:
+            raise serializers.ValidationError("Name must contain letters or digits.")
+        clash = Lubricant.objects.filter(normalized_name=normalized)
+        alias_clash = LubricantAlias.objects.filter(normalized_alias=normalized)
+        if self.instance is not None:
+            clash = clash.exclude(pk=self.instance.pk)
+            alias_clash = alias_clash.exclude(lubricant=self.instance)
+        if clash.exists():
+            raise serializers.ValidationError("A lubricant with this name already exists.")
+        if alias_clash.exists():
+            raise serializers.ValidationError("This name is an alias of another lubricant.")
+        return value
+
+    def validate_aliases(self, value):
+        # Spellings that normalize alike are one alias; the first one given is kept
+        aliases = {}
+        for alias in value:
+            normalized = normalize_lubricant_name(alias)
+            if not normalized:
+                raise serializers.ValidationError("Aliases must contain letters or digits.")
+            aliases.setdefault(normalized, alias)
+
+        clash = LubricantAlias.objects.filter(normalized_alias__in=aliases)
+        # Entries with aliases of their own are curated; bare ones (auto-created from free text) are merged on save
+        curated = Lubricant.objects.filter(normalized_name__in=aliases, aliases__isnull=False)
+        if self.instance is not None:
+            clash = clash.exclude(lubricant=self.instance)
+            curated = curated.exclude(pk=self.instance.pk)
+        if clash.exists():
+            raise serializers.ValidationError("Alias already belongs to another lubricant.")
+        if curated.exists():
+            raise serializers.ValidationError("Alias is the name of another lubricant.")
+        return list(aliases.values())
+
+    @transaction.atomic
+    def create(self, validated_data):
+        aliases = validated_data.pop('aliases', [])
+        validated_data['normalized_name'] = normalize_lubricant_name(validated_data['name'])
+        lubricant = Lubricant.objects.create(**validated_data)
+        self._save_aliases(lubricant, aliases)
+        return lubricant
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        aliases = validated_data.pop('aliases', None)
+        if 'name' in validated_data:
+            instance.name = validated_data['name']
+            instance.normalized_name = normalize_lubricant_name(instance.name)
+        instance.save()
+        if aliases is not None:
+            instance.aliases.all().delete()
+            self._save_aliases(instance, aliases)
+        return instance
+
+    def _save_aliases(self, lubricant, aliases):
+        for alias in aliases:
+            if normalize_lubricant_name(alias) == lubricant.normalized_name:
+                continue
+            alias = LubricantAlias(lubricant=lubricant, alias=alias)
+            alias.save()
+            # Rows already linked to an entry auto-created under this spelling move over to the lubricant
+            for duplicate in Lubricant.objects.filter(normalized_name=alias.normalized_alias).exclude(pk=lubricant.pk):
+                duplicate.merge_into(lubricant)
+
+class MachineBulkSerializer(serializers.Serializer):
+    """Selection (ids and/or filter) plus, for bulk updates, the field patch."""
+    # Unique and bookkeeping columns cannot be set to one value across many machines
+    PATCH_EXCLUDED = ('id', 'machine_name', 'machine_code', 'machine_model', 'machine_serial', 'lubricants',
+                      'created_at', 'updated_at', 'decommissioned_at')
+    FILTER_FIELDS = ('section', 'location_code', 'location_name', 'criticality_level', 'automation_level',
+                     'foundation_type', 'current_type', 'manufacture_year')
+
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False, max_length=10000)
+    filter = serializers.DictField(required=False, allow_empty=False)
+    patch = serializers.DictField(required=False, allow_empty=False)
+
+    def validate_filter(self, value):
+        unknown = set(value) - set(self.FILTER_FIELDS)
+        if unknown:
+            raise serializers.ValidationError(f"Cannot filter on: {', '.join(sorted(unknown))}")
+        # Converted here so a value the column cannot hold is a 400, not an error from the query
+        filters = {}
+        for name, raw in value.items():
+            try:
+                filters[name] = MachineRegistration._meta.get_field(name).to_python(raw)
+            except DjangoValidationError as e:
+                raise serializers.ValidationError({name: e.messages})
+        return filters
+
+    def validate_patch(self, value):
+        excluded = set(value) & set(self.PATCH_EXCLUDED)
+        if excluded:
+            raise serializers.ValidationError(f"Cannot bulk update: {', '.join(sorted(excluded))}")
+        machine = MachineRegistrationSerializer(data=value, partial=True)
+        machine.is_valid(raise_exception=True)
+        unknown = set(value) - set(machine.validated_data)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        patch = machine.validated_data
+        if ('location_code' in patch or 'location_name' in patch) and 'location' not in patch:
+            # As for a single machine, setting the flat code or name by hand takes the machines out of the tree
+            patch['location'] = None
+        return patch
+
+    def validate(self, attrs):
+        if not attrs.get('ids') and not attrs.get('filter'):
+            raise serializers.ValidationError("Provide 'ids' and/or 'filter' to select machines.")
+        if self.context.get('require_patch') and not attrs.get('patch'):
+            raise serializers.ValidationError({'patch': "This field is required."})
+        return attrs
+
+class MachineAccessScopeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MachineAccessScope
+        fields = ['section', 'location_code']
+        extra_kwargs = {'section': {'default': ''}, 'location_code': {'default': ''}}
+
+    def validate(self, attrs):
+        if not attrs.get('section') and not attrs.get('location_code'):
+            raise serializers.ValidationError("Give a section, a location code or both.")
+        return attrs
+
+class MachineAttachmentSerializer(serializers.ModelSerializer):
+    sha256 = serializers.CharField(source='blob_id', read_only=True)
+    size = serializers.IntegerField(source='blob.size', read_only=True)
+    content_type = serializers.CharField(source='blob.content_type', read_only=True)
+    thumbnail_status = serializers.CharField(source='blob.thumbnail_status', read_only=True)
+
+    class Meta:
+        model = MachineAttachment
+        fields = ['id', 'machine', 'kind', 'filename', 'sha256', 'size', 'content_type', 'thumbnail_status',
+                  'uploaded_by', 'created_at']
+        read_only_fields = ['id', 'machine', 'uploaded_by', 'created_at']
+
+    def validate_filename(self, value):
+        return os.path.basename(value.replace('\\', '/')).strip() or 'file'
+
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+    # Optional: lets the server skip the transfer when it already stores this content
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, write_only=True)
+    # Set once the file is stored; a complete upload left for the background has completed_at until then
+    attachment = MachineAttachmentSerializer(read_only=True)
+
+    class Meta:
+        model = AttachmentUpload
+        fields = ['id', 'machine', 'kind', 'filename', 'size', 'received', 'sha256', 'completed_at', 'attachment', 'created_at']
+        read_only_fields = ['id', 'received', 'completed_at', 'attachment', 'created_at']
+        extra_kwargs = {'size': {'min_value': 1}}
+
+    def validate_filename(self, value):
+        return os.path.basename(value.replace('\\', '/')).strip() or 'file'
+
+class LocationSerializer(serializers.ModelSerializer):
+    machine_count = serializers.SerializerMethodField()
+    installed_power = serializers.SerializerMethodField()
+    direct_machine_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Location
+        fields = ['id', 'name', 'code', 'parent', 'path', 'depth', 'machine_count', 'installed_power', 'direct_machine_count']
+        read_only_fields = ['path', 'depth']
+        # The (parent, code) constraints involve a nullable column; checked in validate instead
+        validators = []
+
+    def _rollup(self, obj, field):
+        rollups = self.context.get('rollups')
+        return rollups.get(obj.pk, {}).get(field) if rollups is not None else None
+
+    def get_machine_count(self, obj):
+        return self._rollup(obj, 'machine_count')
+
+    def get_installed_power(self, obj):
+        return self._rollup(obj, 'installed_power')
+
+    def get_direct_machine_count(self, obj):
+        return self._rollup(obj, 'direct_machine_count')
+
+    def validate(self, attrs):
+        parent = attrs.get('parent', self.instance.parent if self.instance else None)
+        code = attrs.get('code', self.instance.code if self.instance else None)
+        if self.instance is not None and parent is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError({'parent': "A location cannot be moved under itself or its descendants."})
+        siblings = Location.objects.filter(parent=parent, code=code)
+        if self.instance is not None:
+            siblings = siblings.exclude(pk=self.instance.pk)
+        if siblings.exists():
+            raise serializers.ValidationError({'code': "A location with this code already exists here."})
+        return attrs
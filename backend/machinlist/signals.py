@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import MachineRegistration, MachineChangeEvent
+from .typeahead import machine_typeahead
+from .events import record_machine_events
+from .readings import delete_machine_readings
+
+
+@receiver(post_save, sender=MachineRegistration)
+def machine_saved(sender, instance, created, **kwargs):
+    # The index is shared by the whole process, so it only sees writes that commit
+    transaction.on_commit(lambda: machine_typeahead.upsert(instance))
+
+    if created:
+        action = MachineChangeEvent.CREATED
+    elif instance.decommissioned_at is not None:
+        action = MachineChangeEvent.DELETED
+    else:
+        action = MachineChangeEvent.UPDATED
+    record_machine_events([instance.pk], action)
+
+
+@receiver(post_delete, sender=MachineRegistration)
+def machine_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    delete_machine_readings([pk])
+    transaction.on_commit(lambda: machine_typeahead.remove(pk))
+    record_machine_events([instance.pk], MachineChangeEvent.DELETED)
@@ -1,3 +1,871 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.apps import apps
+from django.db import connections, transaction
+from django.db.utils import OperationalError
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from django.utils import timezone
+from .models import (
+    User, MachineRegistration, MachineAccessScope, MachineChangeEvent, MachineLubricant, Lubricant, MachineReading,
+    MachineReadingRollup, AttachmentUpload, AttachmentBlob, Location, ArchivedMachine,
+)
+from .admission import KEY_PREFIX, acquire_slot, admitted_render, release_slot
+from . import attachments
+from .attachments import (
+    upload_path, blob_path, thumbnail_path, finish_upload, generate_pending_thumbnails, purge_attachments,
+    finish_pending_uploads,
+)
+from .archive import archive_machines
+from . import db_router
+from .events import EventHub, EventStream, fetch_events
+from .readings import rollup_readings
+from .typeahead import MachineTypeaheadIndex, machine_typeahead
+from .user_import import API_MAX_ROWS
 
-# Create your tests here.
+
+def make_machine(number, **fields):
+    values = {
+        'section': f'S{number % 3}',
+        'machine_name': f'دستگاه پرس {number}',
+        'machine_code': f'PR-{number:03d}',
+        'machine_model': f'M{number}',
+        'machine_serial': f'SN{number:05d}',
+        'manufacture_year': 2000 + number % 20,
+        'company_entry_date': datetime.date(2020, 1, 1 + number % 28),
+        'criticality_level': 'medium',
+        'location_name': f'سالن {number % 2}',
+        'location_code': f'L{number % 2}',
+        'current_type': 'AC',
+        'phase_count': 3,
+        'nominal_voltage': 380,
+        'nominal_power': 5.5 + number,
+        'nominal_current': 10 + number,
+        'supplier_company_name': 'supplier',
+        'supplier_phone': '1',
+        'supplier_address': 'address',
+        'manufacturer_company_name': 'manufacturer',
+        'manufacturer_phone': '2',
+        'manufacturer_address': 'address',
+    }
+    values.update(fields)
+    return MachineRegistration.objects.create(**values)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class APITestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(email='admin@example.com', username='admin', password='x', role='admin')
+        self.user = User.objects.create_user(email='user@example.com', username='user', password='x', role='user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def as_user(self, *scopes):
+        for section, location_code in scopes:
+            MachineAccessScope.objects.create(user=self.user, section=section, location_code=location_code)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+
+class TypeaheadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        machine_typeahead.invalidate()
+        self.addCleanup(machine_typeahead.invalidate)
+
+    def test_search_uses_database_until_built(self):
+        index = MachineTypeaheadIndex()
+        with mock.patch.object(index, 'ensure_ready') as ensure_ready:
+            self.assertIsNone(index.search('PR'))
+        ensure_ready.assert_called_once()
+
+    def test_rebuild_is_single_flight(self):
+        index = MachineTypeaheadIndex()
+        with mock.patch('machinlist.typeahead.threading.Thread') as thread:
+            index.ensure_ready()
+            index.ensure_ready()
+        thread.assert_called_once()
+
+    def test_writes_during_build_are_replayed(self):
+        machine = make_machine(1)
+        add = MachineTypeaheadIndex._add
+
+        def add_then_rename(index, pk, values):
+            add(index, pk, values)
+            if index is not machine_typeahead and machine.machine_code == 'PR-001':
+                # Another request renames the machine after its row was read
+                machine.machine_code = 'XY-001'
+                with self.captureOnCommitCallbacks(execute=True):
+                    machine.save()
+
+        with mock.patch.object(MachineTypeaheadIndex, '_add', add_then_rename):
+            machine_typeahead.build()
+        self.assertEqual([r['machine_code'] for r in machine_typeahead.search('XY')], ['XY-001'])
+        self.assertEqual(machine_typeahead.search('PR-0'), [])
+
+    def test_rolled_back_writes_stay_out_of_the_index(self):
+        machine = make_machine(1)
+        machine_typeahead.build()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            machine.machine_code = 'XY-001'
+            machine.save()
+            make_machine(2)
+            raise RuntimeError
+        self.assertEqual([r['machine_code'] for r in machine_typeahead.search('PR')], ['PR-001'])
+        self.assertEqual(machine_typeahead.search('XY'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            machine.save()
+        self.assertEqual([r['machine_code'] for r in machine_typeahead.search('XY')], ['XY-001'])
+
+    def test_database_fallback_normalizes_persian(self):
+        make_machine(1, machine_name='دستگاه پرس كوچك', section='S1', location_code='L1')
+        client = self.as_user(('S1', 'L1'))
+        response = client.get('/api/machines/autocomplete/', {'q': 'کوچک'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['machine_code'] for r in response.json()], ['PR-001'])
+
+
+class UserImportTests(APITestCase):
+    def upload(self, rows):
+        lines = ['email,password,role'] + [f'user{i}@example.com,secret{i},user' for i in range(rows)]
+        return SimpleUploadedFile('users.csv', '\n'.join(lines).encode())
+
+    def test_api_hashes_inline(self):
+        with mock.patch('machinlist.user_import.ProcessPoolExecutor') as pool:
+            response = self.client.post('/api/users/import/', {'file': self.upload(3)}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['summary'], {'created': 3})
+        pool.assert_not_called()
+
+    def test_existing_emails_match_case_insensitively(self):
+        upload = SimpleUploadedFile('users.csv', b'email,password\nADMIN@example.com,secret\nnew@example.com,secret\n')
+        response = self.client.post('/api/users/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.json()['summary'], {'created': 1, 'skipped': 1})
+        self.assertFalse(User.objects.filter(email='ADMIN@example.com').exists())
+
+    def test_api_rejects_large_files(self):
+        response = self.client.post('/api/users/import/', {'file': self.upload(API_MAX_ROWS + 1)}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(email='user0@example.com').exists())
+
+
+class MachineEventTests(TestCase):
+    def setUp(self):
+        self.machine = make_machine(1)
+
+    def event(self, event_id, age=0):
+        event = MachineChangeEvent.objects.create(id=event_id, machine_id=self.machine.pk, action=MachineChangeEvent.UPDATED)
+        if age:
+            MachineChangeEvent.objects.filter(id=event_id).update(created_at=event.created_at - datetime.timedelta(seconds=age))
+
+    def test_waits_for_late_commit_below_cursor(self):
+        self.event(1)
+        self.event(3)
+        cursor, messages = fetch_events(0)
+        self.assertEqual((cursor, len(messages)), (1, 1))
+        # Event 2 commits after 3 was already visible
+        self.event(2)
+        cursor, messages = fetch_events(cursor)
+        self.assertEqual(cursor, 3)
+
+    def test_skips_settled_holes(self):
+        self.event(1)
+        self.event(3, age=60)
+        self.assertEqual(fetch_events(1)[0], 3)
+
+    def test_one_poll_serves_every_stream(self):
+        other = make_machine(2)
+        user = User.objects.create_user(email='user@example.com', username='user', password='x', role='user')
+        MachineAccessScope.objects.create(user=user, section=self.machine.section, location_code=self.machine.location_code)
+        hub = EventHub()
+        streams = [EventStream(lambda: None) for _ in range(3)]
+        with mock.patch('machinlist.events.threading.Thread'):
+            for stream in streams:
+                self.assertEqual(hub.subscribe(stream), 0)
+        self.event(1)
+        MachineChangeEvent.objects.create(id=2, machine_id=other.pk, action=MachineChangeEvent.UPDATED)
+        with self.assertNumQueries(3):
+            self.assertTrue(hub.poll())
+
+        cursor, chunks = streams[0].take(0)
+        self.assertEqual(cursor, 2)
+        self.assertEqual([b'"machine"' in chunk for chunk in chunks], [True, True])
+        with self.assertNumQueries(1):
+            cursor, chunks = streams[1].take(0, user)
+        self.assertEqual([b'"machine"' in chunk for chunk in chunks], [True, False])
+
+    @override_settings(MACHINE_EVENTS={'QUEUE_SIZE': 1})
+    def test_full_queue_resets_stream(self):
+        stream = EventStream(lambda: None)
+        stream.put(1, [])
+        stream.put(2, [])
+        stream.put(3, [])
+        cursor, chunks = stream.take(0)
+        self.assertEqual(cursor, 3)
+        self.assertEqual(len(chunks), 1)
+        self.assertIn(b'event: reset', chunks[0])
+
+
+class LubricantAliasTests(APITestCase):
+    def test_aliases_normalizing_alike_are_one(self):
+        response = self.client.post('/api/lubricants/', {'name': 'Shell Omala S2', 'aliases': ['Omala', 'omala', 'OMALA ']}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['aliases'], ['Omala'])
+
+    def test_alias_clashes_are_rejected(self):
+        self.client.post('/api/lubricants/', {'name': 'Shell Omala S2', 'aliases': ['Omala']}, format='json')
+        response = self.client.post('/api/lubricants/', {'name': 'Mobil Gear 600', 'aliases': ['omala']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/lubricants/', {'name': 'Mobil Gear 600', 'aliases': ['shell omala-s2']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/lubricants/', {'name': 'OMALA'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_alias_takes_over_auto_created_entry(self):
+        machine = make_machine(1)
+        row = MachineLubricant.objects.create(machine=machine, lubricant_type='Omala 220')
+        auto_created = row.lubricant
+
+        response = self.client.post('/api/lubricants/', {'name': 'Shell Omala S2 G 220', 'aliases': ['omala-220']}, format='json')
+        self.assertEqual(response.status_code, 201)
+        lubricant = Lubricant.objects.get(pk=response.json()['id'])
+        row.refresh_from_db()
+        self.assertEqual(row.lubricant, lubricant)
+        self.assertFalse(Lubricant.objects.filter(pk=auto_created.pk).exists())
+
+        # New free text with that spelling resolves through the alias
+        other = MachineLubricant.objects.create(machine=machine, row_number=2, lubricant_type='OMALA 220')
+        self.assertEqual(other.lubricant, lubricant)
+        machines = self.client.get(f'/api/lubricants/{lubricant.pk}/machines/').json()
+        self.assertEqual(len(machines['machines']), 2)
+
+
+class IncrementalPdfTests(TestCase):
+    def test_output_is_the_template_plus_an_update(self):
+        from io import BytesIO
+        from pypdf import PdfReader
+        from .pdf_utils import fill_machine_pdf, get_template_path
+        from .serializers import MachineRegistrationSerializer
+
+        data = MachineRegistrationSerializer(make_machine(7)).data
+        content = fill_machine_pdf(data, incremental=True).read()
+        with open(get_template_path(), 'rb') as f:
+            template = f.read()
+        self.assertTrue(content.startswith(template.rstrip(b'\n')))
+
+        reader = PdfReader(BytesIO(content))
+        self.assertEqual(len(reader.pages), 1)
+        text = reader.pages[0].extract_text()
+        self.assertIn('PR-007', text)
+        self.assertIn('SN00007', text)
+        # Same overlay as the full rewrite
+        full = PdfReader(fill_machine_pdf(data, incremental=False)).pages[0].extract_text()
+        self.assertIn('PR-007', full)
+
+
+
+@override_settings(MACHINE_LABELS={'PAGES_PER_CHUNK': 1, 'CODE_FORMAT': '{machine_code}/{machine_serial}'})
+class LabelSheetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_streams_a_readable_sheet_in_chunks(self):
+        from io import BytesIO
+        from pypdf import PdfReader
+
+        for i in range(20):
+            make_machine(i)
+        # a4-2x4 holds 8 labels a page, so 20 machines make 3 pages, sent one at a time
+        response = self.client.get('/api/machines/labels/', {'template': 'a4-2x4'})
+        self.assertEqual(response.status_code, 200)
+        chunks = list(response.streaming_content)
+        self.assertGreaterEqual(len(chunks), 5)
+        reader = PdfReader(BytesIO(b''.join(chunks)))
+        self.assertEqual(len(reader.pages), 3)
+        text = ''.join(page.extract_text() for page in reader.pages)
+        for code in ('PR-000', 'PR-008', 'PR-019'):
+            self.assertIn(code, text)
+
+    def test_unknown_code_fields_are_refused_before_streaming(self):
+        make_machine(1)
+        for code_format in ('{machine_code}-{plate}', '{}', '{machine_code'):
+            with self.settings(MACHINE_LABELS={'CODE_FORMAT': code_format}):
+                response = self.client.get('/api/machines/labels/')
+            self.assertEqual(response.status_code, 400, code_format)
+            self.assertIn('error', response.json())
+
+class FormImportTests(APITestCase):
+    def exported_form(self, machine):
+        from .pdf_utils import fill_machine_pdf
+        from .serializers import MachineRegistrationSerializer
+        data = MachineRegistrationSerializer(machine).data
+        return SimpleUploadedFile(f'{machine.machine_code}.pdf', fill_machine_pdf(data).read(), content_type='application/pdf')
+
+    def test_exported_form_round_trips(self):
+        machine = make_machine(7, machine_name='دستگاه پرس هیدرولیک')
+        form = self.exported_form(machine)
+        MachineRegistration.objects.filter(pk=machine.pk).update(machine_name='changed', nominal_voltage=220)
+
+        with mock.patch('machinlist.form_import.ProcessPoolExecutor') as pool:
+            response = self.client.post('/api/machines/import-forms/', {'files': [form]}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['summary'], {'updated': 1}, response.json())
+        pool.assert_not_called()
+        machine.refresh_from_db()
+        self.assertEqual((machine.machine_name, machine.nominal_voltage), ('دستگاه پرس هیدرولیک', 380))
+
+    def test_api_rejects_large_batches(self):
+        from .form_import import API_MAX_FILES
+        forms = [SimpleUploadedFile(f'{i}.pdf', b'%PDF-1.4') for i in range(API_MAX_FILES + 1)]
+        response = self.client.post('/api/machines/import-forms/', {'files': forms}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.machines = [make_machine(i) for i in range(6)]
+
+    def test_filter_values_are_validated(self):
+        response = self.client.patch('/api/machines/bulk/', {'filter': {'manufacture_year': 'abc'}, 'patch': {'section': 'X'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.delete('/api/machines/bulk/', {'filter': {'manufacture_year': 'abc'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_stays_within_scopes(self):
+        client = self.as_user(('S1', 'L1'))
+        response = client.patch('/api/machines/bulk/', {'filter': {'manufacture_year': '2001'}, 'patch': {'criticality_level': 'high'}}, format='json')
+        self.assertEqual(response.json(), {'updated': 1})
+        self.assertEqual(list(MachineRegistration.objects.filter(criticality_level='high').values_list('machine_code', flat=True)), ['PR-001'])
+
+        # Moving the one visible machine out of the caller's scopes is refused
+        ids = [machine.pk for machine in self.machines]
+        response = client.patch('/api/machines/bulk/', {'ids': ids, 'patch': {'section': 'S2'}}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(MachineRegistration.objects.get(machine_code='PR-001').section, 'S1')
+
+    def test_delete_removes_readings_and_part_files(self):
+        target, other = self.machines[1], self.machines[2]
+        now = timezone.now()
+        for machine in (target, other):
+            MachineReading.objects.create(machine_id=machine.pk, metric='current', value=1, recorded_at=now)
+            MachineReadingRollup.objects.create(machine_id=machine.pk, metric='current', period='hour', bucket=now,
+                                                count=1, total=1, minimum=1, maximum=1)
+        with tempfile.TemporaryDirectory() as root, self.settings(ATTACHMENTS={'ROOT': root}):
+            upload = AttachmentUpload.objects.create(machine=target, user=self.admin, filename='a.pdf', size=10)
+            os.makedirs(os.path.dirname(upload_path(upload.pk)))
+            open(upload_path(upload.pk), 'wb').close()
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete('/api/machines/bulk/', {'ids': [target.pk]}, format='json')
+            self.assertEqual(response.json(), {'deleted': 1})
+            self.assertFalse(os.path.exists(upload_path(upload.pk)))
+        for model in (MachineReading, MachineReadingRollup):
+            self.assertEqual(list(model.objects.values_list('machine_id', flat=True)), [other.pk])
+        self.assertEqual(MachineRegistration.objects.count(), 5)
+
+
+class ExportAdmissionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.machine = make_machine(1)
+
+    def hold_render(self, kind):
+        from .views import export_version
+        cache.add(f'{KEY_PREFIX}:lock:{kind}:{export_version(self.machine)}', 'other', 60)
+
+    @override_settings(EXPORT_ADMISSION={'WAIT_LIMIT': 0})
+    def test_waiters_are_bounded(self):
+        self.hold_render('pdf')
+        response = self.client.get(f'/api/machines/{self.machine.pk}/export_pdf/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+    def test_waiter_gets_the_other_render(self):
+        render = mock.Mock()
+
+        def finish_other_render(seconds):
+            cache.set(f'{KEY_PREFIX}:result:pdf:v1', b'%PDF', 60)
+
+        cache.add(f'{KEY_PREFIX}:lock:pdf:v1', 'other', 60)
+        with mock.patch('machinlist.admission.time.sleep', finish_other_render):
+            self.assertEqual(admitted_render('pdf', 'v1', self.admin, render), b'%PDF')
+        render.assert_not_called()
+        # The wait slots are free again
+        self.assertIsNotNone(acquire_slot('wait:global', 1))
+
+    def test_release_keeps_a_slot_taken_over(self):
+        slot = acquire_slot('global', 1)
+        self.assertIsNone(acquire_slot('global', 1))
+        # The lease ran out and another request holds the slot now
+        cache.set(slot[0], 'other', 60)
+        release_slot(slot)
+        self.assertEqual(cache.get(slot[0]), 'other')
+        release_slot((slot[0], 'other'))
+        self.assertIsNotNone(acquire_slot('global', 1))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            acquire_slot('global', 1)
+        with override_settings(DEBUG=True):
+            self.assertIsNotNone(acquire_slot('global', 1))
+
+
+class AttachmentStoreTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = self.settings(ATTACHMENTS={'ROOT': root.name})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.machine = make_machine(1)
+
+    def upload(self, content):
+        upload = AttachmentUpload.objects.create(machine=self.machine, user=self.admin, filename='plate.png', size=len(content))
+        os.makedirs(os.path.dirname(upload_path(upload.pk)), exist_ok=True)
+        with open(upload_path(upload.pk), 'wb') as f:
+            f.write(content)
+        return upload
+
+    def png(self):
+        from io import BytesIO
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_blob_is_stored_on_commit(self):
+        upload = self.upload(self.png())
+        part = upload_path(upload.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment = finish_upload(upload)
+        self.assertTrue(os.path.exists(blob_path(attachment.blob_id)))
+        self.assertFalse(os.path.exists(part))
+
+        self.assertEqual(generate_pending_thumbnails(workers=1), {AttachmentBlob.THUMBNAIL_READY: 1})
+        self.assertTrue(os.path.exists(thumbnail_path(attachment.blob_id)))
+
+    def test_rolled_back_finish_keeps_the_part_file(self):
+        upload = self.upload(b'%PDF-1.4 manual')
+        part = upload_path(upload.pk)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            finish_upload(upload)
+            raise RuntimeError
+        self.assertTrue(os.path.exists(part))
+        self.assertFalse(AttachmentBlob.objects.exists())
+        self.assertFalse(os.path.isdir(os.path.dirname(os.path.dirname(blob_path('0' * 64)))))
+
+    def send(self, upload_id, offset, chunk):
+        return self.client.patch(
+            f'/api/attachment-uploads/{upload_id}/', chunk, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def open_upload(self, content):
+        response = self.client.post('/api/attachment-uploads/', {
+            'machine': self.machine.pk, 'filename': 'plate.png', 'size': len(content),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def test_chunks_are_hashed_as_they_arrive(self):
+        content = self.png()
+        upload_id = self.open_upload(content)
+        middle = len(content) // 2
+        self.assertEqual(self.send(upload_id, 0, content[:middle]).status_code, 200)
+        with mock.patch('machinlist.attachments.hash_file') as hash_file, self.captureOnCommitCallbacks(execute=True):
+            response = self.send(upload_id, middle, content[middle:])
+        hash_file.assert_not_called()
+        self.assertEqual(response.status_code, 201)
+        sha256 = response.json()['attachment']['sha256']
+        self.assertEqual(sha256, hashlib.sha256(content).hexdigest())
+        with open(blob_path(sha256), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(self.client.get(f'/api/attachment-uploads/{upload_id}/').json()['attachment']['sha256'], sha256)
+        self.assertEqual(self.send(upload_id, len(content), b'').status_code, 409)
+
+    def test_upload_received_elsewhere_is_stored_in_the_background(self):
+        content = self.png()
+        upload_id = self.open_upload(content)
+        middle = len(content) // 2
+        self.send(upload_id, 0, content[:middle])
+        # The next chunk reaches a worker that did not see the first one
+        attachments._digests.clear()
+        response = self.send(upload_id, middle, content[middle:])
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNotNone(response.json()['completed_at'])
+        self.assertIsNone(response.json()['attachment'])
+        self.assertEqual(purge_attachments(expiry_hours=0), (0, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(finish_pending_uploads(), 1)
+        self.assertEqual(finish_pending_uploads(), 0)
+        attachment = self.client.get(f'/api/attachment-uploads/{upload_id}/').json()['attachment']
+        self.assertEqual(attachment['sha256'], hashlib.sha256(content).hexdigest())
+        with open(blob_path(attachment['sha256']), 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+
+@override_settings(MACHINE_READINGS={'SETTLE_SECONDS': 0})
+class ReadingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.machine = make_machine(1)
+
+    def ingest(self, *values, machine=None):
+        recorded_at = (timezone.now() - datetime.timedelta(hours=1)).isoformat()
+        rows = [{'machine': (machine or self.machine).pk, 'metric': 'current', 'value': value, 'recorded_at': recorded_at}
+                for value in values]
+        return self.client.post('/api/readings/', rows, format='json')
+
+    def test_impossible_dates_are_rejected(self):
+        response = self.client.get(f'/api/machines/{self.machine.pk}/readings/', {'metric': 'current', 'start': '2026-02-30T00:00:00'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/readings/out-of-spec/', {'end': '0001-01-01T00:00:00'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/readings/', [{'machine': self.machine.pk, 'metric': 'current', 'value': 1,
+                                                        'recorded_at': '2026-02-30T00:00:00'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_decommissioned_machines_take_no_readings(self):
+        MachineRegistration.objects.filter(pk=self.machine.pk).update(decommissioned_at=timezone.now())
+        self.assertEqual(self.ingest(1).status_code, 400)
+        self.assertFalse(MachineReading.objects.exists())
+
+    def test_rollup_counts_each_reading_once(self):
+        self.ingest(1, 2, 3)
+        self.assertEqual(rollup_readings(batch_size=2), 3)
+        self.assertEqual(rollup_readings(), 0)
+        self.ingest(10)
+        self.assertEqual(rollup_readings(), 1)
+        for rollup in MachineReadingRollup.objects.all():
+            self.assertEqual((rollup.count, rollup.total, rollup.maximum), (4, 16, 10))
+
+        response = self.client.get(f'/api/machines/{self.machine.pk}/readings/', {'metric': 'current', 'resolution': 'hour'})
+        self.assertEqual([point['count'] for point in response.json()['series']], [4])
+
+    def ingest_both(self):
+        other = make_machine(2)
+        self.ingest(1, 2)
+        self.ingest(3, machine=other)
+        rollup_readings()
+        return other
+
+    def assert_only_readings_of(self, machine):
+        for model in (MachineReading, MachineReadingRollup):
+            self.assertEqual(set(model.objects.values_list('machine_id', flat=True)), {machine.pk})
+
+    def test_deleted_machine_takes_its_readings(self):
+        other = self.ingest_both()
+        self.assertEqual(self.client.delete(f'/api/machines/{self.machine.pk}/').status_code, 204)
+        self.assert_only_readings_of(other)
+
+    def test_archived_machine_takes_its_readings(self):
+        other = self.ingest_both()
+        MachineRegistration.objects.filter(pk=self.machine.pk).update(decommissioned_at=timezone.now())
+        self.assertEqual(archive_machines(), 1)
+        self.assert_only_readings_of(other)
+
+
+class SearchTests(APITestCase):
+    def test_limit_is_clamped(self):
+        for i in range(3):
+            make_machine(i)
+        response = self.client.get('/api/machines/search/', {'q': 'پرس', 'limit': '-5'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.client.get('/api/machines/search/', {'q': 'پرس', 'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+
+
+class AnalyticsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for i in range(4):
+            make_machine(i, weight_kg=100 * (i + 1), automation_level='manual' if i % 2 else 'auto')
+
+    def test_aggregates(self):
+        data = self.client.get('/api/machines/analytics/').json()
+        self.assertEqual(data['machine_count'], 4)
+        self.assertEqual(
+            [(group['section'], group['count'], group['nominal_power']) for group in data['power_by_section']],
+            [('S0', 2, 14.0), ('S1', 1, 6.5), ('S2', 1, 7.5)],
+        )
+        self.assertEqual(
+            [(group['location_code'], group['nominal_current']) for group in data['power_by_location']],
+            [('L0', 22.0), ('L1', 24.0)],
+        )
+        weight = data['dimensions']['weight_kg']
+        self.assertEqual((weight['count'], weight['sum'], weight['median']), (4, 1000.0, 250.0))
+        self.assertEqual(data['dimensions']['length_mm']['count'], 0)
+        crosstab = data['criticality_by_automation']
+        self.assertEqual((crosstab['automation_levels'], crosstab['counts']), (['auto', 'manual'], [[2, 2]]))
+        self.assertEqual(sum(bucket['count'] for bucket in data['age']['histogram']), 4)
+
+    def test_scoped_users_get_their_own_figures(self):
+        client = self.as_user(('S0', 'L0'))
+        self.assertEqual(self.client.get('/api/machines/analytics/').json()['machine_count'], 4)
+        self.assertEqual(client.get('/api/machines/analytics/').json()['machine_count'], 1)
+
+    def test_new_change_event_invalidates(self):
+        first = self.client.get('/api/machines/analytics/').json()
+        machine = MachineRegistration.objects.get(machine_code='PR-001')
+        # Written outside the change log, so the cached figures still stand
+        MachineRegistration.objects.filter(pk=machine.pk).update(nominal_power=100)
+        self.assertEqual(self.client.get('/api/machines/analytics/').json(), first)
+        MachineChangeEvent.objects.create(machine_id=machine.pk, action=MachineChangeEvent.UPDATED)
+        second = self.client.get('/api/machines/analytics/').json()
+        self.assertGreater(second['version'], first['version'])
+        self.assertIn({'section': 'S1', 'count': 1, 'nominal_power': 100.0, 'nominal_current': 11.0}, second['power_by_section'])
+
+class ColumnarRendererTests(APITestCase):
+    media_type = 'application/vnd.machinlist.columnar+json'
+
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            make_machine(i)
+
+    def test_list_by_format_and_accept(self):
+        for response in (
+            self.client.get('/api/machines/', {'format': 'columnar'}),
+            self.client.get('/api/machines/', HTTP_ACCEPT=self.media_type),
+        ):
+            self.assertEqual(response['Content-Type'], self.media_type)
+            data = response.json()
+            self.assertEqual(data['count'], 4)
+            codes = data['columns'][data['fields'].index('machine_code')]
+            self.assertEqual(sorted(codes), ['PR-000', 'PR-001', 'PR-002', 'PR-003'])
+            sections = data['columns'][data['fields'].index('section')]
+            self.assertEqual(sorted(data['dictionaries']['section'][i] for i in sections), ['S0', 'S0', 'S1', 'S2'])
+
+    def test_search_results(self):
+        response = self.client.get('/api/machines/search/', {'q': 'پرس', 'format': 'columnar'})
+        self.assertEqual(response['Content-Type'], self.media_type)
+        results = response.json()['results']
+        self.assertEqual(results['count'], 4)
+        self.assertIn('rank', results['fields'])
+
+    def test_detail_and_errors_are_plain_json(self):
+        machine = MachineRegistration.objects.first()
+        response = self.client.get(f'/api/machines/{machine.pk}/', HTTP_ACCEPT=self.media_type)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['machine_code'], machine.machine_code)
+        response = self.client.get('/api/machines/0/', {'format': 'columnar'})
+        self.assertEqual((response.status_code, response['Content-Type']), (404, 'application/json'))
+        self.assertIn('detail', response.json())
+        response = self.client.get('/api/machines/search/', {'limit': 'x', 'format': 'columnar'})
+        self.assertEqual((response.status_code, response['Content-Type']), (400, 'application/json'))
+        self.assertEqual(response.json(), {'error': 'limit must be a number'})
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica']})
+class ReplicaRoutingTests(APITestCase):
+    # A second SQLite database stands in for the replica. It holds a different machine, so
+    # responses show which database was read
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3')}
+        connections.settings['replica'] = connections.configure_settings({**connections.settings, 'replica': replica})['replica']
+        cls.databases = {*cls.databases, 'replica'}
+        with connections['replica'].schema_editor() as editor:
+            for model in apps.get_app_config('machinlist').get_models():
+                editor.create_model(model)
+        replica_machine = make_machine(2)
+        MachineRegistration.objects.using('replica').bulk_create([replica_machine])
+        MachineRegistration.objects.filter(pk=replica_machine.pk).delete()
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.databases = cls.databases - {'replica'}
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        make_machine(1)
+        self.addCleanup(db_router._unavailable.clear)
+
+    def codes(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [machine['machine_code'] for machine in response.json()]
+
+    def test_reads_go_to_the_replica(self):
+        response = self.client.get('/api/machines/')
+        self.assertEqual(self.codes(response), ['PR-002'])
+        self.assertNotIn('db_pin', response.cookies)
+
+    def test_writes_pin_later_reads_to_the_primary(self):
+        machine = MachineRegistration.objects.get()
+        response = self.client.patch(f'/api/machines/{machine.pk}/', {'machine_name': 'renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies['db_pin']['max-age'], 5)
+        # The client sends the cookie back until it expires
+        self.assertEqual(self.codes(self.client.get('/api/machines/')), ['PR-001'])
+        del self.client.cookies['db_pin']
+        self.assertEqual(self.codes(self.client.get('/api/machines/')), ['PR-002'])
+
+    def test_unavailable_replica_falls_back_to_the_primary(self):
+        connections['replica'].close()
+        refused = OperationalError('connection refused')
+        with mock.patch.object(connections['replica'], 'ensure_connection', side_effect=refused) as connect:
+            with self.assertLogs('machinlist.db_router', 'WARNING'):
+                self.assertEqual(self.codes(self.client.get('/api/machines/')), ['PR-001'])
+            # Skipped without another attempt until RETRY_SECONDS pass
+            self.assertEqual(self.codes(self.client.get('/api/machines/')), ['PR-001'])
+        self.assertEqual(connect.call_count, 1)
+        self.assertIn('replica', db_router._unavailable)
+
+
+class LocationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.plant = Location.objects.create(name='کارخانه', code='P1')
+        self.hall = Location.objects.create(name='سالن', code='H1', parent=self.plant)
+        self.line = Location.objects.create(name='خط', code='L1', parent=self.hall)
+        self.other = Location.objects.create(name='انبار', code='W1')
+        self.in_line = make_machine(1, location=self.line, location_code='L1', location_name='خط', nominal_power=10)
+        self.in_hall = make_machine(2, location=self.hall, location_code='H1', location_name='سالن', nominal_power=5)
+        self.elsewhere = make_machine(3, location=self.other, location_code='W1', location_name='انبار')
+
+    def codes(self, response):
+        return sorted(row['machine_code'] for row in response.json())
+
+    def test_subtree_filters(self):
+        response = self.client.get('/api/machines/', {'location': self.plant.pk})
+        self.assertEqual(self.codes(response), ['PR-001', 'PR-002'])
+        response = self.client.get('/api/machines/', {'location': 'abc'})
+        self.assertEqual(self.codes(response), [])
+
+        response = self.client.get('/api/locations/', {'within': self.hall.pk})
+        self.assertEqual([row['code'] for row in response.json()], ['H1', 'L1'])
+        response = self.client.get('/api/locations/', {'parent': 'abc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_rollups_cover_the_subtree(self):
+        rows = {row['code']: row for row in self.client.get('/api/locations/').json()}
+        self.assertEqual((rows['P1']['machine_count'], rows['P1']['installed_power'], rows['P1']['direct_machine_count']), (2, 15, 0))
+        self.assertEqual((rows['H1']['machine_count'], rows['H1']['direct_machine_count']), (2, 1))
+
+        # Scoped users only count what they can see
+        client = self.as_user(('', 'L1'))
+        rows = {row['code']: row for row in client.get('/api/locations/').json()}
+        self.assertEqual((rows['P1']['machine_count'], rows['P1']['installed_power']), (1, 10))
+
+    def test_rename_moves_export_version(self):
+        before = self.in_line.updated_at
+        response = self.client.patch(f'/api/locations/{self.line.pk}/', {'name': 'خط تولید'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.in_line.refresh_from_db()
+        self.assertEqual(self.in_line.location_name, 'خط تولید')
+        self.assertGreater(self.in_line.updated_at, before)
+
+    def test_bulk_code_patch_leaves_the_tree(self):
+        response = self.client.patch('/api/machines/bulk/', {'ids': [self.in_line.pk], 'patch': {'location_code': 'X9'}}, format='json')
+        self.assertEqual(response.json(), {'updated': 1})
+        self.in_line.refresh_from_db()
+        self.assertIsNone(self.in_line.location)
+        response = self.client.get('/api/machines/', {'location': self.plant.pk})
+        self.assertEqual(self.codes(response), ['PR-002'])
+
+    def test_moves_use_the_stored_paths(self):
+        cell = Location.objects.create(name='ایستگاه', code='C1', parent=self.line)
+        stale_hall = Location.objects.get(pk=self.hall.pk)
+        stale_line = Location.objects.get(pk=self.line.pk)
+        self.hall.parent = self.other
+        self.hall.save()
+
+        # Loaded before the hall moved, so its own path and its parent's are out of date
+        stale_line.parent = self.plant
+        stale_line.save()
+        cell.refresh_from_db()
+        self.assertEqual(cell.path, self.plant.path + self.line.path_segment() + cell.path_segment())
+        self.assertEqual(cell.depth, 2)
+        response = self.client.get('/api/locations/', {'within': self.plant.pk})
+        self.assertEqual([row['code'] for row in response.json()], ['P1', 'L1', 'C1'])
+
+        # The stale hall still looks like it is under the plant, but it is under the warehouse now
+        self.other.parent = stale_hall
+        with self.assertRaises(ValidationError):
+            self.other.clean()
+        with self.assertRaises(ValueError):
+            self.other.save()
+
+    def test_ids_wider_than_the_path_step_are_refused(self):
+        Location.objects.bulk_create([Location(pk=10 ** Location.PATH_STEP - 1, name='x', code='X', path='9' * Location.PATH_STEP)])
+        with self.assertRaises(ValueError):
+            Location.objects.create(name='y', code='Y')
+        self.assertFalse(Location.objects.filter(code='Y').exists())
+
+
+class StartupTests(TestCase):
+    # Export, form and label stacks (and Pillow for thumbnails) load on first use, not at startup
+    HEAVY_MODULES = ('docx', 'reportlab', 'pypdf', 'arabic_reshaper', 'bidi', 'PIL')
+
+    def test_urlconf_does_not_load_heavy_modules(self):
+        code = (
+            'import json, sys, django; django.setup(); '
+            'from django.urls import get_resolver; get_resolver().url_patterns; '
+            f'print(json.dumps([m for m in {self.HEAVY_MODULES!r} if m in sys.modules]))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='backend.settings'),
+        )
+        self.assertEqual(json.loads(result.stdout.strip().splitlines()[-1]), [])
+
+
+class ArchiveTests(APITestCase):
+    def test_archive_and_restore_round_trip(self):
+        hall = Location.objects.create(name='سالن', code='H1')
+        machine = make_machine(1, location=hall, location_code='H1', location_name='سالن')
+        MachineLubricant.objects.create(machine=machine, lubricant_type='Omala 220', alternative_lubricant_type='Mobil 600')
+        created_at, search_title = machine.created_at, machine.search_title
+
+        self.assertEqual(self.client.post(f'/api/machines/{machine.pk}/decommission/').status_code, 200)
+        self.assertEqual(archive_machines(), 1)
+        self.assertFalse(MachineRegistration.all_objects.filter(pk=machine.pk).exists())
+        archived = ArchivedMachine.objects.get(original_id=machine.pk)
+
+        response = self.client.post(f'/api/archived-machines/{archived.pk}/restore/')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([row['lubricant_type'] for row in response.json()['lubricants']], ['Omala 220'])
+        restored = MachineRegistration.objects.get(machine_code='PR-001')
+        self.assertEqual((restored.pk, restored.location_id), (machine.pk, hall.pk))
+        self.assertEqual(restored.created_at, created_at)
+        self.assertIsNone(restored.decommissioned_at)
+        self.assertEqual(restored.search_title, search_title)
+        self.assertEqual(restored.lubricants.get().lubricant.name, 'Omala 220')
+        self.assertFalse(ArchivedMachine.objects.exists())
+        # Found by search again
+        response = self.client.get('/api/machines/search/', {'q': 'پرس'})
+        self.assertEqual([row['machine_code'] for row in response.json()['results']], ['PR-001'])
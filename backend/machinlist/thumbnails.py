@@ -0,0 +1,61 @@
+import os
+
+# Runs in the thumbnail process pool, so this module stays free of Django imports
+
+THUMBNAIL_EXTENSION = '.thumb.jpg'
+
+# Refuse to decode images beyond this many pixels (about 16k x 12k) instead of allocating for them
+MAX_PIXELS = 200_000_000
+
+
+def _thumbnail_image(image, size):
+    from PIL import Image
+
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, 'white')
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    return image
+
+
+def _first_page_image(path):
+    # Scanned manuals and diagrams are one image per page; vector-only PDFs get no thumbnail
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    if not reader.pages:
+        return None
+    images = list(reader.pages[0].images)
+    if not images:
+        return None
+    largest = max(images, key=lambda image: image.image.width * image.image.height)
+    return largest.image
+
+
+def make_thumbnail(source, target, content_type, size):
+    """
+    Write a JPEG of at most size x size pixels for an image or (image-based)
+    PDF. JPEGs are decoded at a reduced scale with draft(), so even large
+    nameplate photos are never decoded at full resolution. Returns False when
+    the content has no usable picture.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    if content_type == 'application/pdf':
+        image = _first_page_image(source)
+        if image is None:
+            return False
+    elif content_type.startswith('image/'):
+        image = Image.open(source)
+        image.draft('RGB', (size, size))
+    else:
+        return False
+
+    image = _thumbnail_image(image, size)
+    partial = target + '.tmp'
+    image.save(partial, 'JPEG', quality=80, optimize=True)
+    os.replace(partial, target)
+    return True
@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from .normalization import normalize_persian, tokenize
+
+logger = logging.getLogger(__name__)
+
+TYPEAHEAD_FIELDS = ('machine_code', 'machine_name', 'machine_serial')
+
+DEFAULTS = {
+    'MAX_ENTRIES': 50000,       # machines kept in memory; beyond this lookups fall back to the DB
+    'MAX_PREFIX_LENGTH': 12,    # longest token prefix stored in the prefix map
+    'MAX_VALUE_LENGTH': 64,     # characters of each field that are indexed
+    'REBUILD_INTERVAL': 300,    # seconds; bounds staleness from writes made by other workers
+}
+
+
+def get_typeahead_setting(name):
+    return getattr(settings, 'MACHINE_TYPEAHEAD', {}).get(name, DEFAULTS[name])
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class MachineTypeaheadIndex:
+    """
+    In-process lookup index over the unique machine identifiers.
+
+    Short queries (< 3 characters) are answered from a token prefix map,
+    longer ones by intersecting trigram postings and confirming the substring.
+    The index is built in a background thread on first use and every
+    REBUILD_INTERVAL, and kept current by model signals in between. Until the
+    first build finishes, search() returns None and callers use the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._building = False
+        self._pending = None   # writes seen while a build reads the table, replayed after it
+        self._reset()
+
+    def _reset(self):
+        self.ready = False
+        self.overflow = False
+        self.built_at = 0.0
+        self._entries = {}     # id -> (code, name, serial)
+        self._haystacks = {}   # id -> tuple of normalized field values
+        self._prefixes = {}    # token prefix -> set of ids
+        self._trigrams = {}    # trigram -> set of ids
+
+    # Building
+
+    def build(self):
+        """
+        Read the machines into a new index and swap it in. Searches keep using
+        the current one meanwhile; the lock is only held for the swap.
+        """
+        from .models import MachineRegistration
+
+        with self._lock:
+            self._pending = []
+        try:
+            fresh = MachineTypeaheadIndex()
+            max_entries = get_typeahead_setting('MAX_ENTRIES')
+            rows = MachineRegistration.objects.values_list('id', *TYPEAHEAD_FIELDS)
+            for count, (pk, *values) in enumerate(rows.iterator(chunk_size=2000)):
+                if count >= max_entries:
+                    fresh._reset()
+                    fresh.overflow = True
+                    break
+                fresh._add(pk, values)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._entries, self._haystacks = fresh._entries, fresh._haystacks
+            self._prefixes, self._trigrams = fresh._prefixes, fresh._trigrams
+            self.overflow = fresh.overflow
+            self.ready = True
+            self.built_at = time.monotonic()
+            # Rows read before a concurrent write still hold the old values
+            for apply, argument in pending:
+                apply(argument)
+
+    def ensure_ready(self):
+        """Start a background build if the index is missing or stale; at most one runs at a time."""
+        interval = get_typeahead_setting('REBUILD_INTERVAL')
+        if self.ready and not (interval and time.monotonic() - self.built_at > interval):
+            return
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._build_in_background, name='typeahead-build', daemon=True).start()
+
+    def _build_in_background(self):
+        from django.db import connections
+
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Typeahead index build failed')
+        finally:
+            with self._lock:
+                self._building = False
+            connections.close_all()
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+
+    # Incremental maintenance
+
+    def _add(self, pk, values):
+        max_value = get_typeahead_setting('MAX_VALUE_LENGTH')
+        max_prefix = get_typeahead_setting('MAX_PREFIX_LENGTH')
+
+        haystacks = tuple(normalize_persian(value)[:max_value] for value in values)
+        self._entries[pk] = tuple(values)
+        self._haystacks[pk] = haystacks
+
+        for key in self._keys(haystacks, max_prefix):
+            self._prefixes.setdefault(key, set()).add(pk)
+        for gram in set().union(*(trigrams(h) for h in haystacks)):
+            self._trigrams.setdefault(gram, set()).add(pk)
+
+    def _remove(self, pk):
+        haystacks = self._haystacks.pop(pk, None)
+        self._entries.pop(pk, None)
+        if haystacks is None:
+            return
+
+        max_prefix = get_typeahead_setting('MAX_PREFIX_LENGTH')
+        for key in self._keys(haystacks, max_prefix):
+            self._discard(self._prefixes, key, pk)
+        for gram in set().union(*(trigrams(h) for h in haystacks)):
+            self._discard(self._trigrams, gram, pk)
+
+    @staticmethod
+    def _keys(haystacks, max_prefix):
+        keys = set()
+        for haystack in haystacks:
+            for token in tokenize(haystack):
+                for end in range(1, min(len(token), max_prefix) + 1):
+                    keys.add(token[:end])
+        return keys
+
+    @staticmethod
+    def _discard(postings, key, pk):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(pk)
+            if not ids:
+                del postings[key]
+
+    def upsert(self, machine):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.upsert, machine))
+            if not self.ready or self.overflow:
+                return
+            self._remove(machine.pk)
+            if machine.decommissioned_at is not None:
+                return
+            if len(self._entries) >= get_typeahead_setting('MAX_ENTRIES'):
+                self._reset()
+                self.overflow = True
+                self.ready = True
+                self.built_at = time.monotonic()
+                return
+            self._add(machine.pk, [getattr(machine, field) for field in TYPEAHEAD_FIELDS])
+
+    def remove(self, pk):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.remove, pk))
+            if self.ready and not self.overflow:
+                self._remove(pk)
+
+    # Lookup
+
+    def search(self, query, limit=10):
+        needle = normalize_persian(query)
+        if not needle:
+            return []
+
+        self.ensure_ready()
+        if not self.ready or self.overflow:
+            return None
+
+        with self._lock:
+            if len(needle) < 3:
+                candidates = self._prefixes.get(needle, set())
+            else:
+                postings = [self._trigrams.get(gram) for gram in trigrams(needle)]
+                if not all(postings):
+                    return []
+                postings.sort(key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+
+            ranked = []
+            for pk in candidates:
+                haystacks = self._haystacks[pk]
+                rank = self._rank(needle, haystacks)
+                if rank is not None:
+                    ranked.append((rank, len(haystacks[0]), haystacks[0], pk))
+            ranked.sort()
+
+            results = []
+            for _, _, _, pk in ranked[:limit]:
+                code, name, serial = self._entries[pk]
+                results.append({
+                    'id': pk,
+                    'machine_code': code,
+                    'machine_name': name,
+                    'machine_serial': serial,
+                })
+            return results
+
+    @staticmethod
+    def _rank(needle, haystacks):
+        # 0: whole-field prefix, 1: token prefix, 2: substring; code ranks ahead of name, name of serial
+        best = None
+        for position, haystack in enumerate(haystacks):
+            if haystack.startswith(needle):
+                rank = (0, position)
+            elif any(token.startswith(needle) for token in tokenize(haystack)):
+                rank = (1, position)
+            elif needle in haystack:
+                rank = (2, position)
+            else:
+                continue
+            if best is None or rank < best:
+                best = rank
+        return best
+
+
+machine_typeahead = MachineTypeaheadIndex()
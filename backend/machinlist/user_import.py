@@ -0,0 +1,182 @@
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from .models import User
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+LOOKUP_CHUNK = 500
+# Rows accepted through the API, where passwords are hashed inline on the request;
+# larger files go through the import_users command, which hashes on a process pool
+API_MAX_ROWS = 200
+REPORT_FIELDS = ['row', 'email', 'status', 'message']
+
+
+class UserImportError(Exception):
+    pass
+
+
+def _init_worker():
+    # Spawned workers (Windows, macOS) start without Django configured
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _is_valid_email(email):
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def _hash_password(password):
+    return make_password(password)
+
+
+def hash_passwords(passwords, workers=1):
+    # PBKDF2 is deliberately CPU-bound; the command spreads it over a process pool (workers=None: CPU count).
+    # Never from a web worker: forking a threaded server is unsafe and the request would wait on the pool anyway
+    if workers == 1 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return list(pool.map(_hash_password, passwords, chunksize=chunksize))
+
+
+def _existing(field, values, ignore_case=False):
+    # With ignore_case, values and the returned matches are lowercased
+    values = list(values)
+    found = set()
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        chunk = values[start:start + LOOKUP_CHUNK]
+        if ignore_case:
+            matches = User.objects.annotate(folded=Lower(field)).filter(folded__in=[value.lower() for value in chunk])
+            found.update(matches.values_list('folded', flat=True))
+        else:
+            found.update(User.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True))
+    return found
+
+
+def parse_users_csv(stream, default_role='user'):
+    """
+    Parse and validate rows of an HR export. Returns (rows, report) where rows
+    are dicts ready to become users and report holds one entry per rejected row.
+    Expected columns: email, password and optionally username, role, is_staff, is_active.
+    """
+    reader = csv.DictReader(stream)
+    valid_roles = {choice for choice, _ in User.ROLE_CHOICES}
+    rows, report = [], []
+    seen_emails, seen_usernames = set(), set()
+
+    for number, raw in enumerate(reader, start=2):  # row 1 is the header
+        raw = {(key or '').strip().lower(): (value or '').strip() for key, value in raw.items()}
+        email = User.objects.normalize_email(raw.get('email', ''))
+        username = raw.get('username') or None
+        role = raw.get('role') or default_role
+
+        error = None
+        if not _is_valid_email(email):
+            error = 'Invalid email'
+        elif not raw.get('password'):
+            error = 'Password is required'
+        elif role not in valid_roles:
+            error = f"Invalid role '{role}'"
+        elif email.lower() in seen_emails:
+            error = 'Duplicate email in file'
+        elif username and username in seen_usernames:
+            error = 'Duplicate username in file'
+
+        if error:
+            report.append({'row': number, 'email': email, 'status': 'error', 'message': error})
+            continue
+
+        seen_emails.add(email.lower())
+        if username:
+            seen_usernames.add(username)
+        rows.append({
+            'row': number,
+            'email': email,
+            'username': username,
+            'password': raw['password'],
+            'role': role,
+            'is_staff': raw.get('is_staff', '').lower() in TRUE_VALUES or role == 'admin',
+            'is_active': raw.get('is_active', 'true').lower() in TRUE_VALUES,
+        })
+    return rows, report
+
+
+def import_users(stream, workers=1, batch_size=500, default_role='user', max_rows=None):
+    """
+    Create users from a CSV stream. Existing emails/usernames are skipped using
+    one set-based lookup, passwords are hashed (in parallel with workers > 1)
+    and users are written with bulk_create. Returns the per-row report, ordered
+    by row number. Raises UserImportError past max_rows valid rows.
+    """
+    rows, report = parse_users_csv(stream, default_role=default_role)
+    if max_rows is not None and len(rows) > max_rows:
+        raise UserImportError(f'At most {max_rows} users can be imported at once; use the import_users command for larger files')
+
+    # Emails are matched case-insensitively, as duplicates within the file are
+    existing_emails = _existing('email', [row['email'] for row in rows], ignore_case=True)
+    existing_usernames = _existing('username', [row['username'] for row in rows if row['username']])
+
+    pending = []
+    for row in rows:
+        if row['email'].lower() in existing_emails:
+            report.append({'row': row['row'], 'email': row['email'], 'status': 'skipped', 'message': 'Email already exists'})
+        elif row['username'] and row['username'] in existing_usernames:
+            report.append({'row': row['row'], 'email': row['email'], 'status': 'skipped', 'message': 'Username already exists'})
+        else:
+            pending.append(row)
+
+    hashes = hash_passwords([row['password'] for row in pending], workers=workers)
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        users = [
+            User(
+                email=row['email'],
+                username=row['username'],
+                role=row['role'],
+                is_staff=row['is_staff'],
+                is_active=row['is_active'],
+                password=password,
+            )
+            for row, password in zip(batch, hashes[start:start + batch_size])
+        ]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+            report.extend({'row': row['row'], 'email': row['email'], 'status': 'created', 'message': ''} for row in batch)
+        except IntegrityError:
+            # A concurrent write took one of the emails; fall back to row by row for this batch
+            for row, user in zip(batch, users):
+                try:
+                    with transaction.atomic():
+                        user.save()
+                    report.append({'row': row['row'], 'email': row['email'], 'status': 'created', 'message': ''})
+                except IntegrityError as e:
+                    report.append({'row': row['row'], 'email': row['email'], 'status': 'error', 'message': str(e)})
+
+    report.sort(key=lambda entry: entry['row'])
+    return report
+
+
+def write_report(report, stream):
+    writer = csv.DictWriter(stream, fieldnames=REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(report)
+
+
+def decode_upload(uploaded_file):
+    # utf-8-sig so Excel-exported CSVs with a BOM keep their first header intact
+    return io.StringIO(uploaded_file.read().decode('utf-8-sig'))
@@ -4,18 +4,59 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.conf import settings
-from .models import User, MachineRegistration
-from .serializers import UserSerializer, MachineRegistrationSerializer
+from .models import (
+    User, MachineRegistration, MachineLubricant, ArchivedMachine, Lubricant, MachineAccessScope,
+    MachineAttachment, AttachmentUpload, AttachmentBlob, MachineReadingRollup, Location,
+)
+from .serializers import (
+    UserSerializer,
+    MachineRegistrationSerializer,
+    ArchivedMachineSerializer,
+    LubricantSerializer,
+    MachineBulkSerializer,
+    MachineAccessScopeSerializer,
+    MachineAttachmentSerializer,
+    AttachmentUploadSerializer,
+    LocationSerializer,
+)
+from .normalization import normalize_lubricant_name
 from .permissions import IsAdminRole
 from rest_framework import permissions
 import os
-from django.http import HttpResponse
+import tempfile
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
+from django.utils.http import content_disposition_header
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+from django.db.models import Q, Count
+from django.db import IntegrityError, transaction
+from django.db.models.deletion import ProtectedError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 from django.middleware.csrf import get_token
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated
-from docx import Document
 from io import BytesIO
-from .pdf_utils import fill_machine_pdf
+from .typeahead import machine_typeahead
+from .archive import restore_machine
+from .user_import import import_users, decode_upload, UserImportError, API_MAX_ROWS
+from .events import stream_events_async, stream_events_sync
+from .authentication import CustomJWTAuthentication
+from .renderers import ColumnarJSONRenderer
+from .analytics import fleet_analytics
+from .bulk import select_machines, bulk_update_machines, bulk_delete_machines
+from .scoping import scope_queryset, can_access, get_user_scopes, scope_key
+from .admission import admitted_render, ExportRejected, AdmittedStream, AsyncAdmittedStream
+from .attachments import (
+    AttachmentError, start_upload, append_chunk, abort_upload, blob_path, thumbnail_path, parse_range, iter_file,
+    get_attachment_setting, INLINE_TYPES,
+)
+from .search import search_machines
+from .locations import location_rollups, sync_location_machines
+from .readings import ingest_readings, reading_series, out_of_spec_counts, ReadingError, METRICS as READING_METRICS
 
 # Create your views here.
 class CookieTokenObtainPairView(TokenObtainPairView):
@@ -101,22 +142,625 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminRole]
     serializer_class = UserSerializer
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_csv(self, request):
+        uploaded = request.FILES.get('file')
+        if uploaded is None:
+            return Response({"error": "CSV file is required in the 'file' field"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            stream = decode_upload(uploaded)
+        except UnicodeDecodeError:
+            return Response({"error": "CSV file must be UTF-8 encoded"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = import_users(stream, default_role=request.data.get('default_role', 'user'), max_rows=API_MAX_ROWS)
+        except UserImportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        summary = {}
+        for entry in report:
+            summary[entry['status']] = summary.get(entry['status'], 0) + 1
+        return Response({"summary": summary, "rows": report})
+
+    @action(detail=True, methods=['get', 'put'])
+    def scopes(self, request, pk=None):
+        # Section/location assignments; PUT replaces the whole list
+        user = self.get_object()
+        if request.method == 'PUT':
+            serializer = MachineAccessScopeSerializer(data=request.data, many=True)
+            serializer.is_valid(raise_exception=True)
+            pairs = {(scope['section'], scope['location_code']) for scope in serializer.validated_data}
+            with transaction.atomic():
+                user.machine_scopes.all().delete()
+                MachineAccessScope.objects.bulk_create([
+                    MachineAccessScope(user=user, section=section, location_code=location_code)
+                    for section, location_code in sorted(pairs)
+                ])
+        return Response(MachineAccessScopeSerializer(user.machine_scopes.order_by('section', 'location_code'), many=True).data)
+
 class MachineRegistrationViewSet(viewsets.ModelViewSet):
-    queryset = MachineRegistration.objects.all()
+    # The search columns are only read inside SQL; loading them would double the text fetched per machine
+    queryset = MachineRegistration.objects.defer('search_title', 'search_body').prefetch_related('lubricants')
     serializer_class = MachineRegistrationSerializer
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer]
+
+    def get_permissions(self):
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'decommission', 'bulk_update']:
+            permission_classes = [permissions.IsAuthenticated]
+        elif self.action in ['recommission', 'import_forms', 'bulk_destroy']:
+            permission_classes = [IsAdminRole]
+        else:
+            permission_classes = [permissions.IsAuthenticated]
+        return [permission() for permission in permission_classes]
+
+    def get_queryset(self):
+        if self.action == 'recommission':
+            queryset = MachineRegistration.all_objects.filter(decommissioned_at__isnull=False)
+        else:
+            queryset = super().get_queryset()
+        location = self.request.query_params.get('location')
+        if location:
+            # Machines anywhere under the node: one range over the indexed location paths
+            node = Location.objects.filter(pk=location).first() if location.isdigit() else None
+            queryset = queryset.filter(**node.subtree_filter('location__')) if node else queryset.none()
+        return scope_queryset(queryset, self.request.user)
+
+    def check_scope(self, section, location_code):
+        if not can_access(self.request.user, section, location_code):
+            raise exceptions.PermissionDenied("You do not have access to this section and location.")
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        self.check_scope(data.get('section'), data.get('location_code'))
+        serializer.save()
+
+    def perform_update(self, serializer):
+        data, instance = serializer.validated_data, serializer.instance
+        self.check_scope(data.get('section', instance.section), data.get('location_code', instance.location_code))
+        serializer.save()
+
+    @action(detail=False, methods=['patch'], url_path='bulk')
+    def bulk_update(self, request):
+        # {"ids": [...], "filter": {...}, "patch": {...}} -> one UPDATE over the active machines selected
+        serializer = MachineBulkSerializer(data=request.data, context={'require_patch': True})
+        serializer.is_valid(raise_exception=True)
+        queryset = select_machines(
+            self.get_queryset(), serializer.validated_data.get('ids'), serializer.validated_data.get('filter')
+        )
+        patch = serializer.validated_data['patch']
+        if get_user_scopes(request.user) is not None and ('section' in patch or 'location_code' in patch):
+            # Moving machines must not take them outside the caller's scopes
+            for section, location_code in queryset.values_list('section', 'location_code').distinct():
+                self.check_scope(patch.get('section', section), patch.get('location_code', location_code))
+        updated = bulk_update_machines(queryset, patch)
+        return Response({"updated": updated})
+
+    @bulk_update.mapping.delete
+    def bulk_destroy(self, request):
+        serializer = MachineBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = select_machines(
+            self.get_queryset(), serializer.validated_data.get('ids'), serializer.validated_data.get('filter')
+        )
+        try:
+            deleted = bulk_delete_machines(queryset)
+        except ProtectedError as e:
+            return Response({"error": str(e.args[0])}, status=status.HTTP_409_CONFLICT)
+        return Response({"deleted": deleted})
+
+    @action(detail=False, methods=['post'], url_path='import-forms')
+    def import_forms(self, request):
+        # Accepts a ZIP of filled forms in 'file', or one or more PDFs in 'files'
+        # Imported on first use: form parsing pulls in pypdf, bidi and reportlab
+        from .form_import import import_machine_forms, FormImportError, API_MAX_FILES as API_MAX_FORMS
+
+        archive = request.FILES.get('file')
+        uploads = request.FILES.getlist('files')
+        if archive is None and not uploads:
+            return Response({"error": "Upload a ZIP in 'file' or PDFs in 'files'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        with tempfile.TemporaryDirectory() as directory:
+            if archive is not None:
+                path = os.path.join(directory, os.path.basename(archive.name) or 'forms.zip')
+                uploads = [archive]
+                names = [path]
+            else:
+                path = directory
+                names = []
+                for i, upload in enumerate(uploads):
+                    name = os.path.basename(upload.name) or 'form.pdf'
+                    if os.path.join(directory, name) in names:
+                        name = f'{i}-{name}'
+                    names.append(os.path.join(directory, name))
+            for upload, name in zip(uploads, names):
+                with open(name, 'wb') as f:
+                    for chunk in upload.chunks():
+                        f.write(chunk)
+
+            try:
+                report = import_machine_forms(
+                    path,
+                    update_existing=request.data.get('update_existing', 'true') != 'false',
+                    default_section=request.data.get('section'),
+                    max_files=API_MAX_FORMS,
+                )
+            except FormImportError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = {}
+        for entry in report:
+            summary[entry['status']] = summary.get(entry['status'], 0) + 1
+        return Response({"summary": summary, "files": report})
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        return Response(fleet_analytics(self.get_queryset(), scope_key=scope_key(request.user)))
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        # ?q=words&limit=20: full-text search over names, codes, companies, addresses and descriptions
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        machines = list(search_machines(self.get_queryset(), request.query_params.get('q', ''))[:limit])
+        results = []
+        for machine, data in zip(machines, self.get_serializer(machines, many=True).data):
+            results.append({**data, "rank": machine.rank})
+        return Response({"results": results})
+
+    @action(detail=False, methods=['get'])
+    def labels(self, request):
+        # ?section=...&location=<node>&ids=1,2&template=a4-3x8: label sheet PDF, streamed as pages are drawn
+        # Imported on first use so startup doesn't pay for reportlab and pypdf
+        from .labels import label_sheet, code_fields, get_template as get_label_template
+
+        template = get_label_template(request.query_params.get('template'))
+        if template is None:
+            return Response({"error": "Unknown label template"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            code_fields()
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.get_queryset()
+        section = request.query_params.get('section')
+        if section:
+            queryset = queryset.filter(section=section)
+        ids = request.query_params.get('ids')
+        if ids:
+            try:
+                queryset = queryset.filter(pk__in=[int(pk) for pk in ids.split(',')])
+            except ValueError:
+                return Response({"error": "ids must be comma-separated numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            stream = AdmittedStream(request.user, label_sheet(queryset, template))
+        except ExportRejected as e:
+            return export_rejected(e)
+        if isinstance(request._request, ASGIRequest):
+            stream = AsyncAdmittedStream(stream)
+        response = StreamingHttpResponse(stream, content_type='application/pdf')
+        response['Content-Disposition'] = content_disposition_header(True, f"Labels_{section or 'machines'}.pdf")
+        return response
+
+    @action(detail=True, methods=['get'])
+    def readings(self, request, pk=None):
+        # ?metric=current&start=...&end=...&resolution=raw|hour|day (default: picked from the span)
+        machine = self.get_object()
+        params = request.query_params
+        if params.get('metric') not in READING_METRICS:
+            return Response({"error": f"metric must be one of: {', '.join(sorted(READING_METRICS))}"}, status=status.HTTP_400_BAD_REQUEST)
+        if params.get('resolution') not in (None, 'raw', MachineReadingRollup.HOUR, MachineReadingRollup.DAY):
+            return Response({"error": "resolution must be raw, hour or day"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start, end = reading_window(params)
+            series = reading_series(machine, params['metric'], start, end, params.get('resolution'))
+        except ReadingError as e:
+            return Response({"error": e.message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(series)
+
+    @action(detail=True, methods=['post'])
+    def decommission(self, request, pk=None):
+        # Takes the machine off the active set; archive_machines later moves it to the archive table
+        machine = self.get_object()
+        machine.decommissioned_at = timezone.now()
+        machine.save(update_fields=['decommissioned_at', 'updated_at'])
+        return Response({"id": machine.id, "decommissioned_at": machine.decommissioned_at})
+
+    @action(detail=True, methods=['post'])
+    def recommission(self, request, pk=None):
+        machine = self.get_object()
+        machine.decommissioned_at = None
+        machine.save(update_fields=['decommissioned_at', 'updated_at'])
+        return Response(self.get_serializer(machine).data)
+
+class LubricantViewSet(viewsets.ModelViewSet):
+    queryset = Lubricant.objects.all()
+    serializer_class = LubricantSerializer
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
+            permission_classes = [IsAdminRole]
+        else:
             permission_classes = [permissions.IsAuthenticated]
+        return [permission() for permission in permission_classes]
+
+    def get_queryset(self):
+        active = Q(machine_usages__machine__decommissioned_at__isnull=True)
+        active_alternative = Q(alternative_usages__machine__decommissioned_at__isnull=True)
+        queryset = Lubricant.objects.prefetch_related('aliases').annotate(
+            machine_count=Count('machine_usages__machine', filter=active, distinct=True),
+            alternative_machine_count=Count('alternative_usages__machine', filter=active_alternative, distinct=True),
+        )
+        query = self.request.query_params.get('q')
+        if query:
+            normalized = normalize_lubricant_name(query)
+            queryset = queryset.filter(
+                Q(normalized_name__startswith=normalized) | Q(aliases__normalized_alias__startswith=normalized)
+            ).distinct()
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def machines(self, request, pk=None):
+        # Reverse lookup through the indexed catalog foreign keys instead of a LIKE scan over free text
+        lubricant = self.get_object()
+        usages = scope_queryset(
+            MachineLubricant.objects.filter(machine__decommissioned_at__isnull=True),
+            request.user,
+            section_field='machine__section',
+            location_field='machine__location_code',
+        )
+        if request.query_params.get('include_alternatives') in ('1', 'true'):
+            usages = usages.filter(Q(lubricant=lubricant) | Q(alternative_lubricant=lubricant))
+        else:
+            usages = usages.filter(lubricant=lubricant)
+
+        rows = usages.order_by('machine__machine_code', 'row_number').values(
+            'machine_id',
+            'machine__machine_code',
+            'machine__machine_name',
+            'machine__section',
+            'machine__location_code',
+            'row_number',
+            'lubricant_id',
+        )
+        results = [
+            {
+                'id': row['machine_id'],
+                'machine_code': row['machine__machine_code'],
+                'machine_name': row['machine__machine_name'],
+                'section': row['machine__section'],
+                'location_code': row['machine__location_code'],
+                'row_number': row['row_number'],
+                'usage': 'primary' if row['lubricant_id'] == lubricant.id else 'alternative',
+            }
+            for row in rows
+        ]
+        return Response({"lubricant": lubricant.name, "count": len({r['id'] for r in results}), "machines": results})
+
+class LocationViewSet(viewsets.ModelViewSet):
+    # Listed in tree order (by path); ?within=<id> limits to a subtree, ?parent=<id>|root to one level
+    queryset = Location.objects.all()
+    serializer_class = LocationSerializer
+
+    def get_permissions(self):
+        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+            permission_classes = [IsAdminRole]
         else:
             permission_classes = [permissions.IsAuthenticated]
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if params.get('within'):
+            node = Location.objects.filter(pk=params['within']).first() if params['within'].isdigit() else None
+            queryset = queryset.filter(**node.subtree_filter()) if node else queryset.none()
+        if params.get('parent') == 'root':
+            queryset = queryset.filter(parent__isnull=True)
+        elif params.get('parent'):
+            queryset = queryset.filter(parent_id=params['parent']) if params['parent'].isdigit() else queryset.none()
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ['list', 'retrieve']:
+            context['rollups'] = location_rollups(self.request.user, scope_key=scope_key(self.request.user))
+        return context
+
+    def perform_update(self, serializer):
+        location = serializer.save()
+        sync_location_machines(location)
+
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response({"error": "Move or delete the child locations first."}, status=status.HTTP_409_CONFLICT)
+
+class ArchivedMachineViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = ArchivedMachine.objects.all()
+    serializer_class = ArchivedMachineSerializer
+
+    def get_permissions(self):
+        if self.action == 'restore':
+            permission_classes = [IsAdminRole]
+        else:
+            permission_classes = [permissions.IsAuthenticated]
+        return [permission() for permission in permission_classes]
+
+    def get_queryset(self):
+        queryset = scope_queryset(super().get_queryset(), self.request.user)
+        params = self.request.query_params
+        for field in ('section', 'location_code', 'original_id'):
+            if params.get(field):
+                queryset = queryset.filter(**{field: params[field]})
+        if params.get('machine_code'):
+            queryset = queryset.filter(machine_code__istartswith=params['machine_code'])
+        return queryset
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        archived = self.get_object()
+        try:
+            machine = restore_machine(archived)
+        except IntegrityError as e:
+            return Response({"error": f"Cannot restore machine: {str(e)}"}, status=status.HTTP_409_CONFLICT)
+        return Response(MachineRegistrationSerializer(machine).data, status=status.HTTP_201_CREATED)
+
+def reading_window(params):
+    # start/end as ISO 8601; the last 24 hours by default
+    try:
+        # parse_datetime raises ValueError for well-formed but impossible dates (2026-02-30)
+        end = parse_datetime(params['end']) if params.get('end') else timezone.now()
+        start = parse_datetime(params['start']) if params.get('start') else end - timedelta(hours=24)
+        if start is None or end is None:
+            raise ValueError
+        start, end = (timezone.make_aware(t) if timezone.is_naive(t) else t for t in (start, end))
+    except (ValueError, OverflowError):
+        raise ReadingError("start and end must be ISO 8601 datetimes")
+    if start >= end:
+        raise ReadingError("start must be before end")
+    return start, end
+
+class MachineReadingViewSet(viewsets.ViewSet):
+    """
+    POST a list of {machine, metric, value, recorded_at} (or {"readings": [...]})
+    to append readings; per-machine series are at machines/<id>/readings/.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def create(self, request):
+        rows = request.data.get('readings') if isinstance(request.data, dict) else request.data
+        try:
+            ingested = ingest_readings(rows, request.user)
+        except ReadingError as e:
+            return Response({"error": e.message, "errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"ingested": ingested}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='out-of-spec')
+    def out_of_spec(self, request):
+        metric = request.query_params.get('metric')
+        if metric and metric not in READING_METRICS:
+            return Response({"error": f"metric must be one of: {', '.join(sorted(READING_METRICS))}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start, end = reading_window(request.query_params)
+        except ReadingError as e:
+            return Response({"error": e.message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(out_of_spec_counts(request.user, start, end, metric))
+
+def attachment_error(error):
+    body = {"error": error.message}
+    response = Response(body, status=error.status)
+    if error.offset is not None:
+        body["received"] = error.offset
+        response['Upload-Offset'] = str(error.offset)
+    return response
+
+def serve_file(request, path, size, content_type, etag, filename=None, inline=False):
+    # Stored files never change, so the hash is a strong validator
+    etag = f'"{etag}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        prefix = get_attachment_setting('ACCEL_REDIRECT_PREFIX')
+        try:
+            byte_range = None if prefix else parse_range(request.headers.get('Range'), size)
+        except AttachmentError as e:
+            response = HttpResponse(status=e.status)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if prefix:
+            # The front-end server streams the file (and handles ranges); this worker is freed at once
+            relative = os.path.relpath(path, get_attachment_setting('ROOT')).replace(os.sep, '/')
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative
+        elif byte_range is None:
+            # FileResponse hands the file to the server's sendfile wrapper where there is one
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(size)
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(iter_file(path, start, end - start + 1), status=206, content_type=content_type)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, max-age=86400'
+    response['X-Content-Type-Options'] = 'nosniff'
+    if filename and response.status_code != 304:
+        response['Content-Disposition'] = content_disposition_header(not inline, filename)
+    return response
+
+class MachineAttachmentViewSet(viewsets.ModelViewSet):
+    # Files are added through attachment-uploads; here they are listed, renamed, downloaded and removed
+    queryset = MachineAttachment.objects.select_related('blob')
+    serializer_class = MachineAttachmentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'patch', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        queryset = scope_queryset(
+            super().get_queryset(), self.request.user, 'machine__section', 'machine__location_code'
+        )
+        params = self.request.query_params
+        if params.get('machine'):
+            queryset = queryset.filter(machine_id=params['machine'])
+        if params.get('kind'):
+            queryset = queryset.filter(kind=params['kind'])
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        attachment = self.get_object()
+        blob = attachment.blob
+        inline = request.query_params.get('inline') == '1' and blob.content_type in INLINE_TYPES
+        return serve_file(
+            request, blob_path(blob.sha256), blob.size, blob.content_type, blob.sha256,
+            filename=attachment.filename, inline=inline,
+        )
+
+    @action(detail=True, methods=['get'])
+    def thumbnail(self, request, pk=None):
+        blob = self.get_object().blob
+        if blob.thumbnail_status != AttachmentBlob.THUMBNAIL_READY:
+            return Response({"error": "No thumbnail", "thumbnail_status": blob.thumbnail_status}, status=404)
+        path = thumbnail_path(blob.sha256)
+        return serve_file(request, path, os.path.getsize(path), 'image/jpeg', f'{blob.sha256}-thumb')
+
+class AttachmentUploadViewSet(viewsets.GenericViewSet):
+    """
+    Resumable uploads: POST {machine, filename, size, kind[, sha256]} opens one,
+    each PATCH appends the raw request body at the Upload-Offset header, and
+    GET/HEAD reports the offset to resume from. The PATCH that completes the
+    file returns the new attachment (201), or 202 when the file is stored in
+    the background; GET then shows the attachment once it is.
+    """
+    queryset = AttachmentUpload.objects.all()
+    serializer_class = AttachmentUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        machine = data['machine']
+        if not can_access(request.user, machine.section, machine.location_code):
+            raise exceptions.PermissionDenied("You do not have access to this section and location.")
+        try:
+            upload, attachment = start_upload(
+                machine, request.user, data['filename'], data['size'], data.get('kind', MachineAttachment.OTHER),
+                sha256=data.get('sha256'),
+            )
+        except AttachmentError as e:
+            return attachment_error(e)
+        if attachment is not None:
+            return Response({"attachment": MachineAttachmentSerializer(attachment).data}, status=status.HTTP_201_CREATED)
+        response = Response(self.get_serializer(upload).data, status=status.HTTP_201_CREATED)
+        response['Upload-Offset'] = str(upload.received)
+        return response
+
+    def retrieve(self, request, pk=None):
+        upload = self.get_object()
+        response = Response(self.get_serializer(upload).data)
+        response['Upload-Offset'] = str(upload.received)
+        return response
+
+    def partial_update(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({"error": "Send the chunk as the request body with Upload-Offset and Content-Length headers"}, status=status.HTTP_400_BAD_REQUEST)
+        # request.data is never touched, so the body is read straight from the socket instead of being buffered
+        stream = request.stream if length else None
+        try:
+            received, attachment = append_chunk(upload, offset, length, stream)
+        except AttachmentError as e:
+            return attachment_error(e)
+        if attachment is not None:
+            return Response({"attachment": MachineAttachmentSerializer(attachment).data}, status=status.HTTP_201_CREATED)
+        if upload.completed_at is not None:
+            response = Response(self.get_serializer(upload).data, status=status.HTTP_202_ACCEPTED)
+        else:
+            response = Response({"id": upload.pk, "received": received, "size": upload.size})
+        response['Upload-Offset'] = str(received)
+        return response
+
+    def destroy(self, request, pk=None):
+        abort_upload(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def machine_autocomplete(request):
+    query = request.query_params.get('q', '').strip()
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    if not query:
+        return Response([])
+
+    # The in-memory index is fleet-wide, so scoped users query the database instead
+    results = machine_typeahead.search(query, limit=limit) if get_user_scopes(request.user) is None else None
+    if results is None:
+        # Index still building or fleet too large for it: word-prefix search over the normalized
+        # search columns (GIN-indexed on PostgreSQL), so Arabic/Persian spellings match as in the index
+        results = list(
+            search_machines(scope_queryset(MachineRegistration.objects.all(), request.user), query)
+            .values('id', 'machine_code', 'machine_name', 'machine_serial')[:limit]
+        )
+    return Response(results)
+
+async def machine_events(request):
+    # Server-sent events of machine changes; plain async view so ASGI servers can hold many idle connections
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        auth = await sync_to_async(CustomJWTAuthentication().authenticate)(request)
+    except (exceptions.AuthenticationFailed, exceptions.PermissionDenied) as e:
+        return JsonResponse({"error": str(e.detail)}, status=401)
+    if auth is None:
+        return JsonResponse({"error": "Authentication credentials were not provided."}, status=401)
+
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('cursor')
+    try:
+        cursor = int(cursor) if cursor not in (None, '') else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+    user = auth[0]
+    if isinstance(request, ASGIRequest):
+        stream = stream_events_async(cursor, user)
+    else:
+        stream = stream_events_sync(cursor, user)
+
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def export_version(machine):
+    # updated_at moves on every save, including nested lubricant edits, so it identifies the rendered content
+    return f'{machine.pk}:{machine.updated_at.timestamp()}'
+
+def export_rejected(error):
+    response = Response({"error": error.message}, status=error.status)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def export_machine_doc(request, pk):
     try:
-        machine = MachineRegistration.objects.get(pk=pk)
+        machine = scope_queryset(MachineRegistration.objects.all(), request.user).get(pk=pk)
     except MachineRegistration.DoesNotExist:
         return Response({"error": "Machine not found"}, status=404)
 
@@ -136,58 +780,66 @@ def export_machine_doc(request, pk):
     if not template_path:
         return Response({"error": "Template file not found"}, status=500)
 
-    try:
+    def render_doc():
+        # Imported on first use so startup doesn't pay for the export stack
+        from docx import Document
+
         doc = Document(template_path)
-    except Exception as e:
-        return Response({"error": f"Error loading template: {str(e)}"}, status=500)
-
-    # Prepare data replacements
-    replacements = {}
-    for field in machine._meta.fields:
-        key = f"${{{field.name}}}" # e.g. ${machine_code}
-        value = getattr(machine, field.name)
-        # Handle date objects
-        if value is None:
-            value = ""
-        else:
-            value = str(value)
-        replacements[key] = value
-
-    # Helper to replace text in runs to preserve formatting better
-    # Simple text replacement in paragraphs
-    def process_paragraph(paragraph):
-        if not paragraph.text:
-            return
+
+        # Prepare data replacements
+        replacements = {}
+        for field in machine._meta.fields:
+            key = f"${{{field.name}}}" # e.g. ${machine_code}
+            value = getattr(machine, field.name)
+            # Handle date objects
+            if value is None:
+                value = ""
+            else:
+                value = str(value)
+            replacements[key] = value
+
+        # Helper to replace text in runs to preserve formatting better
+        # Simple text replacement in paragraphs
+        def process_paragraph(paragraph):
+            if not paragraph.text:
+                return
         
-        # Check if any key is present
-        text = paragraph.text
-        updated = False
-        for key, value in replacements.items():
-            if key in text:
-                text = text.replace(key, value)
-                updated = True
+            # Check if any key is present
+            text = paragraph.text
+            updated = False
+            for key, value in replacements.items():
+                if key in text:
+                    text = text.replace(key, value)
+                    updated = True
         
-        if updated:
-            paragraph.text = text
-
-    # Iterate paragraphs
-    for p in doc.paragraphs:
-        process_paragraph(p)
-
-    # Iterate tables
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for p in cell.paragraphs:
-                    process_paragraph(p)
+            if updated:
+                paragraph.text = text
+
+        # Iterate paragraphs
+        for p in doc.paragraphs:
+            process_paragraph(p)
+
+        # Iterate tables
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for p in cell.paragraphs:
+                        process_paragraph(p)
                     
-    # Save to buffer
-    f = BytesIO()
-    doc.save(f)
-    f.seek(0)
-    
+        # Save to buffer
+        f = BytesIO()
+        doc.save(f)
+        return f.getvalue()
+
+    try:
+        content = admitted_render('docx', export_version(machine), request.user, render_doc)
+    except ExportRejected as e:
+        return export_rejected(e)
+    except Exception as e:
+        return Response({"error": f"Error generating document: {str(e)}"}, status=500)
+
     filename = f"Machine_{machine.machine_code}.docx"
-    response = HttpResponse(f.read(), content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+    response = HttpResponse(content, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
 
@@ -195,21 +847,28 @@ def export_machine_doc(request, pk):
 @permission_classes([IsAuthenticated])
 def export_machine_pdf(request, pk):
     try:
-        machine = MachineRegistration.objects.get(pk=pk)
+        machine = scope_queryset(MachineRegistration.objects.all(), request.user).get(pk=pk)
     except MachineRegistration.DoesNotExist:
         return Response({"error": "Machine not found"}, status=404)
 
-    try:
+    # Imported on first use so startup doesn't pay for the export stack
+    from .pdf_utils import fill_machine_pdf
+
+    def render_pdf():
         # Prepare data for PDF
         data = MachineRegistrationSerializer(machine).data
-        
-        pdf_stream = fill_machine_pdf(data)
-        
+        return fill_machine_pdf(data).read()
+
+    try:
+        content = admitted_render('pdf', export_version(machine), request.user, render_pdf)
+
         filename = f"Machine_{machine.machine_code}.pdf"
-        response = HttpResponse(pdf_stream.read(), content_type='application/pdf')
+        response = HttpResponse(content, content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
+    except ExportRejected as e:
+        return export_rejected(e)
     except Exception as e:
         print(f"Error generating PDF: {e}")
         return Response({"error": f"Error generating PDF: {str(e)}"}, status=500)
@@ -0,0 +1,54 @@
+import { useEffect, useRef, useState } from "react";
+
+// Applies one server-sent machine event to a list of machines.
+// "created" and "updated" are both upserts: events for the same machine may be
+// collapsed server-side, so a replay can report a new machine as "updated".
+export const applyMachineEvent = (machines, event) => {
+  if (event.action === "deleted") {
+    return machines.filter((m) => m.id !== event.id);
+  }
+  const index = machines.findIndex((m) => m.id === event.id);
+  if (index === -1) {
+    return [...machines, event.machine];
+  }
+  const next = [...machines];
+  next[index] = event.machine;
+  return next;
+};
+
+// Subscribes to /api/machines/events/ and patches local state instead of
+// refetching the whole list. EventSource reconnects on its own and resumes
+// from the last event id; `onReset` is called when the server can't replay
+// the gap and a full refetch is needed.
+const useMachineEvents = (setMachines, onReset) => {
+  const [connected, setConnected] = useState(false);
+  const onResetRef = useRef(onReset);
+  onResetRef.current = onReset;
+
+  useEffect(() => {
+    if (typeof EventSource === "undefined") {
+      return undefined;
+    }
+    const source = new EventSource("/api/machines/events/", {
+      withCredentials: true,
+    });
+
+    source.addEventListener("ready", () => setConnected(true));
+    source.addEventListener("machine", (e) => {
+      const event = JSON.parse(e.data);
+      setMachines((machines) => applyMachineEvent(machines, event));
+    });
+    source.addEventListener("reset", () => {
+      if (onResetRef.current) {
+        onResetRef.current();
+      }
+    });
+    source.onerror = () => setConnected(false);
+
+    return () => source.close();
+  }, [setMachines]);
+
+  return connected;
+};
+
+export default useMachineEvents;
@@ -24,6 +24,8 @@ import {
 } from "lucide-react";
 import { motion } from "framer-motion";
 import axios from "axios";
+import useMachineEvents from "../hooks/useMachineEvents";
+import { decodeColumnar } from "../utils/columnar";
 
 const Dashboard = () => {
   const [machines, setMachines] = useState([]);
@@ -33,11 +35,15 @@ const Dashboard = () => {
     fetchMachines();
   }, []);
 
+  useMachineEvents(setMachines, () => fetchMachines());
+
   const fetchMachines = async () => {
     try {
       const response = await axios.get("/api/machines/", {
         withCredentials: true,
+        params: { format: "columnar" },
       });
+      response.data = decodeColumnar(response.data);
       setMachines(response.data);
       setLoading(false);
     } catch (error) {
@@ -15,6 +15,8 @@ import {
 } from "lucide-react";
 import axios from "axios";
 import { motion, AnimatePresence } from "framer-motion";
+import useMachineEvents from "../hooks/useMachineEvents";
+import { decodeColumnar } from "../utils/columnar";
 
 // Form Section Component
 const FormSection = ({ title, children }) => (
@@ -176,11 +178,16 @@ const MachineList = () => {
     fetchMachines();
   }, []);
 
+  // Live updates; while connected, edits arrive as events instead of a full refetch
+  const eventsConnected = useMachineEvents(setMachines, () => fetchMachines());
+
   const fetchMachines = async () => {
     try {
       const response = await axios.get("/api/machines/", {
         withCredentials: true,
+        params: { format: "columnar" },
       });
+      response.data = decodeColumnar(response.data);
       // Ensure response.data is an array
       if (Array.isArray(response.data)) {
         setMachines(response.data);
@@ -258,7 +265,9 @@ const MachineList = () => {
             "X-CSRFToken": csrfToken,
           },
         });
-        fetchMachines();
+        if (!eventsConnected) {
+          fetchMachines();
+        }
       } catch (error) {
         console.error("Error deleting machine:", error);
         alert("Failed to delete machine");
@@ -318,7 +327,9 @@ const MachineList = () => {
         alert("Machine registered successfully!");
       }
       setShowModal(false);
-      fetchMachines();
+      if (!eventsConnected) {
+        fetchMachines();
+      }
       setFormData(initialFormState);
     } catch (error) {
       console.error("Error saving machine:", error);
@@ -351,6 +362,12 @@ const MachineList = () => {
       link.parentNode.removeChild(link);
     } catch (error) {
       console.error(`Error exporting machine as ${type}:`, error);
+      const status = error.response?.status;
+      if (status === 429 || status === 503) {
+        const retryAfter = error.response.headers["retry-after"];
+        alert(`Export service is busy. Please try again in ${retryAfter || "a few"} seconds.`);
+        return;
+      }
       alert(`Failed to export machine document as ${type}.`);
     }
   };
@@ -0,0 +1,37 @@
+// Decodes the columnar list format (?format=columnar) back into an array of
+// plain objects, identical to what the regular JSON list returns.
+export const decodeColumnar = (payload) => {
+  if (!payload || payload.format !== "columnar") {
+    return payload;
+  }
+  const { count, fields, columns } = payload;
+  const dictionaries = payload.dictionaries || {};
+  const nestedFields = payload.nested_fields || {};
+
+  const rows = new Array(count);
+  for (let i = 0; i < count; i++) {
+    rows[i] = {};
+  }
+
+  fields.forEach((field, f) => {
+    const column = columns[f];
+    const dictionary = dictionaries[field];
+    const nested = nestedFields[field];
+    for (let i = 0; i < count; i++) {
+      let value = column[i];
+      if (value !== null && dictionary) {
+        value = dictionary[value];
+      } else if (value !== null && nested) {
+        value = value.map((item) => {
+          const obj = {};
+          nested.forEach((key, k) => {
+            obj[key] = item[k];
+          });
+          return obj;
+        });
+      }
+      rows[i][field] = value;
+    }
+  });
+  return rows;
+};